@@ -1,24 +1,34 @@
 import os
 import io
 import re
-import base64
 import json
-import requests
+import asyncio
 import threading
 import logging
 import traceback
 import hashlib
 import csv
 import zipfile  
+import unicodedata
+import click
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, date, timedelta
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, abort, send_file, Response
+from urllib.parse import quote
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, abort, Response, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
 import documentos
 import ia_core
+import conversor_pdf
+import armazenamento
+import detector_ia
+import cliches
 
 app = Flask(__name__)
 
@@ -100,6 +110,17 @@ login_manager.login_message = "Por favor, faça login para acessar."
 CHAVE_API_GOOGLE = os.environ.get("GEMINI_API_KEY")
 CHAVE_OPENROUTER = os.environ.get("OPENAI_API_KEY")
 
+# Camada compartilhada do cache de respostas da IA (vários workers): 'banco' usa este mesmo banco
+IA_CACHE_COMPARTILHADO = os.environ.get("IA_CACHE_COMPARTILHADO")
+if IA_CACHE_COMPARTILHADO:
+    with app.app_context():
+        ia_core.CACHE_IA.configurar_compartilhado(
+            db.engine.url.render_as_string(hide_password=False) if IA_CACHE_COMPARTILHADO == 'banco' else IA_CACHE_COMPARTILHADO
+        )
+
+POOL_EXTENSAO = None
+TRAVA_POOL_EXTENSAO = threading.Lock()
+
 # =========================================================
 # MODELOS DO BANCO DE DADOS
 # =========================================================
@@ -143,16 +164,28 @@ class Aluno(db.Model):
     status = db.Column(db.String(20), default='Produção') 
     valor = db.Column(db.Float, default=70.0) 
     
-    documentos = db.relationship('Documento', backref='aluno', lazy=True, cascade="all, delete-orphan")
+    documentos = db.relationship('Documento', backref='aluno', lazy=True, cascade="all, delete-orphan", order_by='Documento.data_upload')
     temas = db.relationship('TemaTrabalho', backref='aluno', lazy=True, cascade="all, delete-orphan")
 
 class Documento(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id'), nullable=False)
     nome_arquivo = db.Column(db.String(255), nullable=False)
-    dados_arquivo = db.Column(db.LargeBinary, nullable=False) 
+    # Adiado: listagens só leem os metadados, o conteúdo vem apenas no download
+    dados_arquivo = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    sha256 = db.Column(db.String(64), nullable=True, index=True)
+    tamanho_bytes = db.Column(db.Integer, nullable=True)
+    mime = db.Column(db.String(100), nullable=True)
+    # Modo receita: só o template + dicionário ficam guardados, o arquivo é renderizado no download
+    sob_demanda = db.Column(db.Boolean, default=False)
+    receita = db.deferred(db.Column(db.Text, nullable=True))
     data_upload = db.Column(db.DateTime, default=datetime.utcnow)
 
+class BlobOrfao(db.Model):
+    # Blob que ficou sem Documento: só sai do armazém na varredura, depois da carência
+    sha256 = db.Column(db.String(64), primary_key=True)
+    marcado_em = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 class TemaTrabalho(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     aluno_id = db.Column(db.Integer, db.ForeignKey('aluno.id'), nullable=False)
@@ -171,6 +204,7 @@ class RegistroUso(db.Model):
     data = db.Column(db.DateTime, default=datetime.utcnow)
     modelo_usado = db.Column(db.String(100))
     custo = db.Column(db.Float, default=0.0)
+    custo_evitado = db.Column(db.Float, default=0.0)
 
 class SiteSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -180,21 +214,346 @@ class SiteSettings(db.Model):
     )
     prompt_password = db.Column(db.String(255), nullable=True)
     convert_api_key = db.Column(db.String(255), nullable=True)
+    conversor_pdf = db.Column(db.String(20), default='convertapi')
+    modo_documentos = db.Column(db.String(20), default='completo')
     modelos_ativos = db.Column(db.Text, nullable=True)
+    detector_ia_margem = db.Column(db.Integer, default=0)
+    detector_ia_pesos = db.Column(db.Text, nullable=True)
+    lexico_cliches = db.Column(db.Text, nullable=True)
+
+class AmostraDetectorIA(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    texto = db.Column(db.Text, nullable=False)
+    porcentagem = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.DateTime, default=datetime.utcnow)
 
 class GeracaoTask(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     status = db.Column(db.String(20), default='Pendente') 
     resultado = db.Column(db.Text, nullable=True) 
+    parcial = db.Column(db.Text, nullable=True)
     modelo_utilizado = db.Column(db.String(100), nullable=True)
     erro = db.Column(db.Text, nullable=True)
     data_criacao = db.Column(db.DateTime, default=datetime.utcnow)
 
+@app.template_filter('tamanho_legivel')
+def tamanho_legivel(total_bytes):
+    if total_bytes is None:
+        return ''
+    for unidade in ['B', 'KB', 'MB']:
+        if total_bytes < 1024:
+            return f"{total_bytes:.0f} {unidade}" if unidade == 'B' else f"{total_bytes:.1f} {unidade}"
+        total_bytes /= 1024
+    return f"{total_bytes:.1f} GB"
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
+# =========================================================
+# ARMAZÉM DE ARQUIVOS (DOCUMENTOS FORA DO BANCO)
+# =========================================================
+ARMAZEM = armazenamento.obter_armazem()
+
+def criar_documento(aluno_id, nome_arquivo, dados, receita=None):
+    """Grava o conteúdo no armazém (deduplicado por SHA-256) e devolve o Documento só com os metadados."""
+    mime = armazenamento.detectar_mime(nome_arquivo)
+    if receita:
+        return Documento(aluno_id=aluno_id, nome_arquivo=nome_arquivo, dados_arquivo=b'', sha256=armazenamento.calcular_sha256(dados), 
+                         tamanho_bytes=len(dados), mime=mime, sob_demanda=True, receita=receita)
+    if ARMAZEM is None:
+        sha256 = armazenamento.calcular_sha256(dados)
+        dados_inline = dados
+    else:
+        sha256 = armazenamento.calcular_sha256(dados)
+        # Tira a marca de órfão antes de gravar: se a varredura está apagando este blob,
+        # o DELETE espera o commit dela e o guardar abaixo grava o arquivo de novo
+        BlobOrfao.query.filter_by(sha256=sha256).delete(synchronize_session=False)
+        ARMAZEM.guardar(dados, mime)
+        dados_inline = b''
+    return Documento(aluno_id=aluno_id, nome_arquivo=nome_arquivo, dados_arquivo=dados_inline, sha256=sha256, tamanho_bytes=len(dados), mime=mime)
+
+def tamanho_no_banco(doc_id):
+    return db.session.query(db.func.length(Documento.dados_arquivo)).filter(Documento.id == doc_id).scalar() or 0
+
+def blob_ausente(doc):
+    # Documentos migrados ou criados com armazém têm b'' na coluna: sem o blob não há o que servir
+    logging.error(f"Blob {doc.sha256} do documento {doc.id} não está no armazém e a coluna dados_arquivo está vazia.")
+    return Exception(f"O arquivo '{doc.nome_arquivo}' não foi encontrado no armazenamento.")
+
+def ler_conteudo_documento(doc):
+    if doc.sob_demanda:
+        return materializar_documento(doc)
+    # Documentos já migrados vivem no armazém; os antigos continuam na coluna dados_arquivo
+    if ARMAZEM is not None and doc.sha256:
+        try:
+            return ARMAZEM.ler(doc.sha256)
+        except armazenamento.BlobNaoEncontrado:
+            if not doc.dados_arquivo:
+                raise blob_ausente(doc)
+    return doc.dados_arquivo
+
+# =========================================================
+# MODO RECEITA (DOCUMENTOS RENDERIZADOS SOB DEMANDA)
+# =========================================================
+MODOS_DOCUMENTOS = {
+    "completo": "Arquivo Completo (Padrão)",
+    "receita": "Só a Receita (Renderiza no Download)"
+}
+TEMPLATES_GUARDADOS = set()
+
+def documentos_sob_demanda():
+    config = SiteSettings.query.first()
+    return bool(config and config.modo_documentos == 'receita')
+
+def guardar_template_original(caminho_template):
+    # Com armazém, a versão exata do template fica guardada: trocar o arquivo no deploy não quebra receitas antigas
+    hash_template, dados = documentos.identificar_template(caminho_template)
+    if hash_template in TEMPLATES_GUARDADOS:
+        return
+    try:
+        ARMAZEM.guardar(dados or documentos.ler_bytes_template(caminho_template), armazenamento.detectar_mime(caminho_template))
+        TEMPLATES_GUARDADOS.add(hash_template)
+    except Exception as e:
+        logging.error(f"Falha ao guardar o template {caminho_template} no armazém: {e}")
+
+def receita_documento(motor, caminho_template, dicionario_dados):
+    """Receita para o criar_documento quando o modo receita está ligado; None no modo completo."""
+    if not documentos_sob_demanda():
+        return None
+    if ARMAZEM is not None:
+        guardar_template_original(caminho_template)
+    return documentos.criar_receita(motor, caminho_template, dicionario_dados)
+
+def buscar_template_guardado(hash_template):
+    if ARMAZEM is None:
+        return None
+    try:
+        return ARMAZEM.ler(hash_template)
+    except armazenamento.BlobNaoEncontrado:
+        return None
+
+def materializar_documento(doc):
+    dados = documentos.materializar_receita(doc.receita, app.root_path, buscar_template_guardado)
+    receita = documentos.atualizar_versao_receita(doc.receita)
+    if receita is not None:
+        # Receita de uma versão antiga do motor: o arquivo agora é o do motor atual, e os
+        # metadados passam a descrevê-lo em vez de prometer bytes que ninguém mais gera
+        sha256 = armazenamento.calcular_sha256(dados)
+        if sha256 != doc.sha256:
+            logging.error(f"Documento {doc.id} re-renderizado com a versão atual do motor: sha256 {doc.sha256} -> {sha256}, {doc.tamanho_bytes} -> {len(dados)} bytes.")
+        doc.receita = receita
+        doc.sha256 = sha256
+        doc.tamanho_bytes = len(dados)
+        db.session.commit()
+    return dados
+
+def ler_pedacos_do_banco(doc_id, inicio=0):
+    # substr() traz da coluna só o pedaço pedido, nunca o arquivo inteiro.
+    # Roda fora do pedido (durante o streaming), por isso abre o próprio contexto a cada pedaço.
+    posicao = inicio
+    while True:
+        with app.app_context():
+            pedaco = db.session.query(db.func.substr(Documento.dados_arquivo, posicao + 1, armazenamento.TAMANHO_PEDACO)).filter(Documento.id == doc_id).scalar()
+        if not pedaco:
+            break
+        posicao += len(pedaco)
+        yield bytes(pedaco)
+
+def fluxo_documento(doc):
+    doc_id, sha256 = doc.id, doc.sha256
+
+    def abrir(inicio):
+        if ARMAZEM is not None and sha256 and ARMAZEM.existe(sha256):
+            return ARMAZEM.ler_pedacos(sha256, inicio)
+        return ler_pedacos_do_banco(doc_id, inicio)
+
+    return armazenamento.FluxoBlob(abrir)
+
+def responder_arquivo(fluxo, tamanho, nome_arquivo, mime=None, etag=None, modificado=None):
+    resposta = Response(fluxo, mimetype=mime or armazenamento.detectar_mime(nome_arquivo), direct_passthrough=True)
+    resposta.content_length = tamanho
+    resposta.headers.set('Content-Disposition', 'attachment', **opcoes_nome_anexo(nome_arquivo))
+    
+    # O conteúdo nunca muda para o mesmo hash, então ele serve de ETag forte.
+    # no-cache faz o navegador revalidar sempre e receber 304 quando já tem o arquivo.
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    if etag:
+        resposta.set_etag(etag)
+    if modificado:
+        resposta.last_modified = modificado
+        
+    return resposta.make_conditional(request, accept_ranges=True, complete_length=tamanho)
+
+def responder_documento(doc, nome_arquivo=None):
+    if doc.sob_demanda:
+        # Renderizado agora (ou vindo do cache de renderização), servido da memória em pedaços
+        dados = materializar_documento(doc)
+        fluxo = armazenamento.FluxoBlob(lambda inicio: (dados[i:i + armazenamento.TAMANHO_PEDACO] for i in range(inicio, len(dados), armazenamento.TAMANHO_PEDACO)))
+        return responder_arquivo(fluxo, len(dados), nome_arquivo or doc.nome_arquivo, doc.mime, armazenamento.calcular_sha256(dados), doc.data_upload)
+
+    if ARMAZEM is not None and doc.sha256 and not ARMAZEM.existe(doc.sha256) and not tamanho_no_banco(doc.id):
+        raise blob_ausente(doc)
+    tamanho = doc.tamanho_bytes
+    if tamanho is None:
+        tamanho = tamanho_no_banco(doc.id)
+    return responder_arquivo(fluxo_documento(doc), tamanho, nome_arquivo or doc.nome_arquivo, doc.mime, doc.sha256, doc.data_upload)
+
+# =========================================================
+# TOKENS DE DOWNLOAD (NO LUGAR DE BASE64 DENTRO DO JSON/HTML)
+# =========================================================
+DOWNLOAD_TOKEN_TTL = int(os.environ.get('DOWNLOAD_TOKEN_TTL', 900))
+ASSINADOR_DOWNLOAD = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='download-arquivo')
+# Avulsos ficam numa área própria, sem despejo por tamanho: o link vale até o token vencer
+DOWNLOADS_TEMPORARIOS = armazenamento.obter_area_temporaria(DOWNLOAD_TOKEN_TTL)
+
+def url_download_documento(doc):
+    token = ASSINADOR_DOWNLOAD.dumps({'origem': 'doc', 'id': doc.id, 'nome': doc.nome_arquivo})
+    return url_for('baixar_arquivo', token=token)
+
+def url_download_temporario(nome_arquivo, dados):
+    # Sem cliente para guardar: o arquivo fica na área temporária pelo mesmo prazo do token
+    chave = DOWNLOADS_TEMPORARIOS.guardar(dados)
+    token = ASSINADOR_DOWNLOAD.dumps({'origem': 'temp', 'chave': chave, 'nome': nome_arquivo})
+    return url_for('baixar_arquivo', token=token)
+
+def opcoes_nome_anexo(nome_arquivo):
+    # Mesmo tratamento do send_file: nomes com acento vão também em filename* (RFC 6266)
+    try:
+        nome_arquivo.encode('ascii')
+        return {'filename': nome_arquivo}
+    except UnicodeEncodeError:
+        simples = unicodedata.normalize('NFKD', nome_arquivo).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simples, 'filename*': f"UTF-8''{quote(nome_arquivo, safe='!#$&+^`|~')}"}
+
+BLOB_CARENCIA = timedelta(minutes=int(os.environ.get('BLOB_CARENCIA_MIN', 10)))
+INTERVALO_VARREDURA_BLOBS = 300
+ULTIMA_VARREDURA_BLOBS = {"em": 0.0}
+
+def marcar_blobs_orfaos(hashes):
+    """Na mesma transação que apaga os Documentos: os blobs viram candidatos, nada sai do armazém agora."""
+    if ARMAZEM is None:
+        return
+    for sha256 in set(h for h in hashes if h):
+        db.session.merge(BlobOrfao(sha256=sha256, marcado_em=datetime.utcnow()))
+
+def varrer_blobs_orfaos(lote=100):
+    """
+    Remove os blobs marcados há mais que a carência e ainda sem Documento. Cada remoção
+    acontece com a marca apagada e não commitada: um criar_documento do mesmo conteúdo
+    fica esperando o commit e então grava o blob de novo (ou, se chegou antes, a marca
+    some e o blob fica). A carência cobre quem já tinha gravado e ainda não commitou.
+    Devolve (candidatos analisados, blobs removidos).
+    """
+    if ARMAZEM is None:
+        return 0, 0
+    limite = datetime.utcnow() - BLOB_CARENCIA
+    candidatos = [h for (h,) in db.session.query(BlobOrfao.sha256).filter(BlobOrfao.marcado_em < limite).limit(lote)]
+    db.session.commit()
+    removidos = 0
+    for sha256 in candidatos:
+        if not BlobOrfao.query.filter(BlobOrfao.sha256 == sha256, BlobOrfao.marcado_em < limite).delete(synchronize_session=False):
+            db.session.rollback()
+            continue
+        if not Documento.query.filter_by(sha256=sha256).first():
+            try:
+                ARMAZEM.remover(sha256)
+                removidos += 1
+            except Exception as e:
+                logging.error(f"Falha ao remover blob {sha256}: {e}")
+                db.session.rollback()
+                continue
+        db.session.commit()
+    return len(candidatos), removidos
+
+def varrer_blobs_orfaos_se_preciso():
+    # Oportunista, depois das exclusões; o comando 'varrer-blobs' faz o mesmo via cron
+    agora = datetime.utcnow().timestamp()
+    if ARMAZEM is None or agora - ULTIMA_VARREDURA_BLOBS["em"] < INTERVALO_VARREDURA_BLOBS:
+        return
+    ULTIMA_VARREDURA_BLOBS["em"] = agora
+    try:
+        varrer_blobs_orfaos()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Falha na varredura de blobs órfãos: {e}")
+
+def preencher_metadados_documentos(lote=50):
+    """Calcula sha256/tamanho/mime dos Documentos antigos, um lote por vez para não carregar tudo na memória."""
+    total = 0
+    while True:
+        docs = Documento.query.options(db.undefer(Documento.dados_arquivo)).filter(Documento.sha256.is_(None)).order_by(Documento.id).limit(lote).all()
+        if not docs:
+            break
+            
+        for doc in docs:
+            dados = doc.dados_arquivo or b''
+            doc.sha256 = armazenamento.calcular_sha256(dados)
+            doc.tamanho_bytes = len(dados)
+            doc.mime = doc.mime or armazenamento.detectar_mime(doc.nome_arquivo)
+            
+        db.session.commit()
+        db.session.expunge_all()
+        total += len(docs)
+    return total
+
+@app.cli.command('migrar-blobs')
+@click.option('--lote', default=50, help='Quantidade de documentos movidos por commit.')
+def migrar_blobs(lote):
+    """Move o conteúdo dos Documentos antigos do banco para o armazém configurado em BLOB_STORE."""
+    if ARMAZEM is None:
+        raise click.ClickException("Configure BLOB_STORE=local ou BLOB_STORE=s3 antes de migrar.")
+
+    movidos = 0
+    ultimo_id = 0
+    while True:
+        docs = Documento.query.options(db.undefer(Documento.dados_arquivo)).filter(Documento.id > ultimo_id).order_by(Documento.id).limit(lote).all()
+        if not docs:
+            break
+            
+        for doc in docs:
+            ultimo_id = doc.id
+            if not doc.dados_arquivo:
+                continue
+            doc.mime = doc.mime or armazenamento.detectar_mime(doc.nome_arquivo)
+            doc.sha256 = ARMAZEM.guardar(doc.dados_arquivo, doc.mime)
+            doc.tamanho_bytes = len(doc.dados_arquivo)
+            doc.dados_arquivo = b''
+            movidos += 1
+            
+        db.session.commit()
+        db.session.expunge_all()
+        click.echo(f"{movidos} documentos movidos até o id {ultimo_id}...")
+        
+    click.echo(f"Migração concluída: {movidos} documentos agora estão no armazém.")
+
+@app.cli.command('varrer-blobs')
+def varrer_blobs():
+    """Remove do armazém os blobs sem Documento marcados há mais que BLOB_CARENCIA_MIN minutos."""
+    total = 0
+    while True:
+        analisados, removidos = varrer_blobs_orfaos()
+        total += removidos
+        if analisados < 100:
+            break
+    click.echo(f"Varredura concluída: {total} blobs removidos.")
+
+@app.cli.command('calibrar-detector')
+@click.option('--min-amostras', default=30, help='Mínimo de notas da IA guardadas para calibrar.')
+def calibrar_detector(min_amostras):
+    """Ajusta os pesos do detector local às notas que a IA deu aos trechos escalados."""
+    amostras = [(a.texto, a.porcentagem) for a in AmostraDetectorIA.query.order_by(AmostraDetectorIA.id.desc()).limit(5000)]
+    if len(amostras) < min_amostras:
+        raise click.ClickException(f"Só há {len(amostras)} amostras (mínimo {min_amostras}). Aumente a margem de escalonamento por um tempo para coletar mais.")
+
+    pesos, erro_medio = detector_ia.calibrar(amostras)
+    config = SiteSettings.query.first()
+    config.detector_ia_pesos = json.dumps(pesos)
+    db.session.commit()
+    click.echo(f"Detector calibrado com {len(amostras)} amostras: erro médio de {erro_medio:.1f} pontos contra a IA.")
+
 # =========================================================
 # PROMPT BASE DE ELITE
 # =========================================================
@@ -263,6 +622,84 @@ with app.app_context():
     except Exception: 
         db.session.rollback()
         
+    try: 
+        db.session.execute(db.text("ALTER TABLE site_settings ADD COLUMN conversor_pdf VARCHAR(20) DEFAULT 'convertapi'"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE documento ADD COLUMN sha256 VARCHAR(64)"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE documento ADD COLUMN tamanho_bytes INTEGER"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE documento ADD COLUMN mime VARCHAR(100)"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE documento ADD COLUMN sob_demanda BOOLEAN DEFAULT FALSE"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE documento ADD COLUMN receita TEXT"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE site_settings ADD COLUMN modo_documentos VARCHAR(20) DEFAULT 'completo'"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE site_settings ADD COLUMN detector_ia_margem INTEGER DEFAULT 0"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE site_settings ADD COLUMN detector_ia_pesos TEXT"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE site_settings ADD COLUMN lexico_cliches TEXT"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("CREATE INDEX IF NOT EXISTS ix_documento_sha256 ON documento (sha256)"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE geracao_task ADD COLUMN parcial TEXT"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
+    try: 
+        db.session.execute(db.text("ALTER TABLE registro_uso ADD COLUMN custo_evitado FLOAT DEFAULT 0.0"))
+        db.session.commit()
+    except Exception: 
+        db.session.rollback()
+        
     try: 
         db.session.execute(db.text("ALTER TABLE registro_uso ADD COLUMN custo FLOAT DEFAULT 0.0"))
         db.session.commit()
@@ -291,6 +728,15 @@ with app.app_context():
     except Exception:
         db.session.rollback()
 
+    # Documentos anteriores às colunas de metadados
+    try:
+        preenchidos = preencher_metadados_documentos()
+        if preenchidos:
+            logging.info(f"Metadados calculados para {preenchidos} documentos antigos.")
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Falha ao preencher metadados dos documentos: {e}")
+
     # Criar dados padrão se estiver vazio
     try:
         if not User.query.filter_by(username='admin').first():
@@ -310,6 +756,13 @@ with app.app_context():
     except Exception: 
         db.session.rollback()
 
+# Pré-compila os templates da Extensão para o primeiro pedido não pagar o parse
+for nome_template in ['TEMPLATE_EVIDENCIAS_PARANA.docx', 'TEMPLATE_FICHA_PARANA.docx']:
+    try:
+        documentos.obter_template_compilado(os.path.join(app.root_path, nome_template))
+    except Exception as e:
+        logging.error(f"Falha ao pré-compilar {nome_template}: {e}")
+
 # =========================================================
 # GESTÃO DE MODELOS E BACKGROUND TASKS
 # =========================================================
@@ -326,50 +779,131 @@ TODOS_MODELOS_CONHECIDOS = [
     "x-ai/grok-2-vision"
 ]
 
+LEXICO_CARREGADO = {"texto": None}
+
+def sincronizar_lexico(config=None):
+    """Recompila o léxico de clichês só quando o texto salvo no admin mudou (cada worker confere o seu)."""
+    config = config or SiteSettings.query.first()
+    texto = (config.lexico_cliches if config else None) or ''
+    if texto != LEXICO_CARREGADO["texto"]:
+        cliches.configurar_lexico(texto)
+        LEXICO_CARREGADO["texto"] = texto
+
+@app.before_request
+def atualizar_lexico_do_worker():
+    # Só os POSTs chamam IA ou limpam texto; uma edição feita em outro worker vale a partir do próximo
+    if request.method == 'POST':
+        try:
+            sincronizar_lexico()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Falha ao carregar o léxico de clichês: {e}")
+
+with app.app_context():
+    try:
+        sincronizar_lexico()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Falha ao carregar o léxico de clichês: {e}")
+
 def get_modelos_ativos():
     config = SiteSettings.query.first()
     if config and config.modelos_ativos:
         return [m.strip() for m in config.modelos_ativos.split(',') if m.strip()]
     return ["anthropic/claude-3.5-sonnet", "google/gemini-2.5-pro", "google/gemini-2.5-flash", "meta-llama/llama-3.3-70b-instruct", "qwen/qwen-2.5-72b-instruct"]
 
-def executar_geracao_bg(task_id, prompt_completo, fila_modelos):
+def montar_fila_modelos(modelo_selecionado):
+    # Escolha do usuário na frente; os reservas na ordem do roteador (circuitos abertos por último)
+    return ia_core.ROTEADOR.ordenar(get_modelos_ativos(), preferido=modelo_selecionado)
+
+def registro_uso_ia(modelo, custo, custo_evitado=None):
+    # Acertos do cache de IA entram com custo zero e guardam quanto foi economizado
+    if custo_evitado is None:
+        return RegistroUso(modelo_usado=modelo, custo=custo)
+    return RegistroUso(modelo_usado=f"{modelo} (cache)", custo=0.0, custo_evitado=custo_evitado)
+
+def registrar_gastos_ia(gastos):
+    for modelo, custo in gastos:
+        db.session.add(RegistroUso(modelo_usado=modelo, custo=custo))
+
+def concluir_geracao(task_id, modelo, dicionario, gastos):
     with app.app_context():
-        ultimo_erro = ""
-        modelos_para_tentar = fila_modelos[:2]
+        task_verificar = GeracaoTask.query.get(task_id)
+        if task_verificar and task_verificar.status == 'Cancelado':
+            db.session.rollback()
+            return 
+            
+        registrar_gastos_ia(gastos)
         
-        for modelo in modelos_para_tentar:
-            try:
-                texto_resposta, custo_estimado = ia_core.chamar_ia(prompt_completo, modelo, CHAVE_API_GOOGLE, CHAVE_OPENROUTER)
-                dicionario = ia_core.extrair_dicionario(texto_resposta)
-                
-                tags_preenchidas = sum(1 for v in dicionario.values() if v.strip())
-                
-                if tags_preenchidas < 3: 
-                    raise Exception(f"A IA {modelo} falhou severamente ao preencher as tags.")
-                
-                task_verificar = GeracaoTask.query.get(task_id)
-                if task_verificar and task_verificar.status == 'Cancelado':
-                    db.session.rollback()
-                    return 
-                    
-                novo_registro = RegistroUso(modelo_usado=modelo, custo=custo_estimado)
-                db.session.add(novo_registro)
-                
-                task_verificar.status = 'Concluido'
-                task_verificar.resultado = json.dumps(dicionario)
-                task_verificar.modelo_utilizado = modelo
-                db.session.commit()
-                return
-                
-            except Exception as e:
-                ultimo_erro = str(e)
-                continue
-                
+        task_verificar.status = 'Concluido'
+        task_verificar.resultado = json.dumps(dicionario)
+        task_verificar.modelo_utilizado = modelo
+        db.session.commit()
+
+def marcar_erro_geracao(task_id, ultimo_erro, gastos=()):
+    with app.app_context():
+        registrar_gastos_ia(gastos)
         task_erro = GeracaoTask.query.get(task_id)
         if task_erro and task_erro.status != 'Cancelado':
             task_erro.status = 'Erro'
             task_erro.erro = f"Falha ao processar as IAs. Último erro: {ultimo_erro}"
-            db.session.commit()
+        db.session.commit()
+
+class GeracaoCancelada(ia_core.ChamadaAbortada):
+    pass
+
+def salvar_secoes_parciais(task_id, secoes):
+    """Grava as seções já terminadas para o /status_geracao mostrar. Devolve False se a tarefa foi cancelada."""
+    with app.app_context():
+        task = GeracaoTask.query.get(task_id)
+        if not task or task.status == 'Cancelado':
+            return False
+        task.parcial = json.dumps(secoes)
+        db.session.commit()
+        return True
+
+def validar_dicionario_gerado(modelo, texto_resposta):
+    dicionario = ia_core.extrair_dicionario(texto_resposta)
+    tags_preenchidas = sum(1 for v in dicionario.values() if v.strip())
+    if tags_preenchidas < 3: 
+        raise Exception(f"A IA {modelo} falhou severamente ao preencher as tags.")
+    return dicionario
+
+async def executar_geracao_async(task_id, prompt_completo, fila_modelos):
+    # Corre no event loop do gateway; o banco (síncrono) vai para o executor do loop
+    gastos = []
+    # Com o hedging dois modelos podem estar escrevendo: o parcial mostrado é o do mais adiantado
+    secoes_mostradas = {"total": 0}
+
+    def receptor(modelo):
+        leitor = ia_core.LeitorSecoesIA()
+
+        async def receber(pedaco):
+            # A cada seção fechada o parcial é gravado; cancelar a tarefa interrompe o streaming
+            if leitor.alimentar(pedaco) and len(leitor.secoes) > secoes_mostradas["total"]:
+                secoes_mostradas["total"] = len(leitor.secoes)
+                if not await asyncio.to_thread(salvar_secoes_parciais, task_id, leitor.secoes):
+                    raise GeracaoCancelada()
+        return receber
+
+    try:
+        modelo, dicionario, _ = await ia_core.chamar_ia_com_hedge(
+            prompt_completo, fila_modelos[:2], "geracao", CHAVE_API_GOOGLE, CHAVE_OPENROUTER,
+            validar=validar_dicionario_gerado, ao_receber=receptor, gastos=gastos
+        )
+    except GeracaoCancelada:
+        return
+    except Exception as e:
+        await asyncio.to_thread(marcar_erro_geracao, task_id, str(e), gastos)
+        return
+        
+    await asyncio.to_thread(concluir_geracao, task_id, modelo, dicionario, gastos)
+
+def agendar_geracao(task_id, prompt_completo, fila_modelos):
+    """Entra na fila do gateway de IA: nenhuma thread nova por geração."""
+    futuro = ia_core.GATEWAY.agendar(executar_geracao_async(task_id, prompt_completo, fila_modelos))
+    futuro.add_done_callback(lambda f: not f.cancelled() and f.exception() and logging.error(f"Geração {task_id} abortou: {f.exception()}"))
+    return futuro
 
 # =========================================================
 # ROTAS PÚBLICAS E AUTENTICAÇÃO
@@ -467,8 +1001,8 @@ def api_gerar_gabarito():
         
         if not questoes_fatiadas or len(questoes_fatiadas) < 2:
             try:
-                questoes_fatiadas, custo_parser = ia_core.fatiar_prova_com_ia(texto_prova, CHAVE_API_GOOGLE, CHAVE_OPENROUTER)
-                db.session.add(RegistroUso(modelo_usado="google/gemini-2.5-flash (Parser Ouro)", custo=custo_parser))
+                questoes_fatiadas, custo_parser, custo_evitado = ia_core.fatiar_prova_com_ia(texto_prova, CHAVE_API_GOOGLE, CHAVE_OPENROUTER)
+                db.session.add(registro_uso_ia("google/gemini-2.5-flash (Parser Ouro)", custo_parser, custo_evitado))
                 db.session.commit()
             except Exception as e:
                 return jsonify({"sucesso": False, "erro": f"A prova está inlegível e o Pré-Processador de Inteligência falhou: {str(e)}"})
@@ -725,44 +1259,16 @@ def recalcular_hashes():
 # =========================================================
 # FERRAMENTA: PROJETOS DE EXTENSÃO
 # =========================================================
-@app.route('/projetos_extensao')
-@login_required
-def projetos_extensao():
-    todos_alunos = Aluno.query.filter_by(user_id=current_user.id).order_by(Aluno.nome).all()
-    return render_template('projetos_extensao.html', alunos=todos_alunos)
-
-@app.route('/gerar_extensao', methods=['POST'])
-@login_required
-def gerar_extensao():
-    aluno_id = request.form.get('aluno_id')
-    matricula = request.form.get('matricula', 'Não informada')
-    nome_avulso = request.form.get('nome_avulso', '')
-    curso_avulso = request.form.get('curso_avulso', '')
-    gerar_pdf = request.form.get('gerar_pdf') == 'sim'
-    
-    aluno = Aluno.query.get(aluno_id) if aluno_id else None
-    nome_aluno = aluno.nome if aluno else nome_avulso
-    curso_aluno = aluno.curso if aluno else curso_avulso
-
-    caminho_evidencias = os.path.join(app.root_path, 'TEMPLATE_EVIDENCIAS_PARANA.docx')
-    caminho_ficha = os.path.join(app.root_path, 'TEMPLATE_FICHA_PARANA.docx')
-    
-    if not os.path.exists(caminho_evidencias) or not os.path.exists(caminho_ficha):
-        flash('Erro: Os arquivos TEMPLATE_EVIDENCIAS_PARANA.docx ou TEMPLATE_FICHA_PARANA.docx não foram encontrados no servidor.', 'error')
-        return redirect(url_for('projetos_extensao'))
-
+def detectar_quantidade_datas(caminho_ficha):
+    # O maior DATA_n vem do manifesto do template (calculado uma vez por versão do arquivo)
     quantidade_datas = 30 
     try:
-        with zipfile.ZipFile(caminho_ficha, 'r') as zf:
-            xml_content = zf.read('word/document.xml').decode('utf-8')
-            texto_puro = re.sub(r'<[^>]+>', '', xml_content)
-            texto_limpo = re.sub(r'[\u200b\u200c\u200d\ufeff\xa0\s]', '', texto_puro).upper()
-            numeros = re.findall(r'DATA_?(\d+)', texto_limpo)
-            if numeros:
-                quantidade_datas = max(int(n) for n in numeros)
+        quantidade_datas = documentos.obter_manifesto_template(caminho_ficha)['max_data'] or quantidade_datas
     except Exception as e:
         print(f"Erro ao detectar tags: {e}")
+    return quantidade_datas
 
+def montar_dicionario_extensao(nome_aluno, matricula, curso_aluno, quantidade_datas):
     datas_reversas = []
     agora_utc = datetime.utcnow()
     data_atual = (agora_utc - timedelta(hours=3)).date()
@@ -788,17 +1294,69 @@ def gerar_extensao():
     
     for i in range(quantidade_datas):
         dicionario[f"{{{{DATA_{i+1}}}}}"] = datas_reversas[i].strftime('%d/%m/%Y')
+    return dicionario
+
+def obter_pool_extensao():
+    # Pool de processos da geração em lote. Nada de 'fork': a esta altura o processo já tem
+    # threads (gateway da IA, workers de PDF, locks do cache) e um filho copiado no meio de
+    # um lock travaria. O forkserver parte de um processo limpo que só importa o documentos;
+    # cada filho compila os templates no initializer, antes do primeiro aluno.
+    global POOL_EXTENSAO
+    with TRAVA_POOL_EXTENSAO:
+        if POOL_EXTENSAO is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                contexto = multiprocessing.get_context('forkserver')
+                contexto.set_forkserver_preload(['documentos'])
+            else:
+                contexto = multiprocessing.get_context('spawn')
+            POOL_EXTENSAO = ProcessPoolExecutor(
+                max_workers=int(os.environ.get('EXTENSAO_WORKERS', os.cpu_count() or 2)),
+                mp_context=contexto,
+                initializer=documentos.aquecer_templates,
+                initargs=([os.path.join(app.root_path, 'TEMPLATE_EVIDENCIAS_PARANA.docx'), os.path.join(app.root_path, 'TEMPLATE_FICHA_PARANA.docx')],)
+            )
+        return POOL_EXTENSAO
+
+def descartar_pool_extensao():
+    global POOL_EXTENSAO
+    with TRAVA_POOL_EXTENSAO:
+        if POOL_EXTENSAO is not None:
+            POOL_EXTENSAO.shutdown(wait=False, cancel_futures=True)
+            POOL_EXTENSAO = None
+
+@app.route('/projetos_extensao')
+@login_required
+def projetos_extensao():
+    todos_alunos = Aluno.query.filter_by(user_id=current_user.id).order_by(Aluno.nome).all()
+    return render_template('projetos_extensao.html', alunos=todos_alunos)
+
+@app.route('/gerar_extensao', methods=['POST'])
+@login_required
+def gerar_extensao():
+    aluno_id = request.form.get('aluno_id')
+    matricula = request.form.get('matricula', 'Não informada')
+    nome_avulso = request.form.get('nome_avulso', '')
+    curso_avulso = request.form.get('curso_avulso', '')
+    gerar_pdf = request.form.get('gerar_pdf') == 'sim'
+    
+    aluno = Aluno.query.get(aluno_id) if aluno_id else None
+    nome_aluno = aluno.nome if aluno else nome_avulso
+    curso_aluno = aluno.curso if aluno else curso_avulso
+
+    caminho_evidencias = os.path.join(app.root_path, 'TEMPLATE_EVIDENCIAS_PARANA.docx')
+    caminho_ficha = os.path.join(app.root_path, 'TEMPLATE_FICHA_PARANA.docx')
+    
+    if not os.path.exists(caminho_evidencias) or not os.path.exists(caminho_ficha):
+        flash('Erro: Os arquivos TEMPLATE_EVIDENCIAS_PARANA.docx ou TEMPLATE_FICHA_PARANA.docx não foram encontrados no servidor.', 'error')
+        return redirect(url_for('projetos_extensao'))
+
+    quantidade_datas = detectar_quantidade_datas(caminho_ficha)
+    dicionario = montar_dicionario_extensao(nome_aluno, matricula, curso_aluno, quantidade_datas)
 
     try:
-        with open(caminho_evidencias, 'rb') as f1:
-            memoria_evidencias = io.BytesIO(f1.read())
-        doc_evidencias = documentos.preencher_template_extensao(memoria_evidencias, dicionario)
-        bytes_evidencias = doc_evidencias.read()
-        
-        with open(caminho_ficha, 'rb') as f2:
-            memoria_ficha = io.BytesIO(f2.read())
-        doc_ficha = documentos.preencher_template_extensao(memoria_ficha, dicionario)
-        bytes_ficha = doc_ficha.read()
+        # Templates compilados em cache: só os runs com tags são tocados a cada pedido
+        bytes_evidencias = documentos.preencher_template_extensao(caminho_evidencias, dicionario).read()
+        bytes_ficha = documentos.preencher_template_extensao(caminho_ficha, dicionario).read()
 
         nome_arq_evidencias = f"[EXTENSÃO] Evidências - {nome_aluno}.docx"
         nome_arq_ficha = f"[EXTENSÃO] Ficha - {nome_aluno}.docx"
@@ -808,39 +1366,40 @@ def gerar_extensao():
 
         if gerar_pdf:
             config = SiteSettings.query.first()
-            if config and config.convert_api_key:
-                resp1 = requests.post(f'https://v2.convertapi.com/convert/docx/to/pdf?Secret={config.convert_api_key}', files={'File': (nome_arq_evidencias, bytes_evidencias)}).json()
-                if 'Files' in resp1: 
-                    pdf_evidencias_bytes = base64.b64decode(resp1['Files'][0]['FileData'])
-                
-                resp2 = requests.post(f'https://v2.convertapi.com/convert/docx/to/pdf?Secret={config.convert_api_key}', files={'File': (nome_arq_ficha, bytes_ficha)}).json()
-                if 'Files' in resp2: 
-                    pdf_ficha_bytes = base64.b64decode(resp2['Files'][0]['FileData'])
+            motor_pdf = (config.conversor_pdf if config else None) or 'convertapi'
+            if motor_pdf == 'local' or (config and config.convert_api_key):
+                # As duas conversões correm em paralelo no motor configurado
+                pdf_evidencias_bytes, pdf_ficha_bytes = conversor_pdf.converter_varios_para_pdf(
+                    [(nome_arq_evidencias, bytes_evidencias), (nome_arq_ficha, bytes_ficha)], 
+                    motor_pdf, config.convert_api_key if config else None
+                )
             else:
                 flash('Chave da ConvertAPI não encontrada nas Configurações.', 'warning')
 
         if aluno:
-            db.session.add(Documento(aluno_id=aluno.id, nome_arquivo=nome_arq_evidencias, dados_arquivo=bytes_evidencias))
-            db.session.add(Documento(aluno_id=aluno.id, nome_arquivo=nome_arq_ficha, dados_arquivo=bytes_ficha))
+            db.session.add(criar_documento(aluno.id, nome_arq_evidencias, bytes_evidencias, receita_documento('motor2', caminho_evidencias, dicionario)))
+            db.session.add(criar_documento(aluno.id, nome_arq_ficha, bytes_ficha, receita_documento('motor2', caminho_ficha, dicionario)))
             
             if pdf_evidencias_bytes:
-                db.session.add(Documento(aluno_id=aluno.id, nome_arquivo=nome_arq_evidencias.replace('.docx','.pdf'), dados_arquivo=pdf_evidencias_bytes))
+                db.session.add(criar_documento(aluno.id, nome_arq_evidencias.replace('.docx','.pdf'), pdf_evidencias_bytes))
             if pdf_ficha_bytes:
-                db.session.add(Documento(aluno_id=aluno.id, nome_arquivo=nome_arq_ficha.replace('.docx','.pdf'), dados_arquivo=pdf_ficha_bytes))
+                db.session.add(criar_documento(aluno.id, nome_arq_ficha.replace('.docx','.pdf'), pdf_ficha_bytes))
             
             db.session.commit()
             flash('Projeto de Extensão gerado e salvo com sucesso!', 'success')
             return redirect(url_for('cliente_detalhe', id=aluno.id))
         else:
             arquivos_para_baixar = [
-                {"nome": nome_arq_evidencias, "b64": base64.b64encode(bytes_evidencias).decode('utf-8')},
-                {"nome": nome_arq_ficha, "b64": base64.b64encode(bytes_ficha).decode('utf-8')}
+                {"nome": nome_arq_evidencias, "url": url_download_temporario(nome_arq_evidencias, bytes_evidencias)},
+                {"nome": nome_arq_ficha, "url": url_download_temporario(nome_arq_ficha, bytes_ficha)}
             ]
             
             if pdf_evidencias_bytes:
-                arquivos_para_baixar.append({"nome": nome_arq_evidencias.replace('.docx','.pdf'), "b64": base64.b64encode(pdf_evidencias_bytes).decode('utf-8')})
+                nome_pdf = nome_arq_evidencias.replace('.docx','.pdf')
+                arquivos_para_baixar.append({"nome": nome_pdf, "url": url_download_temporario(nome_pdf, pdf_evidencias_bytes)})
             if pdf_ficha_bytes:
-                arquivos_para_baixar.append({"nome": nome_arq_ficha.replace('.docx','.pdf'), "b64": base64.b64encode(pdf_ficha_bytes).decode('utf-8')})
+                nome_pdf = nome_arq_ficha.replace('.docx','.pdf')
+                arquivos_para_baixar.append({"nome": nome_pdf, "url": url_download_temporario(nome_pdf, pdf_ficha_bytes)})
             
             todos_alunos = Aluno.query.filter_by(user_id=current_user.id).order_by(Aluno.nome).all()
             return render_template('projetos_extensao.html', alunos=todos_alunos, avulsos=arquivos_para_baixar)
@@ -849,6 +1408,81 @@ def gerar_extensao():
         flash(f'Erro ao processar os documentos: {str(e)}', 'error')
         return redirect(url_for('projetos_extensao'))
 
+@app.route('/gerar_extensao_lote', methods=['POST'])
+@login_required
+def gerar_extensao_lote():
+    ids = [int(i) for i in request.form.getlist('aluno_ids') if str(i).isdigit()]
+    salvar_no_cliente = request.form.get('salvar') == 'sim'
+    alunos = Aluno.query.filter(Aluno.id.in_(ids), Aluno.user_id == current_user.id).order_by(Aluno.nome).all() if ids else []
+    
+    if not alunos:
+        flash('Selecione pelo menos um cliente para a geração em lote.', 'error')
+        return redirect(url_for('projetos_extensao'))
+
+    caminho_evidencias = os.path.join(app.root_path, 'TEMPLATE_EVIDENCIAS_PARANA.docx')
+    caminho_ficha = os.path.join(app.root_path, 'TEMPLATE_FICHA_PARANA.docx')
+    
+    if not os.path.exists(caminho_evidencias) or not os.path.exists(caminho_ficha):
+        flash('Erro: Os arquivos TEMPLATE_EVIDENCIAS_PARANA.docx ou TEMPLATE_FICHA_PARANA.docx não foram encontrados no servidor.', 'error')
+        return redirect(url_for('projetos_extensao'))
+
+    quantidade_datas = detectar_quantidade_datas(caminho_ficha)
+    pool = obter_pool_extensao()
+    futuros = {}
+    
+    for aluno in alunos:
+        matricula = request.form.get(f'matricula_{aluno.id}', '').strip() or 'Não informada'
+        dicionario = montar_dicionario_extensao(aluno.nome, matricula, aluno.curso, quantidade_datas)
+        try:
+            futuro = pool.submit(documentos.gerar_documentos_extensao, [caminho_evidencias, caminho_ficha], dicionario)
+        except BrokenProcessPool:
+            descartar_pool_extensao()
+            pool = obter_pool_extensao()
+            futuro = pool.submit(documentos.gerar_documentos_extensao, [caminho_evidencias, caminho_ficha], dicionario)
+        futuros[futuro] = (aluno.id, aluno.nome, dicionario)
+
+    def transmitir_zip():
+        # Cada aluno entra no ZIP assim que o seu processo termina
+        fluxo = documentos.FluxoZip()
+        try:
+            with zipfile.ZipFile(fluxo, 'w', zipfile.ZIP_STORED) as zf:
+                for futuro in as_completed(futuros):
+                    aluno_id, nome_aluno, dicionario = futuros[futuro]
+                    # A barra no nome criaria uma subpasta no ZIP (e iria assim para o nome do Documento)
+                    nome_aluno = nome_aluno.replace('/', '-')
+                    pasta = f"{nome_aluno} - {aluno_id}"
+                    try:
+                        bytes_evidencias, bytes_ficha = futuro.result()
+                    except Exception as e:
+                        logging.error(f"Falha na geração em lote (aluno {aluno_id}): {e}")
+                        if isinstance(e, BrokenProcessPool):
+                            descartar_pool_extensao()
+                        zf.writestr(f"{pasta}/ERRO.txt", f"Erro ao processar os documentos: {e}")
+                        yield fluxo.retirar()
+                        continue
+
+                    nome_arq_evidencias = f"[EXTENSÃO] Evidências - {nome_aluno}.docx"
+                    nome_arq_ficha = f"[EXTENSÃO] Ficha - {nome_aluno}.docx"
+                    zf.writestr(f"{pasta}/{nome_arq_evidencias}", bytes_evidencias)
+                    zf.writestr(f"{pasta}/{nome_arq_ficha}", bytes_ficha)
+                    
+                    if salvar_no_cliente:
+                        db.session.add(criar_documento(aluno_id, nome_arq_evidencias, bytes_evidencias, receita_documento('motor2', caminho_evidencias, dicionario)))
+                        db.session.add(criar_documento(aluno_id, nome_arq_ficha, bytes_ficha, receita_documento('motor2', caminho_ficha, dicionario)))
+                        db.session.commit()
+                    yield fluxo.retirar()
+            yield fluxo.retirar()
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+
+    nome_zip = f"Extensao_Lote_{(datetime.utcnow() - timedelta(hours=3)).strftime('%d%m%Y_%H%M')}.zip"
+    return Response(
+        stream_with_context(transmitir_zip()), 
+        mimetype='application/zip', 
+        headers={"Content-Disposition": f"attachment;filename={nome_zip}"}
+    )
+
 
 # =========================================================
 # ROTAS DE TRABALHOS ACADÊMICOS E CRM
@@ -868,7 +1502,7 @@ def api_extrair_memorial(doc_id):
         return jsonify({"sucesso": False, "erro": "Acesso negado."}), 403
         
     try:
-        sucesso, texto_memorial = documentos.extrair_etapa_5(doc.dados_arquivo)
+        sucesso, texto_memorial = documentos.extrair_etapa_5(ler_conteudo_documento(doc))
         return jsonify({
             "sucesso": sucesso, 
             "texto": texto_memorial if sucesso else "", 
@@ -898,13 +1532,13 @@ REGRAS DE SEGURANÇA MÁXIMA (ANTI-DETECÇÃO):
 2. Na Autoavaliação ou Resumo, NUNCA mencione "limites de caracteres", "exigências do prompt", "Etapa 5", ou a dificuldade de escrever o texto. Fale como se o trabalho fosse real e prático.
 3. Fale APENAS sobre o caso prático, os conceitos da disciplina e o aprendizado do aluno."""
     
-    fila_modelos = [modelo_selecionado] + [m for m in get_modelos_ativos() if m != modelo_selecionado]
+    fila_modelos = montar_fila_modelos(modelo_selecionado)
     
     nova_task = GeracaoTask(user_id=current_user.id, status='Pendente')
     db.session.add(nova_task)
     db.session.commit()
     
-    threading.Thread(target=executar_geracao_bg, args=(nova_task.id, prompt_completo, fila_modelos)).start()
+    agendar_geracao(nova_task.id, prompt_completo, fila_modelos)
     return jsonify({"sucesso": True, "task_id": nova_task.id})
 
 @app.route('/humanizar_trabalho', methods=['POST'])
@@ -931,12 +1565,12 @@ REGRAS DE BLINDAGEM (ESTILO DE ESCRITA):
 TEXTO ORIGINAL:
 {texto_contexto}"""
         
-        fila_modelos = [modelo_selecionado] + [m for m in get_modelos_ativos() if m != modelo_selecionado]
+        fila_modelos = montar_fila_modelos(modelo_selecionado)
         nova_task = GeracaoTask(user_id=current_user.id, status='Pendente')
         db.session.add(nova_task)
         db.session.commit()
         
-        threading.Thread(target=executar_geracao_bg, args=(nova_task.id, prompt_humanizador, fila_modelos)).start()
+        agendar_geracao(nova_task.id, prompt_humanizador, fila_modelos)
         return jsonify({"sucesso": True, "task_id": nova_task.id})
     except Exception as e:
         return jsonify({"sucesso": False, "erro": str(e)})
@@ -959,7 +1593,7 @@ def status_geracao(task_id):
         return jsonify({"sucesso": False, "erro": "Tarefa não encontrada."})
         
     if task.status == 'Pendente': 
-        return jsonify({"status": "Pendente"})
+        return jsonify({"status": "Pendente", "parcial": json.loads(task.parcial) if task.parcial else {}})
     elif task.status == 'Erro': 
         return jsonify({"status": "Erro", "erro": task.erro})
     elif task.status == 'Cancelado': 
@@ -971,15 +1605,26 @@ def status_geracao(task_id):
         "modelo_utilizado": task.modelo_utilizado
     })
 
-@app.route('/analisar_ia_trecho', methods=['POST'])
-@login_required
-def analisar_ia_trecho():
-    try:
-        trecho = str(request.json.get('trecho', '')).strip()
-        if not trecho or len(trecho) < 25: 
-            return jsonify({"sucesso": True, "porcentagem": 0})
-        
-        prompt = f"""Você é um analista de textos acadêmicos. Avalie de 0 a 100 qual a probabilidade do texto abaixo ter sido gerado por uma Inteligência Artificial.
+DETECTORES_IA = {}
+TRAVA_DETECTORES_IA = threading.Lock()
+
+def obter_detector_ia(config):
+    # Um detector por conjunto de pesos e léxico: o matcher compilado é reaproveitado entre os pedidos.
+    # A chave é o conteúdo dos dois, nunca o id() do léxico, que o Python reaproveita depois do coletor
+    pesos_json = (config.detector_ia_pesos if config else None) or ''
+    termos = cliches.obter_lexico().termos()
+    chave = (pesos_json, hashlib.sha1("\n".join(termos).encode('utf-8')).hexdigest())
+    with TRAVA_DETECTORES_IA:
+        detector = DETECTORES_IA.get(chave)
+        if detector is None:
+            DETECTORES_IA.clear()
+            detector = DETECTORES_IA[chave] = detector_ia.DetectorIA(
+                detector_ia.carregar_pesos(pesos_json), detector_ia.LEXICO_CLICHES + termos
+            )
+    return detector
+
+def prompt_analise_trecho(trecho):
+    return f"""Você é um analista de textos acadêmicos. Avalie de 0 a 100 qual a probabilidade do texto abaixo ter sido gerado por uma Inteligência Artificial.
 ATENÇÃO: Textos universitários usam naturalmente linguagem técnica, formal e culta. NÃO confunda texto técnico humano com Inteligência Artificial!
 
 DÊ UMA NOTA ALTA (70-100%) APENAS SE: 
@@ -994,14 +1639,84 @@ TEXTO:
 
 Responda ÚNICA E EXCLUSIVAMENTE com o número da porcentagem (ex: 15). Nenhuma palavra extra."""
 
-        resposta, custo = ia_core.chamar_ia(prompt, "google/gemini-2.5-flash", CHAVE_API_GOOGLE, CHAVE_OPENROUTER)
-        db.session.add(RegistroUso(modelo_usado="google/gemini-2.5-flash", custo=custo))
-        db.session.commit()
+def analisar_trechos_com_ia(trechos):
+    """
+    Nota da IA para vários trechos ({tag: texto}) numa única ida ao gateway: as chamadas
+    correm em paralelo e cada trecho tem o seu cache. Trechos que falharem ficam de fora.
+    """
+    prompts = {tag: prompt_analise_trecho(trecho) for tag, trecho in trechos.items()}
+    resultados = ia_core.GATEWAY.executar(ia_core.chamar_ia_em_paralelo(prompts, "google/gemini-2.5-flash", "analise_trecho", CHAVE_API_GOOGLE, CHAVE_OPENROUTER))
+    
+    porcentagens = {}
+    for tag, resultado in resultados.items():
+        if isinstance(resultado, Exception):
+            logging.error(f"Análise de IA do trecho {tag} falhou: {resultado}")
+            continue
+        resposta, custo, custo_evitado = resultado
+        db.session.add(registro_uso_ia("google/gemini-2.5-flash", custo, custo_evitado))
         
         numeros = re.findall(r'\d+', resposta)
-        porcentagem_final = min(int(numeros[0]), 100) if numeros else 15
+        porcentagens[tag] = min(int(numeros[0]), 100) if numeros else 15
+        # Cada nota da IA vira amostra para calibrar o detector local (flask calibrar-detector)
+        if numeros and custo_evitado is None:
+            db.session.add(AmostraDetectorIA(texto=trechos[tag], porcentagem=porcentagens[tag]))
+    db.session.commit()
+    return porcentagens
+
+def pontuar_trechos(trechos, config):
+    """
+    Nota local (milissegundos, sem rede) de cada trecho. Só as notas perto de uma faixa do
+    radar e os trechos curtos demais para o detector vão para a IA, e só se houver margem
+    configurada. Devolve ({tag: nota}, {tag: origem}).
+    """
+    detector = obter_detector_ia(config)
+    margem = config.detector_ia_margem if config else 0
+    porcentagens, origens, incertos = {}, {}, {}
+    
+    for tag, trecho in trechos.items():
+        porcentagens[tag], caracteristicas = detector.pontuar(trecho)
+        origens[tag] = 'local'
+        if len(trecho) < detector_ia.MIN_CARACTERES:
+            continue
+        # Sem características o trecho é curto demais para o detector: quem decide é a IA, se houver margem
+        if (caracteristicas is None and margem) or detector.incerta(porcentagens[tag], margem):
+            incertos[tag] = trecho
+            
+    if incertos:
+        try:
+            for tag, porcentagem in analisar_trechos_com_ia(incertos).items():
+                porcentagens[tag] = porcentagem
+                origens[tag] = 'ia'
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Escalonamento do detector para a IA falhou: {e}")
+    return porcentagens, origens
+
+@app.route('/analisar_ia_trecho', methods=['POST'])
+@login_required
+def analisar_ia_trecho():
+    try:
+        trecho = str(request.json.get('trecho', '')).strip()
+        if not trecho or len(trecho) < detector_ia.MIN_CARACTERES: 
+            return jsonify({"sucesso": True, "porcentagem": 0, "origem": "local"})
         
-        return jsonify({"sucesso": True, "porcentagem": porcentagem_final})
+        porcentagens, origens = pontuar_trechos({'trecho': trecho}, SiteSettings.query.first())
+        return jsonify({"sucesso": True, "porcentagem": porcentagens['trecho'], "origem": origens['trecho']})
+    except Exception as e:
+        return jsonify({"sucesso": False, "erro": str(e)})
+
+@app.route('/analisar_ia_lote', methods=['POST'])
+@login_required
+def analisar_ia_lote():
+    """Todas as seções do editor num pedido só: {"dicionario": {tag: texto}} -> nota por tag."""
+    try:
+        dicionario = (request.json or {}).get('dicionario') or {}
+        if not isinstance(dicionario, dict):
+            return jsonify({"sucesso": False, "erro": "Envie o dicionário de seções."})
+        
+        trechos = {str(tag): str(texto or '').strip() for tag, texto in dicionario.items()}
+        porcentagens, origens = pontuar_trechos(trechos, SiteSettings.query.first())
+        return jsonify({"sucesso": True, "porcentagens": porcentagens, "origens": origens})
     except Exception as e:
         return jsonify({"sucesso": False, "erro": str(e)})
 
@@ -1054,13 +1769,21 @@ def assistente_pontual():
 @login_required
 def exterminar_cliches():
     try:
-        prompt = f"Remova palavras clichês de IA (ex: crucial, vital, tapeçaria, locus, multifacetada, teia) deste texto, mantendo a formalidade técnica e acadêmica de forma natural:\n{request.json.get('trecho', '')}\nRetorne APENAS o texto limpo."
+        dados = request.json or {}
+        trecho = dados.get('trecho', '')
         
-        novo_texto, custo = ia_core.chamar_ia(prompt, "google/gemini-2.5-flash", CHAVE_API_GOOGLE, CHAVE_OPENROUTER)
-        db.session.add(RegistroUso(modelo_usado="google/gemini-2.5-flash", custo=custo))
+        # Padrão: o léxico local, sem custo. A IA só entra quando o usuário pede (modo 'ia')
+        if dados.get('modo') != 'ia':
+            lexico = cliches.obter_lexico()
+            return jsonify({"sucesso": True, "novo_texto": lexico.substituir(trecho), "trocas": lexico.contar(trecho), "origem": "local"})
+        
+        prompt = f"Remova palavras clichês de IA (ex: crucial, vital, tapeçaria, locus, multifacetada, teia) deste texto, mantendo a formalidade técnica e acadêmica de forma natural:\n{trecho}\nRetorne APENAS o texto limpo."
+        
+        novo_texto, custo, custo_evitado = ia_core.chamar_ia_com_cache(prompt, "google/gemini-2.5-flash", "cliches", CHAVE_API_GOOGLE, CHAVE_OPENROUTER)
+        db.session.add(registro_uso_ia("google/gemini-2.5-flash", custo, custo_evitado))
         db.session.commit()
         
-        return jsonify({"sucesso": True, "novo_texto": novo_texto})
+        return jsonify({"sucesso": True, "novo_texto": novo_texto, "origem": "ia"})
     except Exception as e:
         return jsonify({"sucesso": False, "erro": str(e)})
 
@@ -1076,20 +1799,23 @@ def regerar_trecho():
         texto_contexto = "".join([f"{k}:\n{v}\n\n" for k, v in contexto_atual.items() if v and str(v).strip()])
 
         prompt = f"TEMA:\n{dados.get('tema', '')}\nCONTEXTO:\n{texto_contexto}\nReescreva APENAS o trecho da tag {tag}. ATENÇÃO: NUNCA mencione limites de caracteres ou regras de formatação. Retorne APENAS o texto limpo."
-        fila_modelos = [modelo_selecionado] + [m for m in get_modelos_ativos() if m != modelo_selecionado]
+        fila_modelos = montar_fila_modelos(modelo_selecionado)
         
-        for modelo in fila_modelos[:2]: 
-            try:
-                novo_texto, custo = ia_core.chamar_ia(prompt, modelo, CHAVE_API_GOOGLE, CHAVE_OPENROUTER)
-                novo_texto = re.sub(rf"\[/?START_{tag}\]", "", novo_texto, flags=re.IGNORECASE)
-                novo_texto = re.sub(rf"\[/?END_{tag}\]", "", novo_texto, flags=re.IGNORECASE).strip('* ')
-                
-                db.session.add(RegistroUso(modelo_usado=modelo, custo=custo))
-                db.session.commit()
-                return jsonify({"sucesso": True, "novo_texto": novo_texto, "modelo_utilizado": modelo})
-            except Exception as e: 
-                continue
-                
+        def limpar_trecho(modelo, novo_texto):
+            return ia_core.extrair_trecho(novo_texto, tag)
+        
+        gastos = []
+        try:
+            modelo, novo_texto, _ = ia_core.GATEWAY.executar(ia_core.chamar_ia_com_hedge(
+                prompt, fila_modelos[:2], "trecho", CHAVE_API_GOOGLE, CHAVE_OPENROUTER, validar=limpar_trecho, gastos=gastos
+            ))
+        except Exception:
+            modelo = None
+        
+        registrar_gastos_ia(gastos)
+        db.session.commit()
+        if modelo:
+            return jsonify({"sucesso": True, "novo_texto": novo_texto, "modelo_utilizado": modelo})
         return jsonify({"sucesso": False, "erro": "Falha nas tentativas."})
     except Exception as e:
         return jsonify({"sucesso": False, "erro": str(e)})
@@ -1102,8 +1828,8 @@ def gerar_docx_final():
         aluno_id = dados.get('aluno_id')
         nome_arquivo = str(dados.get('nome_arquivo', '')).strip()
         
-        with open(os.path.join(app.root_path, 'TEMPLATE_COM_TAGS.docx'), 'rb') as f: 
-            arquivo_bytes = documentos.preencher_template_com_tags(io.BytesIO(f.read()), dados.get('dicionario', {})).read()
+        caminho_template = os.path.join(app.root_path, 'TEMPLATE_COM_TAGS.docx')
+        arquivo_bytes = documentos.preencher_template_com_tags(caminho_template, dados.get('dicionario', {})).read()
         
         if not nome_arquivo:
             nome_arquivo = f"Trabalho_{datetime.now().strftime('%d%m%Y')}.docx"
@@ -1111,16 +1837,20 @@ def gerar_docx_final():
             nome_arquivo += '.docx'
             
         if aluno_id:
-            db.session.add(Documento(aluno_id=aluno_id, nome_arquivo=nome_arquivo, dados_arquivo=arquivo_bytes))
+            novo_doc = criar_documento(aluno_id, nome_arquivo, arquivo_bytes, receita_documento('motor1', caminho_template, dados.get('dicionario', {})))
+            db.session.add(novo_doc)
             aluno = Aluno.query.get(aluno_id)
             if aluno and (aluno.status == 'Produção' or not aluno.status): 
                 aluno.status = 'Pendente'
             db.session.commit()
+            url_download = url_download_documento(novo_doc)
+        else:
+            url_download = url_download_temporario(nome_arquivo, arquivo_bytes)
             
         return jsonify({
             "sucesso": True, 
             "nome_arquivo": nome_arquivo, 
-            "arquivo_base64": base64.b64encode(arquivo_bytes).decode('utf-8')
+            "url_download": url_download
         })
     except Exception as e: 
         return jsonify({"sucesso": False, "erro": str(e)})
@@ -1137,20 +1867,19 @@ def converter_pdf(doc_id):
             return jsonify({"sucesso": False, "erro": "Apenas arquivos .docx podem ser convertidos."})
 
         config = SiteSettings.query.first()
-        if not config or not config.convert_api_key: 
+        motor_pdf = (config.conversor_pdf if config else None) or 'convertapi'
+        if motor_pdf == 'convertapi' and (not config or not config.convert_api_key): 
             return jsonify({"sucesso": False, "erro": "Cadastre a Secret Key da ConvertAPI."})
 
-        response = requests.post(f'https://v2.convertapi.com/convert/docx/to/pdf?Secret={config.convert_api_key}', files={'File': (doc.nome_arquivo, doc.dados_arquivo)}).json()
+        try:
+            pdf_bytes = conversor_pdf.converter_docx_para_pdf(doc.nome_arquivo, ler_conteudo_documento(doc), motor_pdf, config.convert_api_key if config else None)
+        except Exception as e:
+            return jsonify({"sucesso": False, "erro": str(e) or 'Falha na conversão.'})
         
-        if 'Files' in response:
-            novo_nome = doc.nome_arquivo.replace('.docx', '.pdf').replace('.DOCX', '.pdf')
-            pdf_bytes = base64.b64decode(response['Files'][0]['FileData'])
-            
-            db.session.add(Documento(aluno_id=doc.aluno_id, nome_arquivo=novo_nome, dados_arquivo=pdf_bytes))
-            db.session.commit()
-            return jsonify({"sucesso": True})
-            
-        return jsonify({"sucesso": False, "erro": response.get('Message', 'Falha na conversão.')})
+        novo_nome = doc.nome_arquivo.replace('.docx', '.pdf').replace('.DOCX', '.pdf')
+        db.session.add(criar_documento(doc.aluno_id, novo_nome, pdf_bytes))
+        db.session.commit()
+        return jsonify({"sucesso": True})
     except Exception as e:
         return jsonify({"sucesso": False, "erro": str(e)})
 
@@ -1241,11 +1970,16 @@ def dashboard():
             
     # Lógica de custos das IAs
     custo_periodo = 0.0
+    economia_cache_periodo = 0.0
+    acertos_cache_periodo = 0
     uso_modelos_dict = {}
     for u in RegistroUso.query.all():
         d_uso_br = (u.data - timedelta(hours=3)).date()
         if (not data_inicio or d_uso_br >= data_inicio) and (not data_fim or d_uso_br <= data_fim):
             custo_periodo += (u.custo or 0.0)
+            if u.custo_evitado:
+                economia_cache_periodo += u.custo_evitado
+                acertos_cache_periodo += 1
             uso_modelos_dict.setdefault(u.modelo_usado, {'count': 0, 'custo': 0.0})
             uso_modelos_dict[u.modelo_usado]['count'] += 1
             uso_modelos_dict[u.modelo_usado]['custo'] += (u.custo or 0.0)
@@ -1280,6 +2014,8 @@ def dashboard():
         receita_periodo=receita_periodo, 
         a_receber_periodo=a_receber_periodo, 
         custo_periodo=custo_periodo, 
+        economia_cache_periodo=economia_cache_periodo, 
+        acertos_cache_periodo=acertos_cache_periodo, 
         saldo_real_openrouter=saldo_openrouter, 
         trabalhos_periodo=trabalhos_periodo, 
         uso_modelos=uso_modelos_lista, 
@@ -1405,8 +2141,11 @@ def deletar_cliente(id):
     if aluno.user_id != current_user.id and current_user.role != 'admin': 
         abort(403)
         
+    hashes = [d.sha256 for d in Documento.query.with_entities(Documento.sha256).filter_by(aluno_id=aluno.id)]
     db.session.delete(aluno)
+    marcar_blobs_orfaos(hashes)
     db.session.commit()
+    varrer_blobs_orfaos_se_preciso()
     flash('Cliente apagado.', 'success')
     return redirect(url_for('clientes'))
 
@@ -1470,7 +2209,7 @@ def upload_doc(aluno_id):
     try:
         arquivo = request.files.get('arquivo')
         if arquivo and arquivo.filename.lower().endswith(('.docx', '.pdf')):
-            db.session.add(Documento(aluno_id=aluno_id, nome_arquivo=arquivo.filename, dados_arquivo=arquivo.read()))
+            db.session.add(criar_documento(aluno_id, arquivo.filename, arquivo.read()))
             db.session.commit()
             flash('Documento anexado!', 'success')
         else:
@@ -1483,11 +2222,29 @@ def upload_doc(aluno_id):
 @app.route('/download_doc/<int:doc_id>')
 def download_doc(doc_id):
     doc = Documento.query.get_or_404(doc_id)
-    return send_file(
-        io.BytesIO(doc.dados_arquivo), 
-        download_name=doc.nome_arquivo, 
-        as_attachment=True
-    )
+    return responder_documento(doc)
+
+@app.route('/baixar/<token>')
+def baixar_arquivo(token):
+    try:
+        dados = ASSINADOR_DOWNLOAD.loads(token, max_age=DOWNLOAD_TOKEN_TTL)
+    except SignatureExpired:
+        abort(410)
+    except BadSignature:
+        abort(404)
+
+    if dados.get('origem') == 'doc':
+        return responder_documento(Documento.query.get_or_404(dados['id']), dados.get('nome'))
+
+    # Avulsos: o arquivo está na área temporária até o token vencer
+    chave = dados.get('chave', '')
+    if dados.get('origem') != 'temp' or not re.fullmatch(r'[0-9a-f]{64}', chave):
+        abort(404)
+    tamanho = DOWNLOADS_TEMPORARIOS.tamanho(chave)
+    if tamanho is None:
+        abort(410)
+    fluxo = armazenamento.FluxoBlob(lambda inicio: DOWNLOADS_TEMPORARIOS.ler_pedacos(chave, inicio))
+    return responder_arquivo(fluxo, tamanho, dados['nome'], etag=chave)
 
 @app.route('/rename_doc/<int:doc_id>', methods=['POST'])
 @login_required
@@ -1505,13 +2262,41 @@ def rename_doc(doc_id):
         
     return redirect(url_for('cliente_detalhe', id=doc.aluno_id))
 
+@app.route('/fixar_doc/<int:doc_id>')
+@login_required
+def fixar_doc(doc_id):
+    doc = Documento.query.get_or_404(doc_id)
+    if doc.aluno.user_id != current_user.id and current_user.role != 'admin': 
+        abort(403)
+        
+    if doc.sob_demanda:
+        try:
+            fixado = criar_documento(doc.aluno_id, doc.nome_arquivo, materializar_documento(doc))
+        except Exception as e:
+            flash(f'Erro ao fixar o documento: {str(e)}', 'error')
+            return redirect(url_for('cliente_detalhe', id=doc.aluno_id))
+            
+        doc.dados_arquivo = fixado.dados_arquivo
+        doc.sha256 = fixado.sha256
+        doc.tamanho_bytes = fixado.tamanho_bytes
+        doc.mime = fixado.mime
+        doc.sob_demanda = False
+        doc.receita = None
+        db.session.commit()
+        flash('Documento fixado: a cópia renderizada agora fica guardada permanentemente.', 'success')
+        
+    return redirect(url_for('cliente_detalhe', id=doc.aluno_id))
+
 @app.route('/delete_doc/<int:doc_id>')
 @login_required
 def delete_doc(doc_id):
     doc = Documento.query.get_or_404(doc_id)
     aluno_id = doc.aluno_id
+    sha256 = doc.sha256
     db.session.delete(doc)
+    marcar_blobs_orfaos([sha256])
     db.session.commit()
+    varrer_blobs_orfaos_se_preciso()
     flash('Documento apagado.', 'success')
     return redirect(url_for('cliente_detalhe', id=aluno_id))
 
@@ -1530,6 +2315,18 @@ def configuracoes():
         config.whatsapp_template = request.form.get('whatsapp_template')
         config.prompt_password = request.form.get('prompt_password')
         config.convert_api_key = request.form.get('convert_api_key')
+        if request.form.get('conversor_pdf') in conversor_pdf.MOTORES_PDF:
+            config.conversor_pdf = request.form.get('conversor_pdf')
+        if request.form.get('modo_documentos') in MODOS_DOCUMENTOS:
+            config.modo_documentos = request.form.get('modo_documentos')
+        if request.form.get('lexico_cliches') is not None:
+            texto_lexico = request.form.get('lexico_cliches').strip()
+            config.lexico_cliches = cliches.formatar_lexico(cliches.ler_lexico(texto_lexico)) or None
+        if request.form.get('detector_ia_margem') is not None:
+            try:
+                config.detector_ia_margem = max(0, min(50, int(request.form.get('detector_ia_margem') or 0)))
+            except ValueError:
+                pass
         
         modelos = request.form.getlist('modelos_ativos')
         novo_modelo = request.form.get('novo_modelo')
@@ -1538,6 +2335,7 @@ def configuracoes():
             
         config.modelos_ativos = ",".join(modelos)
         db.session.commit()
+        sincronizar_lexico(config)
         flash('Configurações salvas com sucesso!', 'success')
         return redirect(url_for('configuracoes'))
         
@@ -1548,9 +2346,28 @@ def configuracoes():
         'configuracoes.html', 
         config=config, 
         todos_modelos=todos_para_exibir, 
-        modelos_ativos=ativos_atuais
+        modelos_ativos=ativos_atuais,
+        motores_pdf=conversor_pdf.MOTORES_PDF,
+        modos_documentos=MODOS_DOCUMENTOS,
+        saude_modelos=ia_core.ROTEADOR.estatisticas(ia_core.ROTEADOR.ordenar(ativos_atuais, sondar=False)),
+        amostras_detector=AmostraDetectorIA.query.count(),
+        lexico_texto=(config.lexico_cliches if config and config.lexico_cliches else cliches.formatar_lexico(cliches.SUBSTITUICOES_PADRAO))
     )
 
+@app.route('/estatisticas_cache')
+@login_required
+def estatisticas_cache():
+    if current_user.role not in ['admin', 'sub-admin']: 
+        abort(403)
+    return jsonify({
+        "sucesso": True, 
+        "renderizacao": documentos.CACHE_RENDERIZACAO.estatisticas(), 
+        "gateway_ia": ia_core.GATEWAY.estatisticas(),
+        "respostas_ia": ia_core.CACHE_IA.estatisticas(),
+        "latencias_ia": ia_core.LATENCIAS_IA.estatisticas(),
+        "roteador_ia": ia_core.ROTEADOR.estatisticas()
+    })
+
 @app.route('/prompts')
 @login_required
 def prompts():
@@ -0,0 +1,272 @@
+import os
+import time
+import hashlib
+import tempfile
+import mimetypes
+import threading
+
+# =========================================================
+# ARMAZÉM DE ARQUIVOS ENDEREÇADO POR CONTEÚDO (SHA-256)
+# =========================================================
+MIMES_CONHECIDOS = {
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".pdf": "application/pdf",
+}
+
+# Tamanho de cada pedaço lido durante um download (a memória do worker não cresce com o arquivo)
+TAMANHO_PEDACO = 256 * 1024
+
+
+class BlobNaoEncontrado(Exception):
+    pass
+
+
+def calcular_sha256(dados):
+    return hashlib.sha256(dados).hexdigest()
+
+
+def detectar_mime(nome_arquivo):
+    extensao = os.path.splitext(nome_arquivo or "")[1].lower()
+    return MIMES_CONHECIDOS.get(extensao) or mimetypes.guess_type(nome_arquivo or "")[0] or "application/octet-stream"
+
+
+class FluxoBlob:
+    """
+    Iterável de bytes com seek/tell para o Response do Werkzeug. Num pedido com
+    Range o Werkzeug faz um único seek antes da primeira leitura, então a fonte
+    só é aberta ali, já na posição certa. 'abrir(inicio)' devolve um iterador de pedaços.
+    """
+
+    def __init__(self, abrir):
+        self.abrir = abrir
+        self.posicao = 0
+        self.pedacos = None
+
+    def seekable(self):
+        return True
+
+    def seek(self, posicao, whence=0):
+        if whence != 0:
+            raise ValueError("FluxoBlob só aceita posições absolutas.")
+        self.close()
+        self.posicao = posicao
+        return posicao
+
+    def tell(self):
+        return self.posicao
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pedacos is None:
+            self.pedacos = iter(self.abrir(self.posicao))
+        pedaco = next(self.pedacos)
+        self.posicao += len(pedaco)
+        return pedaco
+
+    def close(self):
+        if self.pedacos is not None and hasattr(self.pedacos, "close"):
+            self.pedacos.close()
+        self.pedacos = None
+
+
+def chave_sharded(sha256):
+    # ab/cd/abcd... -> no máximo 65536 pastas, nenhuma com milhões de arquivos
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+class ArmazemLocal:
+    """Arquivos no disco local, um por hash. Conteúdo repetido é gravado uma única vez."""
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+
+    def caminho(self, sha256):
+        return os.path.join(self.pasta, *chave_sharded(sha256).split("/"))
+
+    def existe(self, sha256):
+        return os.path.exists(self.caminho(sha256))
+
+    def guardar(self, dados, mime=None):
+        sha256 = calcular_sha256(dados)
+        caminho = self.caminho(sha256)
+        if not os.path.exists(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporario, "wb") as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        return sha256
+
+    def ler(self, sha256):
+        try:
+            with open(self.caminho(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNaoEncontrado(sha256)
+
+    def ler_pedacos(self, sha256, inicio=0):
+        try:
+            with open(self.caminho(sha256), "rb") as f:
+                f.seek(inicio)
+                while True:
+                    pedaco = f.read(TAMANHO_PEDACO)
+                    if not pedaco:
+                        break
+                    yield pedaco
+        except FileNotFoundError:
+            raise BlobNaoEncontrado(sha256)
+
+    def remover(self, sha256):
+        try:
+            os.remove(self.caminho(sha256))
+        except FileNotFoundError:
+            pass
+
+
+class ArmazemS3:
+    """Qualquer serviço compatível com S3 (AWS, MinIO, R2...). Requer o pacote boto3."""
+
+    def __init__(self, bucket, endpoint_url=None, chave_acesso=None, chave_secreta=None, regiao=None, prefixo=""):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise Exception("O armazém S3 precisa do pacote boto3 (pip install boto3).")
+
+        self.ClientError = ClientError
+        self.bucket = bucket
+        self.prefixo = prefixo
+        self.cliente = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            aws_access_key_id=chave_acesso or None,
+            aws_secret_access_key=chave_secreta or None,
+            region_name=regiao or None
+        )
+
+    def chave(self, sha256):
+        return self.prefixo + chave_sharded(sha256)
+
+    def existe(self, sha256):
+        try:
+            self.cliente.head_object(Bucket=self.bucket, Key=self.chave(sha256))
+            return True
+        except self.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def guardar(self, dados, mime=None):
+        sha256 = calcular_sha256(dados)
+        if not self.existe(sha256):
+            self.cliente.put_object(
+                Bucket=self.bucket, Key=self.chave(sha256), Body=dados,
+                ContentType=mime or "application/octet-stream"
+            )
+        return sha256
+
+    def ler(self, sha256):
+        try:
+            return self.cliente.get_object(Bucket=self.bucket, Key=self.chave(sha256))["Body"].read()
+        except self.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise BlobNaoEncontrado(sha256)
+            raise
+
+    def ler_pedacos(self, sha256, inicio=0):
+        try:
+            extras = {"Range": f"bytes={inicio}-"} if inicio else {}
+            resposta = self.cliente.get_object(Bucket=self.bucket, Key=self.chave(sha256), **extras)
+        except self.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise BlobNaoEncontrado(sha256)
+            raise
+        try:
+            yield from resposta["Body"].iter_chunks(TAMANHO_PEDACO)
+        finally:
+            resposta["Body"].close()
+
+    def remover(self, sha256):
+        self.cliente.delete_object(Bucket=self.bucket, Key=self.chave(sha256))
+
+
+class AreaTemporaria(ArmazemLocal):
+    """
+    Arquivos de download avulso (sem cliente onde guardar). Nada sai por falta de espaço:
+    cada arquivo vive 'ttl' segundos desde a última vez que foi guardado, o mesmo prazo
+    do token que aponta para ele, e uma varredura periódica apaga os vencidos.
+    """
+
+    def __init__(self, pasta, ttl, intervalo_varredura=60):
+        super().__init__(pasta)
+        self.ttl = ttl
+        self.intervalo_varredura = intervalo_varredura
+        self.ultima_varredura = 0.0
+        self.trava = threading.Lock()
+
+    def guardar(self, dados, mime=None):
+        sha256 = super().guardar(dados, mime)
+        try:
+            # Conteúdo repetido: o prazo recomeça junto com o token novo
+            os.utime(self.caminho(sha256))
+        except FileNotFoundError:
+            # A varredura apagou a cópia vencida entre a checagem e o utime
+            super().guardar(dados, mime)
+        self.varrer_se_preciso()
+        return sha256
+
+    def vencido(self, st):
+        return st.st_mtime + self.ttl < time.time()
+
+    def tamanho(self, sha256):
+        """Tamanho do arquivo, ou None se ele venceu ou não existe."""
+        try:
+            st = os.stat(self.caminho(sha256))
+        except OSError:
+            return None
+        return None if self.vencido(st) else st.st_size
+
+    def varrer_se_preciso(self):
+        with self.trava:
+            if time.time() - self.ultima_varredura < self.intervalo_varredura:
+                return
+            self.ultima_varredura = time.time()
+
+        for raiz, _, arquivos in os.walk(self.pasta):
+            for nome in arquivos:
+                caminho = os.path.join(raiz, nome)
+                try:
+                    # stat logo antes de apagar: um guardar recente renova o mtime
+                    if self.vencido(os.stat(caminho)):
+                        os.remove(caminho)
+                except OSError:
+                    pass
+
+
+def obter_area_temporaria(ttl):
+    pasta_padrao = os.path.join(tempfile.gettempdir(), "hubmaster_downloads")
+    return AreaTemporaria(os.environ.get("DOWNLOADS_TEMP_DIR", pasta_padrao), ttl)
+
+
+def obter_armazem():
+    """
+    Escolhe o armazém pela variável BLOB_STORE: 'local', 's3' ou vazio/'banco'.
+    Sem configuração os arquivos continuam dentro do banco (comportamento antigo),
+    já que um disco local efêmero perderia tudo a cada deploy.
+    """
+    tipo = os.environ.get("BLOB_STORE", "banco").strip().lower()
+    if tipo == "local":
+        pasta_padrao = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blobs")
+        return ArmazemLocal(os.environ.get("BLOB_DIR", pasta_padrao))
+    if tipo == "s3":
+        return ArmazemS3(
+            bucket=os.environ.get("S3_BUCKET", "hubmaster-documentos"),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+            chave_acesso=os.environ.get("S3_ACCESS_KEY"),
+            chave_secreta=os.environ.get("S3_SECRET_KEY"),
+            regiao=os.environ.get("S3_REGION"),
+            prefixo=os.environ.get("S3_PREFIX", "")
+        )
+    return None
@@ -0,0 +1,242 @@
+"""
+BENCHMARK DOS MOTORES DE DOCUMENTOS
+
+Renderiza os templates do sistema com dicionários realistas e roda a extração da
+Etapa 5 sobre uploads sintéticos. Cada cenário roda num processo novo (para o pico
+de RSS ser só dele) e o resultado sai em JSON, pronto para comparar com uma base.
+
+Uso:
+    python benchmark_documentos.py --saida base.json
+    python benchmark_documentos.py --saida depois.json --comparar base.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import zipfile
+import tracemalloc
+import multiprocessing
+from datetime import datetime, date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+
+CHAVES_MOTOR_1 = [
+    "ASPECTO_1", "POR_QUE_1", "ASPECTO_2", "POR_QUE_2", "ASPECTO_3", "POR_QUE_3",
+    "CONCEITOS_TEORICOS", "ANALISE_CONCEITO_1", "ENTENDIMENTO_TEORICO", "SOLUCOES_TEORICAS",
+    "RESUMO_MEMORIAL", "CONTEXTO_MEMORIAL", "ANALISE_MEMORIAL", "PROPOSTAS_MEMORIAL",
+    "CONCLUSAO_MEMORIAL", "REFERENCIAS_ADICIONAIS", "AUTOAVALIACAO_MEMORIAL"
+]
+
+FRASES = [
+    "A equipe identificou falhas de comunicação entre os setores durante a implantação do projeto.",
+    "Isso atrasou entregas.",
+    "Segundo a **teoria da contingência**, não existe uma única forma correta de organizar uma empresa, e a estrutura deve responder ao ambiente.",
+    "Por que a liderança demorou a agir diante dos primeiros sinais de conflito?",
+    "Os indicadores de desempenho mostraram queda de produtividade no segundo trimestre, especialmente nas áreas operacionais.",
+    "A proposta envolve reuniões quinzenais, um painel compartilhado de metas e a revisão dos fluxos de aprovação.",
+]
+
+
+# =========================================================
+# DADOS REALISTAS
+# =========================================================
+def texto_longo(total_frases, semente):
+    return " ".join(FRASES[(semente + i) % len(FRASES)] for i in range(total_frases))
+
+
+def dicionario_motor_1():
+    dic = {}
+    for i, chave in enumerate(CHAVES_MOTOR_1):
+        tamanho = 40 if chave.endswith("_MEMORIAL") else 6
+        dic[f"{{{{{chave}}}}}"] = texto_longo(tamanho, i)
+    return dic
+
+
+def dicionario_motor_2(quantidade_datas=30):
+    dic = {
+        "{{NOME_ALUNO}}": "Maria Aparecida dos Santos Oliveira",
+        "{{MATRICULA}}": "8689599",
+        "{{CURSO}}": "Engenharia Ambiental e Sanitária"
+    }
+    inicio = date(2026, 3, 2)
+    for i in range(quantidade_datas):
+        dic[f"{{{{DATA_{i+1}}}}}"] = (inicio + timedelta(days=i)).strftime('%d/%m/%Y')
+    return dic
+
+
+def upload_sintetico(paragrafos_instrucao, imagens):
+    """DOCX parecido com o que o aluno envia: instruções, o marcador, o memorial e fotos."""
+    from docx import Document
+    from docx.shared import Cm
+
+    with zipfile.ZipFile(os.path.join(PASTA, 'TEMPLATE_FICHA_PARANA.docx')) as zf:
+        foto = zf.read('word/media/image1.jpeg')
+
+    doc = Document()
+    for i in range(paragrafos_instrucao):
+        doc.add_paragraph(texto_longo(3, i))
+    for _ in range(imagens):
+        doc.add_picture(io.BytesIO(foto), width=Cm(10))
+    doc.add_paragraph("Lembre-se também de salvar este documento antes de enviar.")
+    doc.add_paragraph("Memorial Analítico")
+    for i, titulo in enumerate(["Resumo", "Contextualização do desafio", "Análise", "Propostas de solução",
+                                "Conclusão reflexiva", "Referências", "Autoavaliação"]):
+        doc.add_paragraph(titulo)
+        doc.add_paragraph(texto_longo(25, i))
+
+    saida = io.BytesIO()
+    doc.save(saida)
+    return saida.getvalue()
+
+
+# =========================================================
+# CENÁRIOS
+# =========================================================
+def preparar_cenario(nome):
+    """Devolve a função a medir (sem argumentos). Tudo que é preparo fica fora da medição."""
+    import documentos
+
+    if nome == "motor1_com_tags":
+        caminho, dic = os.path.join(PASTA, 'TEMPLATE_COM_TAGS.docx'), dicionario_motor_1()
+        return lambda: documentos.renderizar_template_com_tags(caminho, dic)
+
+    if nome == "motor1_acerto_cache":
+        caminho, dic = os.path.join(PASTA, 'TEMPLATE_COM_TAGS.docx'), dicionario_motor_1()
+        documentos.preencher_template_com_tags(caminho, dic)
+        return lambda: documentos.preencher_template_com_tags(caminho, dic)
+
+    if nome in ("motor2_evidencias", "motor2_ficha"):
+        arquivo = 'TEMPLATE_EVIDENCIAS_PARANA.docx' if nome == "motor2_evidencias" else 'TEMPLATE_FICHA_PARANA.docx'
+        caminho, dic = os.path.join(PASTA, arquivo), dicionario_motor_2()
+        documentos.obter_template_compilado(caminho)
+        return lambda: documentos.renderizar_template_extensao(caminho, dic)
+
+    if nome == "motor2_compilacao_ficha":
+        with open(os.path.join(PASTA, 'TEMPLATE_FICHA_PARANA.docx'), 'rb') as f:
+            dados = f.read()
+        return lambda: documentos.TemplateCompilado(dados)
+
+    if nome == "etapa5_upload_pequeno":
+        dados = upload_sintetico(40, 0)
+        return lambda: documentos.extrair_etapa_5(dados)
+
+    if nome == "etapa5_upload_com_fotos":
+        dados = upload_sintetico(400, 12)
+        return lambda: documentos.extrair_etapa_5(dados)
+
+    raise ValueError(f"Cenário desconhecido: {nome}")
+
+
+CENARIOS = [
+    "motor1_com_tags", "motor1_acerto_cache", "motor2_evidencias", "motor2_ficha",
+    "motor2_compilacao_ficha", "etapa5_upload_pequeno", "etapa5_upload_com_fotos"
+]
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    baixo, alto = int(k), min(int(k) + 1, len(ordenados) - 1)
+    return ordenados[baixo] + (ordenados[alto] - ordenados[baixo]) * (k - baixo)
+
+
+def medir_cenario(nome, repeticoes, aquecimento):
+    # Roda dentro de um processo novo: cache de renderização isolado e RSS só deste cenário
+    os.environ['CACHE_RENDER_DIR'] = tempfile.mkdtemp(prefix='bench_cache_')
+    sys.path.insert(0, PASTA)
+    funcao = preparar_cenario(nome)
+
+    for _ in range(aquecimento):
+        funcao()
+
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+
+    # Alocações medidas numa execução à parte (o tracemalloc distorce o tempo)
+    tracemalloc.start()
+    funcao()
+    atual, pico = tracemalloc.get_traced_memory()
+    blocos = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    tracemalloc.stop()
+
+    return {
+        "repeticoes": repeticoes,
+        "ms_p50": round(percentil(tempos, 50), 3),
+        "ms_p90": round(percentil(tempos, 90), 3),
+        "ms_p99": round(percentil(tempos, 99), 3),
+        "ms_min": round(min(tempos), 3),
+        "ms_max": round(max(tempos), 3),
+        "alocacao_pico_bytes": pico,
+        "alocacao_retida_bytes": atual,
+        "blocos_retidos": blocos,
+        "rss_pico_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def executar(cenarios, repeticoes, aquecimento):
+    contexto = multiprocessing.get_context('spawn')
+    resultados = {}
+    for nome in cenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as pool:
+            resultados[nome] = pool.submit(medir_cenario, nome, repeticoes, aquecimento).result()
+        r = resultados[nome]
+        print(f"{nome:<28} p50 {r['ms_p50']:>9.2f} ms | p90 {r['ms_p90']:>9.2f} ms | p99 {r['ms_p99']:>9.2f} ms | "
+              f"pico alocado {r['alocacao_pico_bytes'] / 1024:>9.0f} KB | RSS {r['rss_pico_kb'] / 1024:>6.1f} MB")
+    return {
+        "data": datetime.utcnow().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "maquina": platform.machine(),
+        "repeticoes": repeticoes,
+        "cenarios": resultados
+    }
+
+
+def comparar(atual, base, tolerancia):
+    """Imprime a variação de p50/p90 contra a base. Devolve True se algum cenário piorou além da tolerância."""
+    piorou = False
+    print(f"\nComparação com a base de {base.get('data', '?')} (tolerância {tolerancia:.0%}):")
+    for nome, r in atual["cenarios"].items():
+        ref = base.get("cenarios", {}).get(nome)
+        if not ref:
+            print(f"{nome:<28} (sem base)")
+            continue
+        linha = []
+        for metrica in ("ms_p50", "ms_p90"):
+            variacao = (r[metrica] - ref[metrica]) / ref[metrica] if ref[metrica] else 0.0
+            linha.append(f"{metrica} {ref[metrica]:.2f} -> {r[metrica]:.2f} ({variacao:+.1%})")
+            if variacao > tolerancia:
+                piorou = True
+        print(f"{nome:<28} " + " | ".join(linha))
+    return piorou
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark dos motores de documentos.")
+    parser.add_argument('--repeticoes', type=int, default=30)
+    parser.add_argument('--aquecimento', type=int, default=3)
+    parser.add_argument('--cenarios', nargs='*', default=CENARIOS, choices=CENARIOS)
+    parser.add_argument('--saida', help="Arquivo JSON onde salvar o resultado.")
+    parser.add_argument('--comparar', help="JSON de uma execução anterior para usar como base.")
+    parser.add_argument('--tolerancia', type=float, default=0.10, help="Piora máxima aceita no p50/p90 (0.10 = 10%%).")
+    args = parser.parse_args()
+
+    resultado = executar(args.cenarios, args.repeticoes, args.aquecimento)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        if comparar(resultado, base, args.tolerancia):
+            sys.exit(1)
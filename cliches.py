@@ -0,0 +1,210 @@
+import re
+
+# =========================================================
+# LÉXICO DE CLICHÊS DE IA (UM ÚNICO MATCHER COMPILADO)
+# =========================================================
+# Termo -> substituto. É o padrão de fábrica (as 16 trocas de sempre); o admin edita a lista em /configuracoes
+SUBSTITUICOES_PADRAO = [
+    ("momentum", "impulso"),
+    ("locus", "ambiente"),
+    ("outrossim", "além disso"),
+    ("dessarte", "assim"),
+    ("destarte", "assim"),
+    ("um mergulho profundo", "uma análise detalhada"),
+    ("mergulho profundo", "análise detalhada"),
+    ("tapeçaria de", "conjunto de"),
+    ("tapeçaria", "estrutura"),
+    ("farol", "guia"),
+    ("crucial", "essencial"),
+    ("vital", "essencial"),
+    ("adentrar", "explorar"),
+    ("testamento", "prova"),
+    ("paisagem", "cenário"),
+    ("notável", "importante"),
+]
+
+# Palavras que não flexionam dentro de uma expressão ("tapeçaria de" -> "tapeçarias de")
+PALAVRAS_FIXAS = {"de", "da", "do", "das", "dos", "em", "e", "a", "o", "as", "os", "para", "com", "por", "além", "disso", "assim"}
+ARTIGOS_PLURAL = {"um": "uns", "uma": "umas"}
+# Termos que não passam pela flexão (advérbios, latinismos, verbos)
+INVARIAVEIS = {"momentum", "locus", "outrossim", "dessarte", "destarte", "adentrar"}
+# Marca, no texto do admin, as entradas que são adjetivos: "multifacetada = complexa | adjetivo"
+MARCA_ADJETIVO = "adjetivo"
+
+
+def plural(palavra):
+    """Plural regular do português, o suficiente para adjetivos e substantivos do léxico."""
+    if palavra in ARTIGOS_PLURAL:
+        return ARTIGOS_PLURAL[palavra]
+    if palavra in PALAVRAS_FIXAS or len(palavra) < 3:
+        return palavra
+    if palavra.endswith("ão"):
+        return palavra[:-2] + "ões"
+    if palavra.endswith("vel"):
+        return palavra[:-3] + "veis"
+    if palavra.endswith("al"):
+        return palavra[:-2] + "ais"
+    if palavra.endswith("el"):
+        return palavra[:-2] + "éis"
+    if palavra.endswith("ol"):
+        return palavra[:-2] + "óis"
+    if palavra.endswith("ul"):
+        return palavra[:-2] + "uis"
+    if palavra.endswith("il"):
+        return palavra[:-2] + "is"
+    if palavra.endswith("m"):
+        return palavra[:-1] + "ns"
+    if palavra.endswith(("r", "z")):
+        return palavra + "es"
+    if palavra.endswith(("s", "x")):
+        return palavra
+    return palavra + "s"
+
+
+def plural_expressao(expressao):
+    return " ".join(plural(p) for p in expressao.split())
+
+
+def trocar_genero(palavra):
+    if palavra.endswith("o"):
+        return palavra[:-1] + "a"
+    if palavra.endswith("a"):
+        return palavra[:-1] + "o"
+    return None
+
+
+def flexoes(termo, substituto, adjetivo=False):
+    """
+    Pares (variante do termo, variante do substituto) na mesma flexão: singular e plural
+    e, só para entradas marcadas como adjetivo (uma palavra, terminada em -o/-a), os dois
+    gêneros ("multifacetada" -> "multifacetado", "multifacetados"...). Substantivos não
+    mudam de gênero: "testamento" não vira "testamenta".
+    """
+    termo, substituto = normalizar(termo), normalizar(substituto)
+    pares = [(termo, substituto)]
+    if termo in INVARIAVEIS:
+        return pares
+
+    if adjetivo and " " not in termo:
+        outro_termo, outro_substituto = trocar_genero(termo), trocar_genero(substituto.split()[-1])
+        if outro_termo and outro_substituto:
+            pares.append((outro_termo, " ".join(substituto.split()[:-1] + [outro_substituto])))
+
+    pares += [(plural_expressao(t), plural_expressao(s)) for t, s in list(pares)]
+    return pares
+
+
+def normalizar(texto):
+    return " ".join((texto or "").lower().split())
+
+
+def flexionar_termos(termos):
+    """Só os termos (sem substitutos), já com todas as flexões. Usado pelo detector."""
+    return sorted({variante for termo in termos for variante, _ in flexoes(termo, termo)})
+
+
+def compilar_padrao(termos):
+    """
+    Uma regex só para todos os termos, montada como uma trie: os prefixos comuns são
+    testados uma vez e a alternativa mais longa ganha ("um mergulho profundo" antes de
+    "mergulho profundo"). Espaços dentro de expressões aceitam qualquer espaço em branco.
+    """
+    trie = {}
+    for termo in termos:
+        if not termo:
+            continue
+        no = trie
+        for letra in termo:
+            no = no.setdefault(letra, {})
+        no[""] = {}
+
+    def montar(no):
+        termina_aqui = "" in no
+        ramos = [(r"\s+" if letra == " " else re.escape(letra)) + montar(filho) for letra, filho in sorted(no.items()) if letra]
+        if not ramos:
+            return ""
+        if len(ramos) == 1 and not termina_aqui:
+            return ramos[0]
+        return "(?:" + "|".join(ramos) + ")" + ("?" if termina_aqui else "")
+
+    if not trie:
+        return None
+    return re.compile(r"(?<!\w)" + montar(trie) + r"(?!\w)", re.IGNORECASE)
+
+
+def ajustar_caixa(original, substituto):
+    if len(original) > 1 and original.isupper():
+        return substituto.upper()
+    if original[:1].isupper():
+        return substituto[:1].upper() + substituto[1:]
+    return substituto
+
+
+class LexicoCliches:
+    """Todas as substituições num passe só: uma regex compilada e um dicionário de troca."""
+
+    def __init__(self, entradas=None):
+        # Entradas (termo, substituto) ou (termo, substituto, adjetivo)
+        self.entradas = [(e[0], e[1], bool(e[2:] and e[2])) for e in (entradas if entradas is not None else SUBSTITUICOES_PADRAO)]
+        self.trocas = {}
+        for termo, substituto, adjetivo in self.entradas:
+            for variante, troca in flexoes(termo, substituto, adjetivo):
+                self.trocas.setdefault(variante, troca)
+        self.padrao = compilar_padrao(self.trocas)
+
+    def trocar(self, achado):
+        original = achado.group(0)
+        return ajustar_caixa(original, self.trocas.get(normalizar(original), original))
+
+    def substituir(self, texto):
+        if not texto or self.padrao is None:
+            return texto
+        return self.padrao.sub(self.trocar, texto)
+
+    def contar(self, texto):
+        if not texto or self.padrao is None:
+            return 0
+        return sum(1 for _ in self.padrao.finditer(texto))
+
+    def termos(self):
+        """Todos os termos já flexionados (o detector soma o léxico do admin aos seus)."""
+        return sorted(self.trocas)
+
+
+def ler_lexico(texto):
+    """
+    Uma entrada por linha no formato 'termo = substituto', com '| adjetivo' no fim para
+    flexionar também o gênero. Linhas em branco ou com # são ignoradas.
+    """
+    entradas = []
+    for linha in (texto or "").splitlines():
+        linha = linha.strip()
+        if not linha or linha.startswith("#") or "=" not in linha:
+            continue
+        termo, resto = (parte.strip() for parte in linha.split("=", 1))
+        substituto, _, marca = (parte.strip() for parte in resto.partition("|"))
+        if termo and substituto:
+            entradas.append((termo, substituto, marca.lower() == MARCA_ADJETIVO))
+    return entradas
+
+
+def formatar_lexico(entradas):
+    linhas = []
+    for termo, substituto, *adjetivo in entradas:
+        linhas.append(f"{termo} = {substituto}" + (f" | {MARCA_ADJETIVO}" if adjetivo and adjetivo[0] else ""))
+    return "\n".join(linhas)
+
+
+LEXICO_ATIVO = LexicoCliches()
+
+
+def obter_lexico():
+    return LEXICO_ATIVO
+
+
+def configurar_lexico(texto):
+    """Troca o léxico do processo pelo texto salvo no admin (vazio = padrão de fábrica)."""
+    global LEXICO_ATIVO
+    entradas = ler_lexico(texto)
+    LEXICO_ATIVO = LexicoCliches(entradas or None)
+    return LEXICO_ATIVO
@@ -0,0 +1,97 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# =========================================================
+# CLIENTES HTTP COMPARTILHADOS (POOL + KEEP-ALIVE POR PROVEDOR)
+# =========================================================
+HTTP_POOL_CONEXOES = int(os.environ.get("HTTP_POOL_CONEXOES", 4))
+HTTP_POOL_MAX = int(os.environ.get("HTTP_POOL_MAX", 20))
+HTTP_TIMEOUT_CONEXAO = float(os.environ.get("HTTP_TIMEOUT_CONEXAO", 10))
+
+# Timeout de leitura de cada provedor (segundos); o de conexão é sempre curto
+TIMEOUTS_LEITURA = {
+    "openrouter": float(os.environ.get("HTTP_TIMEOUT_OPENROUTER", 180)),
+    "openrouter_saldo": 10.0,
+    "google": float(os.environ.get("HTTP_TIMEOUT_GOOGLE", 180)),
+    "convertapi": float(os.environ.get("PDF_TIMEOUT", 120)),
+}
+
+ADAPTADORES = {}
+CLIENTES_GOOGLE = {}
+TRAVA_CLIENTES = threading.Lock()
+SESSOES_POR_THREAD = threading.local()
+
+
+def timeout(provedor):
+    """Par (conexão, leitura) no formato do requests."""
+    return (HTTP_TIMEOUT_CONEXAO, TIMEOUTS_LEITURA.get(provedor, 60.0))
+
+
+def obter_adaptador(provedor):
+    with TRAVA_CLIENTES:
+        adaptador = ADAPTADORES.get(provedor)
+        if adaptador is None:
+            # Só falhas de conexão são repetidas: um POST que chegou ao provedor nunca é reenviado
+            adaptador = HTTPAdapter(
+                pool_connections=HTTP_POOL_CONEXOES,
+                pool_maxsize=HTTP_POOL_MAX,
+                pool_block=False,
+                max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3)
+            )
+            ADAPTADORES[provedor] = adaptador
+        return adaptador
+
+
+def obter_sessao(provedor):
+    """
+    Sessão do requests para o provedor. Cada thread tem a sua (o Session guarda cookies
+    e não é garantido entre threads), mas todas montam o mesmo adaptador: o pool de
+    conexões TLS abertas é um só por provedor e é reaproveitado por todas as threads.
+    """
+    sessoes = getattr(SESSOES_POR_THREAD, "sessoes", None)
+    if sessoes is None:
+        sessoes = SESSOES_POR_THREAD.sessoes = {}
+
+    sessao = sessoes.get(provedor)
+    if sessao is None:
+        sessao = requests.Session()
+        adaptador = obter_adaptador(provedor)
+        sessao.mount("https://", adaptador)
+        sessao.mount("http://", adaptador)
+        sessoes[provedor] = sessao
+    return sessao
+
+
+def obter_cliente_google(chave_google):
+    """Um genai.Client por chave, criado uma vez: o httpx interno mantém as conexões vivas."""
+    with TRAVA_CLIENTES:
+        cliente = CLIENTES_GOOGLE.get(chave_google)
+        if cliente is None:
+            import httpx
+            from google import genai
+            from google.genai import types
+
+            limites = httpx.Limits(max_connections=HTTP_POOL_MAX, max_keepalive_connections=HTTP_POOL_CONEXOES)
+            cliente = genai.Client(api_key=chave_google, http_options=types.HttpOptions(
+                timeout=int(TIMEOUTS_LEITURA["google"] * 1000),
+                client_args={"limits": limites},
+                async_client_args={"limits": limites}
+            ))
+            CLIENTES_GOOGLE[chave_google] = cliente
+        return cliente
+
+
+def criar_cliente_async(provedor):
+    """httpx.AsyncClient com os mesmos limites de pool e timeouts; deve ser criado dentro do event loop que vai usá-lo."""
+    import httpx
+
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(TIMEOUTS_LEITURA.get(provedor, 60.0), connect=HTTP_TIMEOUT_CONEXAO),
+        transport=httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=HTTP_POOL_MAX, max_keepalive_connections=HTTP_POOL_CONEXOES),
+            retries=2
+        )
+    )
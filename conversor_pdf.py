@@ -0,0 +1,244 @@
+import os
+import time
+import atexit
+import signal
+import base64
+import queue
+import socket
+import shutil
+import logging
+import pathlib
+import tempfile
+import threading
+import subprocess
+import xmlrpc.client
+import clientes_http
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as TempoEsgotado
+
+# =========================================================
+# CONVERSÃO DOCX -> PDF (MOTORES PLUGÁVEIS)
+# =========================================================
+MOTORES_PDF = {
+    "convertapi": "ConvertAPI (Nuvem)",
+    "local": "LibreOffice Local (Pool de Workers, via unoserver)"
+}
+
+LIBREOFFICE_BIN = os.environ.get("LIBREOFFICE_BIN", "soffice")
+# unoserver (pip install unoserver, no Python que enxerga o módulo uno do LibreOffice)
+UNOSERVER_BIN = os.environ.get("UNOSERVER_BIN", "unoserver")
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", 2))
+PDF_TIMEOUT = int(os.environ.get("PDF_TIMEOUT", 120))
+PDF_JOBS_POR_WORKER = int(os.environ.get("PDF_JOBS_POR_WORKER", 50))
+PDF_TIMEOUT_INICIO = int(os.environ.get("PDF_TIMEOUT_INICIO", 60))
+# Quanto o chamador espera, fila incluída, antes de desistir do trabalho
+PDF_ESPERA_MAXIMA = PDF_TIMEOUT + 30
+
+POOL_CONVERTAPI = ThreadPoolExecutor(max_workers=4)
+POOL_LOCAL = None
+TRAVA_POOL_LOCAL = threading.Lock()
+
+
+def converter_convertapi(nome_arquivo, dados_docx, chave_convertapi):
+    if not chave_convertapi:
+        raise Exception("Cadastre a Secret Key da ConvertAPI.")
+
+    res = clientes_http.obter_sessao("convertapi").post(
+        f'https://v2.convertapi.com/convert/docx/to/pdf?Secret={chave_convertapi}',
+        files={'File': (nome_arquivo, dados_docx)},
+        timeout=clientes_http.timeout("convertapi")
+    ).json()
+
+    if 'Files' in res:
+        return base64.b64decode(res['Files'][0]['FileData'])
+    raise Exception(res.get('Message', 'Falha na conversão.'))
+
+
+class TransporteComTimeout(xmlrpc.client.Transport):
+    """O ServerProxy padrão espera para sempre; o worker precisa de um limite por conversão."""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conexao = super().make_connection(host)
+        conexao.timeout = self.timeout
+        return conexao
+
+
+def porta_livre():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class WorkerLibreOffice:
+    """
+    Um unoserver de vida longa: o soffice headless sobe uma vez, com perfil próprio,
+    e cada conversão é só uma chamada XML-RPC (biblioteca padrão, o app não precisa
+    das bindings UNO; quem precisa é o unoserver).
+    """
+
+    def __init__(self, n, timeout):
+        self.n = n
+        self.timeout = timeout
+        self.processo = None
+        self.perfil = None
+        self.porta = None
+
+    def ativo(self):
+        return self.processo is not None and self.processo.poll() is None
+
+    def iniciar(self):
+        self.perfil = tempfile.mkdtemp(prefix=f"lo_perfil_{self.n}_")
+        self.porta = porta_livre()
+        comando = [
+            UNOSERVER_BIN, "--interface", "127.0.0.1", "--port", str(self.porta), "--uno-port", str(porta_livre()),
+            "--executable", LIBREOFFICE_BIN, "--user-installation", pathlib.Path(self.perfil).as_uri()
+        ]
+        try:
+            self.processo = subprocess.Popen(comando, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError as e:
+            self.parar()
+            raise Exception(f"Não foi possível iniciar o unoserver ({UNOSERVER_BIN}): {e}")
+
+        # O XML-RPC só abre a porta depois que o soffice subiu e aceitou a conexão UNO
+        prazo = time.monotonic() + PDF_TIMEOUT_INICIO
+        while time.monotonic() < prazo:
+            if self.processo.poll() is not None:
+                self.parar()
+                raise Exception("O unoserver encerrou durante a inicialização do LibreOffice.")
+            try:
+                socket.create_connection(("127.0.0.1", self.porta), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.25)
+        self.parar()
+        raise Exception(f"LibreOffice não ficou pronto em {PDF_TIMEOUT_INICIO}s.")
+
+    def converter(self, dados_docx):
+        proxy = xmlrpc.client.ServerProxy(f"http://127.0.0.1:{self.porta}", allow_none=True, transport=TransporteComTimeout(self.timeout))
+        try:
+            # convert(inpath, indata, outpath, convert_to): sem caminhos, os bytes vão e voltam pela chamada
+            resultado = proxy.convert(None, xmlrpc.client.Binary(dados_docx), None, "pdf")
+        except socket.timeout:
+            raise Exception(f"LibreOffice excedeu o tempo limite de {self.timeout}s.")
+        except (xmlrpc.client.Error, OSError) as e:
+            raise Exception(f"LibreOffice falhou na conversão: {str(e)[:300]}")
+
+        pdf = resultado.data if isinstance(resultado, xmlrpc.client.Binary) else resultado
+        if not pdf:
+            raise Exception("LibreOffice falhou na conversão: resposta vazia.")
+        return pdf
+
+    def parar(self):
+        if self.processo is not None:
+            # Mata o grupo inteiro (o unoserver dispara o soffice e o soffice.bin como filhos)
+            try:
+                os.killpg(self.processo.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.processo.wait()
+            self.processo = None
+        if self.perfil:
+            shutil.rmtree(self.perfil, ignore_errors=True)
+            self.perfil = None
+
+
+class PoolLibreOffice:
+    """
+    Workers fixos alimentados por uma fila. Cada worker mantém o seu LibreOffice
+    aberto (WorkerLibreOffice) e o recicla após N trabalhos, num timeout ou numa
+    falha. Trabalhos cujo chamador já desistiu (Future cancelado) são pulados.
+    """
+
+    def __init__(self, total_workers=PDF_WORKERS, timeout=PDF_TIMEOUT, jobs_por_worker=PDF_JOBS_POR_WORKER):
+        self.fila = queue.Queue()
+        self.timeout = timeout
+        self.jobs_por_worker = jobs_por_worker
+        self.workers = [WorkerLibreOffice(n, timeout) for n in range(max(1, total_workers))]
+        for worker in self.workers:
+            threading.Thread(target=self.trabalhar, args=(worker,), daemon=True, name=f"pdf-worker-{worker.n}").start()
+        atexit.register(self.encerrar)
+
+    def enviar(self, dados_docx):
+        futuro = Future()
+        self.fila.put((dados_docx, futuro))
+        return futuro
+
+    def trabalhar(self, worker):
+        # Aquece já na criação do pool; se falhar, o primeiro trabalho tenta de novo
+        try:
+            worker.iniciar()
+        except Exception as e:
+            logging.error(f"pdf-worker-{worker.n}: {e}")
+        jobs = 0
+
+        while True:
+            dados_docx, futuro = self.fila.get()
+            if not futuro.set_running_or_notify_cancel():
+                continue
+
+            reciclar = False
+            try:
+                if not worker.ativo():
+                    worker.parar()
+                    worker.iniciar()
+                    jobs = 0
+                futuro.set_result(worker.converter(dados_docx))
+            except Exception as e:
+                futuro.set_exception(e)
+                reciclar = True
+
+            jobs += 1
+            if reciclar or jobs >= self.jobs_por_worker:
+                worker.parar()
+                jobs = 0
+
+    def encerrar(self):
+        for worker in self.workers:
+            worker.parar()
+
+
+def obter_pool_local():
+    global POOL_LOCAL
+    with TRAVA_POOL_LOCAL:
+        if POOL_LOCAL is None:
+            POOL_LOCAL = PoolLibreOffice()
+        return POOL_LOCAL
+
+
+def enviar_conversao(nome_arquivo, dados_docx, motor="convertapi", chave_convertapi=None):
+    """Agenda a conversão no motor escolhido e devolve um Future com os bytes do PDF."""
+    if motor == "local":
+        return obter_pool_local().enviar(dados_docx)
+    return POOL_CONVERTAPI.submit(converter_convertapi, nome_arquivo, dados_docx, chave_convertapi)
+
+
+def aguardar(futuro, prazo):
+    """Espera até o prazo (time.monotonic); se o chamador desiste, o trabalho sai da fila."""
+    try:
+        return futuro.result(timeout=max(0, prazo - time.monotonic()))
+    except TempoEsgotado:
+        futuro.cancel()
+        raise Exception(f"A conversão para PDF não terminou em {PDF_ESPERA_MAXIMA}s.")
+
+
+def converter_docx_para_pdf(nome_arquivo, dados_docx, motor="convertapi", chave_convertapi=None):
+    futuro = enviar_conversao(nome_arquivo, dados_docx, motor, chave_convertapi)
+    return aguardar(futuro, time.monotonic() + PDF_ESPERA_MAXIMA)
+
+
+def converter_varios_para_pdf(arquivos, motor="convertapi", chave_convertapi=None):
+    """Converte [(nome, bytes), ...] em paralelo. Devolve os PDFs na mesma ordem (None onde falhou)."""
+    futuros = [enviar_conversao(nome, dados, motor, chave_convertapi) for nome, dados in arquivos]
+    # Um prazo só para o lote: esperar um arquivo não soma tempo de espera aos seguintes
+    prazo = time.monotonic() + PDF_ESPERA_MAXIMA
+    resultados = []
+    for (nome, _), futuro in zip(arquivos, futuros):
+        try:
+            resultados.append(aguardar(futuro, prazo))
+        except Exception as e:
+            logging.error(f"Falha ao converter {nome} para PDF: {e}")
+            resultados.append(None)
+    return resultados
@@ -0,0 +1,220 @@
+import re
+import json
+import math
+import hashlib
+import threading
+import statistics
+from collections import OrderedDict
+import cliches
+
+# =========================================================
+# DETECTOR LOCAL DE TEXTO DE IA (SEM CHAMADAS DE REDE)
+# =========================================================
+# Clichês que o prompt do /analisar_ia_trecho cita; o app soma a eles os termos do léxico editável (cliches.py)
+LEXICO_CLICHES = [
+    "crucial", "vital", "notável", "locus", "momentum", "outrossim", "dessarte", "destarte",
+    "mergulho profundo", "mergulhar", "tapeçaria", "farol", "adentrar", "testamento", "paisagem",
+    "em suma", "multifacetada", "multifacetado", "teia", "intrincado", "intrincada"
+]
+
+PALAVRA = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*", re.UNICODE)
+FIM_DE_FRASE = re.compile(r"(?<=[.!?…])\s+|\n+")
+PONTUACAO_INTERNA = re.compile(r"[,;:—()–]")
+
+# Faixas do radar no editor: perto delas uma nota incerta muda a cor do selo
+LIMIARES_RADAR = (35, 70)
+JANELA_TTR = 50
+# Abaixo de MIN_CARACTERES a nota é 0, como sempre foi; entre isso e MIN_PALAVRAS não há
+# frases que cheguem para medir ritmo e diversidade, e a nota é incerta (ver pontuar)
+MIN_CARACTERES = 25
+MIN_PALAVRAS = 25
+# Nota sem evidência nenhuma: o meio da escala, onde a regressão fica com todos os desvios nulos
+NOTA_NEUTRA = 50
+# Notas já calculadas por detector: uma seção que não mudou depois de uma edição não é reavaliada
+MEMORIA_MAX_ITENS = 4096
+
+NOMES_CARACTERISTICAS = ["cliches", "variacao_frases", "diversidade_lexical", "variacao_pontuacao", "tamanho_medio_frase"]
+
+# Valores típicos de texto acadêmico humano e a escala de cada característica: o modelo
+# recebe o desvio padronizado, então os pesos são comparáveis entre si
+CENTROS = {
+    "cliches": 0.3,
+    "variacao_frases": 0.5,
+    "diversidade_lexical": 0.72,
+    "variacao_pontuacao": 0.8,
+    "tamanho_medio_frase": 22.0
+}
+ESCALAS = {
+    "cliches": 1.0,
+    "variacao_frases": 0.2,
+    "diversidade_lexical": 0.05,
+    "variacao_pontuacao": 0.3,
+    "tamanho_medio_frase": 8.0
+}
+
+# Pesos de partida da regressão logística; a calibração com as notas antigas da IA os substitui
+PESOS_PADRAO = {
+    "intercepto": -0.6,
+    "cliches": 1.1,
+    "variacao_frases": -0.6,
+    "diversidade_lexical": -0.4,
+    "variacao_pontuacao": -0.35,
+    "tamanho_medio_frase": 0.4
+}
+
+
+def compilar_lexico(termos):
+    # Mesmo matcher do limpar_texto_ia: uma trie compilada com as flexões de cada termo
+    return cliches.compilar_padrao(cliches.flexionar_termos(termos))
+
+
+def coeficiente_variacao(valores):
+    if len(valores) < 2:
+        return None
+    media = statistics.fmean(valores)
+    if media == 0:
+        return 0.0
+    return statistics.pstdev(valores) / media
+
+
+def diversidade_lexical(palavras, janela=JANELA_TTR):
+    """Type/token ratio em janela móvel (MATTR): não cai só porque o texto é longo."""
+    if len(palavras) <= janela:
+        return len(set(palavras)) / len(palavras)
+    contagem = {}
+    for p in palavras[:janela]:
+        contagem[p] = contagem.get(p, 0) + 1
+    soma = len(contagem)
+    for i in range(janela, len(palavras)):
+        entra, sai = palavras[i], palavras[i - janela]
+        contagem[entra] = contagem.get(entra, 0) + 1
+        contagem[sai] -= 1
+        if not contagem[sai]:
+            del contagem[sai]
+        soma += len(contagem)
+    return soma / (len(palavras) - janela + 1) / janela
+
+
+def extrair_caracteristicas(texto, regex_cliches):
+    palavras = [p.lower() for p in PALAVRA.findall(texto)]
+    if len(palavras) < MIN_PALAVRAS:
+        return None
+
+    frases = [f for f in FIM_DE_FRASE.split(texto.strip()) if PALAVRA.search(f)]
+    tamanhos = [len(PALAVRA.findall(f)) for f in frases]
+    pontuacao = [len(PONTUACAO_INTERNA.findall(f)) for f in frases]
+    total_cliches = len(regex_cliches.findall(texto)) if regex_cliches else 0
+
+    variacao_frases = coeficiente_variacao(tamanhos)
+    variacao_pontuacao = coeficiente_variacao(pontuacao)
+    return {
+        # Clichês por 100 palavras
+        "cliches": total_cliches * 100 / len(palavras),
+        # Uma frase só não tem ritmo nenhum para medir: conta como neutra
+        "variacao_frases": CENTROS["variacao_frases"] if variacao_frases is None else variacao_frases,
+        "diversidade_lexical": diversidade_lexical(palavras),
+        "variacao_pontuacao": CENTROS["variacao_pontuacao"] if variacao_pontuacao is None else variacao_pontuacao,
+        "tamanho_medio_frase": statistics.fmean(tamanhos) if tamanhos else 0.0
+    }
+
+
+def sigmoide(z):
+    if z < -40:
+        return 0.0
+    if z > 40:
+        return 1.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+def vetor(caracteristicas):
+    return [1.0] + [(caracteristicas[n] - CENTROS[n]) / ESCALAS[n] for n in NOMES_CARACTERISTICAS]
+
+
+class DetectorIA:
+    """
+    Nota de 0 a 100 (mesma escala do /analisar_ia_trecho) a partir da densidade de
+    clichês, da variação do tamanho das frases (burstiness), da diversidade lexical e
+    do ritmo da pontuação. É uma regressão logística: os pesos vêm calibrados pelas
+    notas que a IA deu no passado (ver calibrar) ou, sem amostras, dos PESOS_PADRAO.
+    """
+
+    def __init__(self, pesos=None, lexico=None):
+        pesos = dict(PESOS_PADRAO, **(pesos or {}))
+        self.coeficientes = [pesos["intercepto"]] + [pesos[n] for n in NOMES_CARACTERISTICAS]
+        self.regex_cliches = compilar_lexico(lexico if lexico is not None else LEXICO_CLICHES)
+        self.memoria = OrderedDict()
+        self.trava = threading.Lock()
+
+    def pontuar(self, texto):
+        """
+        Devolve (porcentagem, caracteristicas). Textos com menos de MIN_CARACTERES valem 0,
+        como antes; com menos de MIN_PALAVRAS valem NOTA_NEUTRA e voltam sem características,
+        o que o chamador trata como nota incerta.
+        """
+        chave = hashlib.sha1((texto or "").encode("utf-8")).digest()
+        with self.trava:
+            achado = self.memoria.get(chave)
+            if achado is not None:
+                self.memoria.move_to_end(chave)
+                return achado
+
+        caracteristicas = extrair_caracteristicas(texto or "", self.regex_cliches)
+        if len((texto or "").strip()) < MIN_CARACTERES:
+            resultado = 0, None
+        elif caracteristicas is None:
+            resultado = NOTA_NEUTRA, None
+        else:
+            z = sum(c * x for c, x in zip(self.coeficientes, vetor(caracteristicas)))
+            resultado = int(round(100 * sigmoide(z))), caracteristicas
+
+        with self.trava:
+            self.memoria[chave] = resultado
+            if len(self.memoria) > MEMORIA_MAX_ITENS:
+                self.memoria.popitem(last=False)
+        return resultado
+
+    def incerta(self, porcentagem, margem):
+        """Nota a menos de 'margem' pontos de uma faixa do radar (margem 0 = nunca)."""
+        return bool(margem) and any(abs(porcentagem - limiar) < margem for limiar in LIMIARES_RADAR)
+
+    def pesos(self):
+        return dict(zip(["intercepto"] + NOMES_CARACTERISTICAS, self.coeficientes))
+
+
+def calibrar(amostras, lexico=None, iteracoes=1000, taxa=0.3, regularizacao=0.01):
+    """
+    Ajusta os pesos a pares (texto, nota_da_ia) por descida de gradiente na
+    entropia cruzada com a nota como alvo (0..1). A regularização puxa para os
+    PESOS_PADRAO, o que mantém o modelo estável com poucas amostras.
+    Devolve (pesos, erro_medio_absoluto_em_pontos).
+    """
+    regex_cliches = compilar_lexico(lexico if lexico is not None else LEXICO_CLICHES)
+    dados = []
+    for texto, nota in amostras:
+        caracteristicas = extrair_caracteristicas(texto or "", regex_cliches)
+        if caracteristicas is not None and nota is not None:
+            dados.append((vetor(caracteristicas), max(0, min(100, nota)) / 100))
+    if not dados:
+        raise Exception("Nenhuma amostra utilizável para calibrar o detector.")
+
+    base = [PESOS_PADRAO["intercepto"]] + [PESOS_PADRAO[n] for n in NOMES_CARACTERISTICAS]
+    w = list(base)
+    n = len(dados)
+    for _ in range(iteracoes):
+        gradiente = [regularizacao * (wi - bi) for wi, bi in zip(w, base)]
+        for x, y in dados:
+            erro = sigmoide(sum(wi * xi for wi, xi in zip(w, x))) - y
+            for i, xi in enumerate(x):
+                gradiente[i] += erro * xi / n
+        w = [wi - taxa * gi for wi, gi in zip(w, gradiente)]
+
+    erro_medio = sum(abs(sigmoide(sum(wi * xi for wi, xi in zip(w, x))) - y) for x, y in dados) / n * 100
+    return dict(zip(["intercepto"] + NOMES_CARACTERISTICAS, w)), erro_medio
+
+
+def carregar_pesos(pesos_json):
+    try:
+        pesos = json.loads(pesos_json) if pesos_json else None
+    except ValueError:
+        return None
+    return pesos if isinstance(pesos, dict) else None
@@ -1,185 +1,750 @@
 import io
 import os
 import re
+import json
+import logging
+import copy
+import functools
+import hashlib
+import struct
+import tempfile
+import threading
+import zipfile
 from docx import Document
-from docx.oxml.text.paragraph import CT_P
 from docx.text.paragraph import Paragraph
-from docx.oxml.ns import qn
+from docx.oxml.ns import qn, nsmap
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from lxml import etree
+
+# =========================================================
+# GRAVAÇÃO NO NÍVEL DO ZIP (SEM RECOMPRIMIR AS IMAGENS)
+# =========================================================
+def copiar_entrada_crua(zip_origem, zip_destino, info):
+    # Lê os bytes já comprimidos da entrada (pula o cabeçalho local e o nome)
+    zip_origem.fp.seek(info.header_offset)
+    cabecalho = struct.unpack(zipfile.structFileHeader, zip_origem.fp.read(zipfile.sizeFileHeader))
+    zip_origem.fp.seek(cabecalho[zipfile._FH_FILENAME_LENGTH] + cabecalho[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+    bruto = zip_origem.fp.read(info.compress_size)
+
+    # Regrava o cabeçalho com CRC e tamanhos já conhecidos (sem data descriptor)
+    nova_info = copy.copy(info)
+    nova_info.flag_bits &= ~0x08
+    nova_info.header_offset = zip_destino.fp.tell()
+    zip_destino.fp.write(nova_info.FileHeader())
+    zip_destino.fp.write(bruto)
+    zip_destino.start_dir = zip_destino.fp.tell()
+    zip_destino.filelist.append(nova_info)
+    zip_destino.NameToInfo[nova_info.filename] = nova_info
+    zip_destino._didModify = True
+
+
+def salvar_docx_cru(dados_template, partes_xml):
+    """
+    Monta o .docx final a partir dos bytes do template: só as partes XML em
+    'partes_xml' ({'word/document.xml': elemento}) são serializadas e comprimidas,
+    o resto (imagens, estilos, temas) é copiado cru, na mesma ordem do original.
+    """
+    arquivo_saida = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(dados_template)) as zip_origem, \
+            zipfile.ZipFile(arquivo_saida, 'w', zipfile.ZIP_DEFLATED) as zip_destino:
+        for info in zip_origem.infolist():
+            elemento = partes_xml.get(info.filename)
+            if elemento is None:
+                copiar_entrada_crua(zip_origem, zip_destino, info)
+            else:
+                nova_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                nova_info.compress_type = zipfile.ZIP_DEFLATED
+                nova_info.external_attr = info.external_attr
+                zip_destino.writestr(nova_info, serialize_part_xml(elemento))
+    arquivo_saida.seek(0)
+    return arquivo_saida
+
+
+def ler_bytes_template(arquivo_template):
+    if isinstance(arquivo_template, (str, os.PathLike)):
+        with open(arquivo_template, 'rb') as f:
+            return f.read()
+    if isinstance(arquivo_template, bytes):
+        return arquivo_template
+    arquivo_template.seek(0)
+    return arquivo_template.read()
+
+
+TITULOS_MEMORIAL = [
+    "Resumo", "Contextualização do desafio", "Análise", 
+    "Propostas de solução", "Conclusão reflexiva", 
+    "Referências", "Autoavaliação"
+]
+TITULOS_ASPECTOS = ["Aspecto 1:", "Aspecto 2:", "Aspecto 3:", "Por quê:"]
+
+
+@functools.lru_cache(maxsize=64)
+def compilar_marcadores(marcadores):
+    # Um único matcher para todas as tags (as mais longas primeiro, para não cortar prefixos)
+    return re.compile("|".join(re.escape(m) for m in sorted(marcadores, key=len, reverse=True)))
+
+
+def formatar_texto_academico(texto_original):
+    for t in TITULOS_MEMORIAL:
+        if texto_original.strip().startswith(t): 
+            texto_original = texto_original.replace(t, f"**{t}**\n", 1)
+            
+    for t in TITULOS_ASPECTOS:
+        if t in texto_original: 
+            texto_original = texto_original.replace(t, f"\n**{t}** " if "Por quê:" in t else f"**{t}** ")
+            
+    if "?" in texto_original and "Por quê:" not in texto_original:
+        partes = texto_original.split("?", 1)
+        pergunta = partes[0].strip()
+        if 10 < len(pergunta) < 150 and not pergunta.startswith("**"):
+            texto_original = f"**{pergunta}?**\n" + partes[1].lstrip()
+            
+    return texto_original.replace("**\n ", "**\n").replace(":**\n:", ":**\n")
+
+
+@functools.lru_cache(maxsize=512)
+def markdown_para_runs(texto):
+    """Quebra o texto final do parágrafo em (pedaço, negrito). Calculado uma vez por texto."""
+    segmentos = []
+    linhas = texto.split('\n')
+    for i, linha in enumerate(linhas):
+        partes = linha.split('**')
+        for j, parte in enumerate(partes):
+            if parte: 
+                segmentos.append((parte, j % 2 == 1))
+        if i < len(linhas) - 1: 
+            segmentos.append(('\n', False))
+    return tuple(segmentos)
+
 
 def preencher_template_com_tags(arquivo_template, dicionario_dados):
     """
     MOTOR 1: Usado APENAS para os Trabalhos Acadêmicos gerados por IA.
     Aplica formatação Markdown (**negrito**) e regras específicas de títulos.
+    O resultado fica no cache de renderização (template + dicionário + versão).
     """
-    doc = Document(arquivo_template)
-    
-    def processar_paragrafo(paragrafo):
-        texto_original = paragrafo.text
-        tem_tag = False
-        
-        for marcador, texto_novo in dicionario_dados.items():
-            if marcador in texto_original:
-                texto_original = texto_original.replace(marcador, str(texto_novo))
-                tem_tag = True
+    return CACHE_RENDERIZACAO.obter_ou_gerar('motor1', VERSAO_MOTOR_1, arquivo_template, dicionario_dados, renderizar_template_com_tags)
+
+
+def renderizar_template_com_tags(arquivo_template, dicionario_dados):
+    # Parágrafos sem '{{' são pulados e todas as tags saem numa única varredura. Todas as
+    # chaves entram, como no motor antigo: o manifesto normaliza as tags e não vê todo texto
+    # que o python-docx junta num parágrafo, então filtrar por ele poderia deixar tag sem trocar
+    dados_template = ler_bytes_template(arquivo_template)
+    valores = {k: str(v) for k, v in dicionario_dados.items()}
+    doc = Document(io.BytesIO(dados_template))
+
+    if valores:
+        marcadores = compilar_marcadores(tuple(valores))
+        exige_chaves = all("{{" in k for k in valores)
+        substituir = lambda m: valores[m.group(0)]
+
+        # Parágrafos soltos do corpo + parágrafos das células das tabelas
+        for p in doc.element.body.xpath('./w:p | ./w:tbl/w:tr/w:tc/w:p'):
+            if exige_chaves and "{{" not in "".join(p.itertext(qn('w:t'))):
+                continue
                 
-        if tem_tag:
-            titulos_memorial = [
-                "Resumo", "Contextualização do desafio", "Análise", 
-                "Propostas de solução", "Conclusão reflexiva", 
-                "Referências", "Autoavaliação"
-            ]
-            for t in titulos_memorial:
-                if texto_original.strip().startswith(t): 
-                    texto_original = texto_original.replace(t, f"**{t}**\n", 1)
-                    
-            titulos_aspectos = ["Aspecto 1:", "Aspecto 2:", "Aspecto 3:", "Por quê:"]
-            for t in titulos_aspectos:
-                if t in texto_original: 
-                    texto_original = texto_original.replace(t, f"\n**{t}** " if "Por quê:" in t else f"**{t}** ")
-                    
-            if "?" in texto_original and "Por quê:" not in texto_original:
-                partes = texto_original.split("?", 1)
-                pergunta = partes[0].strip()
-                if 10 < len(pergunta) < 150 and not pergunta.startswith("**"):
-                    texto_original = f"**{pergunta}?**\n" + partes[1].lstrip()
-                    
-            texto_original = texto_original.replace("**\n ", "**\n").replace(":**\n:", ":**\n")
+            paragrafo = Paragraph(p, doc._body)
+            texto_original, total = marcadores.subn(substituir, paragrafo.text)
+            if not total:
+                continue
+
             paragrafo.clear()
-            linhas = texto_original.split('\n')
+            for parte, negrito in markdown_para_runs(formatar_texto_academico(texto_original)):
+                run = paragrafo.add_run(parte)
+                if negrito: 
+                    run.bold = True
+
+    # Só o document.xml mudou: o resto do pacote segue cru para a saída
+    return salvar_docx_cru(dados_template, {doc.part.partname.membername: doc.element})
+
+
+# =========================================================
+# MOTOR 2: TEMPLATES COMPILADOS (PROJETOS DE EXTENSÃO)
+# =========================================================
+MAX_TEMPLATES_COMPILADOS = 8
+TEMPLATES_COMPILADOS = {}
+HASH_POR_CAMINHO = {}
+TRAVA_TEMPLATES = threading.Lock()
+
+
+def arrumar_tag_quebrada(match):
+    # Remove lixos invisíveis e espaços (ex: {{ DATA_ 08 }} vira {{DATA_8}})
+    inner = match.group(1).replace(' ', '').replace('\u200b', '').replace('\xa0', '').upper()
+    inner = inner.replace('-', '_')
+    
+    if inner == 'NOMEALUNO': return '{{NOME_ALUNO}}'
+    if inner == 'MATRICULA': return '{{MATRICULA}}'
+    if inner == 'CURSO': return '{{CURSO}}'
+    
+    # Converte zeros extras (DATA_08 -> DATA_8)
+    if inner.startswith('DATA'):
+        num = inner.replace('DATA', '').replace('_', '')
+        if num.isdigit():
+            return f"{{{{DATA_{int(num)}}}}}"
             
-            for i, linha in enumerate(linhas):
-                partes = linha.split('**')
-                for j, parte in enumerate(partes):
-                    if parte: 
-                        run = paragrafo.add_run(parte)
-                        if j % 2 == 1: 
-                            run.bold = True
-                if i < len(linhas) - 1: 
-                    paragrafo.add_run('\n')
-
-    for paragrafo in doc.paragraphs: 
-        processar_paragrafo(paragrafo)
-        
-    for tabela in doc.tables:
-        for linha in tabela.rows:
-            for celula in linha.cells:
-                for paragrafo in celula.paragraphs: 
-                    processar_paragrafo(paragrafo)
+    return f"{{{{{inner}}}}}"
 
-    arquivo_saida = io.BytesIO()
-    doc.save(arquivo_saida)
-    arquivo_saida.seek(0)
-    return arquivo_saida
+
+def normalizar_tags(texto):
+    # Passa a vassoura nos espaços vazios e erros de digitação das chaves
+    texto_limpo = re.sub(r'[\u200b\u200c\u200d\ufeff\xa0]', '', texto)
+    return re.sub(r'\{\{(.*?)\}\}', arrumar_tag_quebrada, texto_limpo)
+
+
+# Runs que carregam imagem ou o "esqueleto" de uma Caixa de Texto, achados numa única consulta
+XPATH_RUNS_COM_FORMA = etree.XPath(
+    '//w:r[.//w:drawing or .//w:pict or .//w:object or .//v:shape]',
+    namespaces={'w': nsmap['w'], 'v': 'urn:schemas-microsoft-com:vml'}
+)
+
+
+def indexar_runs_com_forma(raiz):
+    return set(XPATH_RUNS_COM_FORMA(raiz))
+
+
+def substituir_marcadores(texto, dicionario_dados):
+    modificou = False
+    for marcador, valor in dicionario_dados.items():
+        if marcador in texto:
+            texto = texto.replace(marcador, str(valor))
+            modificou = True
+    return texto, modificou
+
+
+class TemplateCompilado:
+    """
+    Template do Motor 2 aberto UMA única vez: as tags quebradas pelo Word já ficam
+    normalizadas na árvore em cache e cada parágrafo com {{...}} vira um 'alvo'
+    (run que recebe o texto + runs que devem ser apagados + texto com as tags).
+    """
+
+    def __init__(self, dados_template):
+        self.dados = dados_template
+        self.doc = Document(io.BytesIO(dados_template))
+        self.partes = []
+        self.runs_com_forma = {}
+        for part in self.partes_de_texto():
+            self.runs_com_forma[part.partname.membername] = indexar_runs_com_forma(part.element)
+            alvos = self.mapear_alvos(part)
+            if alvos:
+                self.partes.append((part, alvos))
+
+    def partes_de_texto(self):
+        # RAIO-X: Corpo do documento + todos os Cabeçalhos e Rodapés existentes
+        partes = [self.doc.part]
+        for rel in self.doc.part.rels.values():
+            if not rel.is_external and rel.reltype in (RT.HEADER, RT.FOOTER):
+                if rel.target_part not in partes:
+                    partes.append(rel.target_part)
+        return partes
+
+    def mapear_alvos(self, part):
+        raiz = part.element
+        indice_runs = {r: i for i, r in enumerate(raiz.iter(qn('w:r')))}
+        escopo = raiz.body if part is self.doc.part else raiz
+        runs_com_forma = self.runs_com_forma[part.partname.membername]
+        alvos = []
+
+        # Entra nas Caixas de Texto, Tabelas Flutuantes e Textos Normais
+        for node in escopo.iter(qn('w:p')):
+            p = Paragraph(node, part)
+            # Isola apenas os pedaços de texto puro, protegendo os esqueletos das caixas de texto
+            safe_runs = [r for r in p.runs if r._r not in runs_com_forma]
+            if not safe_runs:
+                continue
+
+            # Junta os textos que o Word quebrou invisivelmente
+            full_text = "".join(r.text for r in safe_runs if r.text)
+            if "{{" not in full_text:
+                continue
+
+            texto_limpo = normalizar_tags(full_text)
+            if texto_limpo != full_text:
+                safe_runs[0].text = texto_limpo
+                for r in safe_runs[1:]:
+                    r.text = ""
+                runs_para_apagar = []
+            else:
+                runs_para_apagar = [indice_runs[r._r] for r in safe_runs[1:]]
+
+            alvos.append((indice_runs[safe_runs[0]._r], runs_para_apagar, texto_limpo))
+        return alvos
+
+    def renderizar(self, dicionario_dados):
+        # Clona só as partes que têm tags e mexe apenas nos runs mapeados na compilação.
+        # Todas as chaves entram, como no Motor 1: o manifesto não vê todo o texto dos alvos
+        partes_xml = {}
+        for part, alvos in self.partes:
+            copia = copy.deepcopy(part.element)
+            runs = list(copia.iter(qn('w:r')))
+            for idx_alvo, idx_apagar, texto in alvos:
+                texto_final, modificou = substituir_marcadores(texto, dicionario_dados)
+                if modificou:
+                    runs[idx_alvo].text = texto_final
+                    for idx in idx_apagar:
+                        runs[idx].text = ""
+            partes_xml[part.partname.membername] = copia
+
+        return salvar_docx_cru(self.dados, partes_xml)
+
+
+def identificar_template(arquivo_template):
+    """Devolve (hash sha256, bytes ou None). Caminhos só são relidos quando o arquivo muda."""
+    if isinstance(arquivo_template, (str, os.PathLike)):
+        caminho = os.path.abspath(arquivo_template)
+        st = os.stat(caminho)
+        assinatura = (st.st_mtime_ns, st.st_size)
+        memo = HASH_POR_CAMINHO.get(caminho)
+        if memo and memo[0] == assinatura:
+            return memo[1], None
+        with open(caminho, 'rb') as f:
+            dados = f.read()
+        hash_template = hashlib.sha256(dados).hexdigest()
+        HASH_POR_CAMINHO[caminho] = (assinatura, hash_template)
+        return hash_template, dados
+
+    dados = ler_bytes_template(arquivo_template)
+    return hashlib.sha256(dados).hexdigest(), dados
+
+
+def obter_template_compilado(arquivo_template):
+    hash_template, dados = identificar_template(arquivo_template)
+    compilado = TEMPLATES_COMPILADOS.get(hash_template)
+    if compilado is not None:
+        return compilado
+
+    with TRAVA_TEMPLATES:
+        compilado = TEMPLATES_COMPILADOS.get(hash_template)
+        if compilado is None:
+            if dados is None:
+                dados = ler_bytes_template(arquivo_template)
+            compilado = TemplateCompilado(dados)
+            if len(TEMPLATES_COMPILADOS) >= MAX_TEMPLATES_COMPILADOS:
+                TEMPLATES_COMPILADOS.pop(next(iter(TEMPLATES_COMPILADOS)))
+            TEMPLATES_COMPILADOS[hash_template] = compilado
+    return compilado
+
+
+# =========================================================
+# MANIFESTO DE TAGS DOS TEMPLATES (CACHE EM DISCO)
+# =========================================================
+VERSAO_MANIFESTO = 1
+MANIFESTOS = {}
+PARTES_COM_TEXTO = re.compile(r'^word/(document|header\d*|footer\d*)\.xml$')
+
+
+def calcular_manifesto(dados_template, hash_template):
+    """
+    Varre o template uma vez e lista cada tag (já normalizada), quantas vezes aparece
+    e onde (corpo, cabecalho, rodape, caixa_de_texto), além do maior DATA_n.
+    """
+    tags = {}
+    partes = []
+    with zipfile.ZipFile(io.BytesIO(dados_template)) as zf:
+        for nome in zf.namelist():
+            tipo = PARTES_COM_TEXTO.match(nome)
+            if not tipo:
+                continue
+            if tipo.group(1) == 'document':
+                local_parte = 'corpo'
+            elif tipo.group(1).startswith('header'):
+                local_parte = 'cabecalho'
+            else:
+                local_parte = 'rodape'
+
+            raiz = etree.fromstring(zf.read(nome))
+            runs_com_forma = indexar_runs_com_forma(raiz)
+            for p in raiz.iter(qn('w:p')):
+                texto = "".join(
+                    t.text or '' 
+                    for r in p.iterchildren(qn('w:r')) if r not in runs_com_forma 
+                    for t in r.iterchildren(qn('w:t'))
+                )
+                if "{{" not in texto:
+                    continue
+
+                em_caixa = any(a.tag == qn('w:txbxContent') for a in p.iterancestors())
+                local = 'caixa_de_texto' if em_caixa else local_parte
+                for tag in re.findall(r'\{\{.*?\}\}', normalizar_tags(texto)):
+                    info = tags.setdefault(tag, {'total': 0, 'locais': {}})
+                    info['total'] += 1
+                    info['locais'][local] = info['locais'].get(local, 0) + 1
+                    if nome not in partes:
+                        partes.append(nome)
+
+    numeros = [int(m.group(1)) for m in (re.match(r'^\{\{DATA_(\d+)\}\}$', t) for t in tags) if m]
+    return {
+        'versao': VERSAO_MANIFESTO,
+        'hash': hash_template,
+        'tags': tags,
+        'partes': partes,
+        'max_data': max(numeros) if numeros else 0
+    }
+
+
+def obter_manifesto_template(arquivo_template):
+    """
+    Manifesto por hash de conteúdo. Para caminhos ele fica salvo ao lado do template
+    (<template>.manifesto.json) e é recalculado sozinho quando o arquivo muda.
+    """
+    hash_template, dados = identificar_template(arquivo_template)
+    manifesto = MANIFESTOS.get(hash_template)
+    if manifesto is not None:
+        return manifesto
+
+    caminho_manifesto = None
+    if isinstance(arquivo_template, (str, os.PathLike)):
+        caminho_manifesto = os.path.abspath(arquivo_template) + '.manifesto.json'
+        try:
+            with open(caminho_manifesto, 'r', encoding='utf-8') as f:
+                salvo = json.load(f)
+            if salvo.get('hash') == hash_template and salvo.get('versao') == VERSAO_MANIFESTO:
+                manifesto = salvo
+        except (OSError, ValueError):
+            pass
+
+    if manifesto is None:
+        if dados is None:
+            dados = ler_bytes_template(arquivo_template)
+        manifesto = calcular_manifesto(dados, hash_template)
+        if caminho_manifesto:
+            try:
+                temporario = f"{caminho_manifesto}.{os.getpid()}.tmp"
+                with open(temporario, 'w', encoding='utf-8') as f:
+                    json.dump(manifesto, f, ensure_ascii=False, indent=1)
+                os.replace(temporario, caminho_manifesto)
+            except OSError:
+                pass
+
+    if len(MANIFESTOS) >= MAX_TEMPLATES_COMPILADOS:
+        MANIFESTOS.pop(next(iter(MANIFESTOS)))
+    MANIFESTOS[hash_template] = manifesto
+    return manifesto
 
 
 def preencher_template_extensao(arquivo_template, dicionario_dados):
     """
     MOTOR 2 (ALTA PRECISÃO): Usado APENAS para Projetos de Extensão.
     Filtra Caixas de Texto, junta tags fragmentadas pelo Word e auto-corrige erros.
+    Aceita caminho, bytes ou BytesIO; o template é compilado uma vez e reaproveitado.
     """
-    doc = Document(arquivo_template)
+    return CACHE_RENDERIZACAO.obter_ou_gerar('motor2', VERSAO_MOTOR_2, arquivo_template, dicionario_dados, renderizar_template_extensao)
 
-    def arrumar_tag_quebrada(match):
-        # Remove lixos invisíveis e espaços (ex: {{ DATA_ 08 }} vira {{DATA_8}})
-        inner = match.group(1).replace(' ', '').replace('\u200b', '').replace('\xa0', '').upper()
-        inner = inner.replace('-', '_')
-        
-        if inner == 'NOMEALUNO': return '{{NOME_ALUNO}}'
-        if inner == 'MATRICULA': return '{{MATRICULA}}'
-        if inner == 'CURSO': return '{{CURSO}}'
-        
-        # Converte zeros extras (DATA_08 -> DATA_8)
-        if inner.startswith('DATA'):
-            num = inner.replace('DATA', '').replace('_', '')
-            if num.isdigit():
-                return f"{{{{DATA_{int(num)}}}}}"
-                
-        return f"{{{{{inner}}}}}"
 
-    def has_shape(run):
-        # Verifica se este 'run' é, na verdade, uma imagem ou o "esqueleto" da Caixa de Texto
-        for tag in ['w:drawing', 'w:pict', 'w:object', 'v:shape']:
+def renderizar_template_extensao(arquivo_template, dicionario_dados):
+    return obter_template_compilado(arquivo_template).renderizar(dicionario_dados)
+
+
+# =========================================================
+# CACHE DE DOCUMENTOS RENDERIZADOS (ENDEREÇADO POR CONTEÚDO)
+# =========================================================
+# Suba a versão sempre que a saída de um motor mudar, para não servir arquivos antigos
+VERSAO_MOTOR_1 = 2
+VERSAO_MOTOR_2 = 2
+
+
+def hash_dicionario(dicionario_dados):
+    # Forma canônica: chaves ordenadas e valores como texto (os motores usam str(valor))
+    canonico = json.dumps({str(k): str(v) for k, v in dicionario_dados.items()}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonico.encode('utf-8')).hexdigest()
+
+
+class CacheRenderizacao:
+    """
+    LRU em disco limitado por bytes. A chave junta o hash do template, o hash do
+    dicionário canônico e a versão do motor; o mtime do arquivo marca o último uso.
+    """
+
+    def __init__(self, pasta, limite_bytes):
+        self.pasta = pasta
+        self.limite_bytes = limite_bytes
+        self.trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.total_bytes = None
+
+    def caminho(self, chave):
+        return os.path.join(self.pasta, chave[:2], chave + '.bin')
+
+    def calcular_total(self):
+        total = 0
+        for raiz, _, arquivos in os.walk(self.pasta):
+            for nome in arquivos:
+                try:
+                    total += os.path.getsize(os.path.join(raiz, nome))
+                except OSError:
+                    pass
+        return total
+
+    def obter_ou_gerar(self, motor, versao, arquivo_template, dicionario_dados, renderizar):
+        hash_template, _ = identificar_template(arquivo_template)
+        chave = hashlib.sha256(f"{motor}:{versao}:{hash_template}:{hash_dicionario(dicionario_dados)}".encode('utf-8')).hexdigest()
+        caminho = self.caminho(chave)
+
+        try:
+            with open(caminho, 'rb') as f:
+                dados = f.read()
+            os.utime(caminho)
+            with self.trava:
+                self.acertos += 1
+            return io.BytesIO(dados)
+        except OSError:
+            pass
+
+        with self.trava:
+            self.falhas += 1
+        saida = renderizar(arquivo_template, dicionario_dados)
+        self.guardar(caminho, saida.getvalue())
+        saida.seek(0)
+        return saida
+
+    def guardar(self, caminho, dados):
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporario, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        except OSError as e:
+            logging.error(f"Cache de renderização indisponível: {e}")
+            return
+
+        with self.trava:
+            if self.total_bytes is None:
+                self.total_bytes = self.calcular_total()
+            else:
+                self.total_bytes += len(dados)
+            if self.total_bytes > self.limite_bytes:
+                self.despejar()
+
+    def despejar(self):
+        # Remove os menos usados até sobrar 90% do limite
+        entradas = []
+        for raiz, _, arquivos in os.walk(self.pasta):
+            for nome in arquivos:
+                caminho = os.path.join(raiz, nome)
+                try:
+                    st = os.stat(caminho)
+                    entradas.append((st.st_mtime, st.st_size, caminho))
+                except OSError:
+                    pass
+
+        total = sum(e[1] for e in entradas)
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.limite_bytes * 0.9:
+                break
             try:
-                if len(list(run._element.iter(qn(tag)))) > 0:
-                    return True
-            except:
+                os.remove(caminho)
+                total -= tamanho
+            except OSError:
                 pass
-        return False
+        self.total_bytes = total
 
-    def substituir_em_paragrafo(p):
-        # 1. Isola apenas os pedaços de texto puro, protegendo os esqueletos das caixas de texto
-        safe_runs = [r for r in p.runs if not has_shape(r)]
-        if not safe_runs:
-            return
-            
-        # 2. Junta os textos que o Word quebrou invisivelmente
-        full_text = "".join(r.text for r in safe_runs if r.text)
-        if "{{" not in full_text:
-            return
+    def estatisticas(self):
+        with self.trava:
+            consultas = self.acertos + self.falhas
+            return {
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / consultas, 3) if consultas else 0.0,
+                'bytes_em_disco': self.total_bytes if self.total_bytes is not None else self.calcular_total(),
+                'limite_bytes': self.limite_bytes
+            }
 
-        # 3. Passa a vassoura nos espaços vazios e erros de digitação das chaves
-        texto_limpo = re.sub(r'[\u200b\u200c\u200d\ufeff\xa0]', '', full_text)
-        texto_limpo = re.sub(r'\{\{(.*?)\}\}', arrumar_tag_quebrada, texto_limpo)
-        
-        modificou = False
-        for marcador, valor in dicionario_dados.items():
-            if marcador in texto_limpo:
-                texto_limpo = texto_limpo.replace(marcador, str(valor))
-                modificou = True
-                
-        # 4. Injeta a data limpa no primeiro espaço de texto e apaga os pedaços quebrados
-        if modificou or texto_limpo != full_text:
-            safe_runs[0].text = texto_limpo
-            for r in safe_runs[1:]:
-                r.text = ""
-
-    # RAIO-X: Entra nas Caixas de Texto, Tabelas Flutuantes e Textos Normais
-    for node in doc.element.body.iter():
-        if isinstance(node, CT_P):
-            p = Paragraph(node, doc)
-            substituir_em_paragrafo(p)
-
-    # RAIO-X: Entra nos Cabeçalhos e Rodapés
-    for section in doc.sections:
-        if section.header:
-            for node in section.header._element.iter():
-                if isinstance(node, CT_P):
-                    substituir_em_paragrafo(Paragraph(node, section.header))
-        if section.footer:
-            for node in section.footer._element.iter():
-                if isinstance(node, CT_P):
-                    substituir_em_paragrafo(Paragraph(node, section.footer))
 
-    arquivo_saida = io.BytesIO()
-    doc.save(arquivo_saida)
-    arquivo_saida.seek(0)
-    return arquivo_saida
+CACHE_RENDERIZACAO = CacheRenderizacao(
+    os.environ.get('CACHE_RENDER_DIR', os.path.join(tempfile.gettempdir(), 'hubmaster_cache_render')),
+    int(os.environ.get('CACHE_RENDER_MAX_MB', 512)) * 1024 * 1024
+)
+
+
+# =========================================================
+# RECEITAS: DOCUMENTOS GUARDADOS SÓ COMO (TEMPLATE + DICIONÁRIO)
+# =========================================================
+MOTORES_RECEITA = {
+    'motor1': (preencher_template_com_tags, VERSAO_MOTOR_1),
+    'motor2': (preencher_template_extensao, VERSAO_MOTOR_2)
+}
+
+
+def criar_receita(motor, caminho_template, dicionario_dados):
+    """Tudo o que é preciso para renderizar o documento de novo: alguns KB no lugar de MB."""
+    hash_template, _ = identificar_template(caminho_template)
+    return json.dumps({
+        'motor': motor,
+        'versao': MOTORES_RECEITA[motor][1],
+        'template': os.path.basename(caminho_template),
+        'hash_template': hash_template,
+        'dicionario': {chave: str(valor) for chave, valor in dicionario_dados.items()}
+    }, ensure_ascii=False)
+
+
+def materializar_receita(receita_json, pasta_templates, buscar_template=None):
+    """
+    Renderiza uma receita (passando pelo cache de renderização). Se o template em
+    disco mudou desde a geração, usa a cópia original via buscar_template(hash).
+    Renderiza sempre com a versão atual do motor (ver atualizar_versao_receita).
+    """
+    receita = json.loads(receita_json)
+    preencher, _ = MOTORES_RECEITA[receita['motor']]
+
+    arquivo_template = os.path.join(pasta_templates, os.path.basename(receita['template']))
+    if not os.path.exists(arquivo_template) or identificar_template(arquivo_template)[0] != receita['hash_template']:
+        arquivo_template = buscar_template(receita['hash_template']) if buscar_template else None
+        if arquivo_template is None:
+            raise Exception(f"O template {receita['template']} mudou e a versão usada neste documento não está guardada.")
+
+    return preencher(arquivo_template, receita['dicionario']).read()
+
+
+def atualizar_versao_receita(receita_json):
+    """
+    None se a receita foi gravada com a versão atual do motor; senão a mesma receita com a
+    versão atual. O motor antigo não existe mais, então materializar_receita renderiza com o
+    atual e quem guarda a receita deve atualizar também o sha256 e o tamanho do documento.
+    """
+    receita = json.loads(receita_json)
+    versao_atual = MOTORES_RECEITA[receita['motor']][1]
+    if receita.get('versao') == versao_atual:
+        return None
+    receita['versao'] = versao_atual
+    return json.dumps(receita, ensure_ascii=False)
+
+
+def aquecer_templates(caminhos_templates):
+    """Initializer do pool de processos: cada filho compila os templates uma vez, antes do primeiro trabalho."""
+    for caminho in caminhos_templates:
+        obter_template_compilado(caminho)
+
+
+def gerar_documentos_extensao(caminhos_templates, dicionario_dados):
+    """Renderiza os templates da Extensão com o mesmo dicionário (roda dentro do pool de processos)."""
+    return [preencher_template_extensao(caminho, dicionario_dados).read() for caminho in caminhos_templates]
+
+
+class FluxoZip(io.RawIOBase):
+    """Destino não-pesquisável para o zipfile: acumula os bytes até a rota retirá-los e enviá-los."""
+
+    def __init__(self):
+        super().__init__()
+        self.pedacos = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.pedacos.append(bytes(dados))
+        return len(dados)
+
+    def retirar(self):
+        dados = b"".join(self.pedacos)
+        self.pedacos = []
+        return dados
+
+
+# =========================================================
+# EXTRAÇÃO DE TEXTO EM FLUXO (SEM MONTAR O DOCUMENTO INTEIRO)
+# =========================================================
+W = '{%s}' % nsmap['w']
+TAGS_BLOCO_CORPO = (W + 'p', W + 'tbl', W + 'sdt')
+
+
+def texto_run_xml(r):
+    # Mesmas regras do python-docx: w:t, tabulações, quebras de linha e hífens
+    partes = []
+    for filho in r:
+        tag = filho.tag
+        if tag == W + 't':
+            partes.append(filho.text or '')
+        elif tag in (W + 'tab', W + 'ptab'):
+            partes.append('\t')
+        elif tag == W + 'br':
+            if filho.get(W + 'type', 'textWrapping') == 'textWrapping':
+                partes.append('\n')
+        elif tag == W + 'cr':
+            partes.append('\n')
+        elif tag == W + 'noBreakHyphen':
+            partes.append('-')
+    return ''.join(partes)
+
+
+def texto_paragrafo_xml(p):
+    partes = []
+    for filho in p:
+        if filho.tag == W + 'r':
+            partes.append(texto_run_xml(filho))
+        elif filho.tag == W + 'hyperlink':
+            partes.extend(texto_run_xml(r) for r in filho.iterchildren(W + 'r'))
+    return ''.join(partes)
+
+
+def localizar_document_xml(zf):
+    # O nome da parte principal vem do _rels/.rels (quase sempre word/document.xml)
+    try:
+        rels = etree.fromstring(zf.read('_rels/.rels'))
+        for rel in rels:
+            if rel.get('Type') == RT.OFFICE_DOCUMENT:
+                return rel.get('Target').lstrip('/')
+    except (KeyError, etree.XMLSyntaxError):
+        pass
+    return 'word/document.xml'
+
+
+def iterar_paragrafos_docx(arquivo_bytes):
+    """
+    Gera o texto de cada parágrafo do corpo (o mesmo que doc.paragraphs) lendo o
+    document.xml direto do zip com iterparse. Cada bloco do corpo é descartado
+    logo após ser lido, então a memória fica limitada ao maior bloco.
+    """
+    fonte = io.BytesIO(arquivo_bytes) if isinstance(arquivo_bytes, bytes) else arquivo_bytes
+    with zipfile.ZipFile(fonte) as zf:
+        with zf.open(localizar_document_xml(zf)) as xml:
+            for _, elemento in etree.iterparse(xml, events=('end',), tag=TAGS_BLOCO_CORPO, huge_tree=True):
+                pai = elemento.getparent()
+                if pai is None or pai.tag != W + 'body':
+                    continue
+                if elemento.tag == W + 'p':
+                    yield texto_paragrafo_xml(elemento)
+                elemento.clear()
+                while elemento.getprevious() is not None:
+                    del pai[0]
 
 
 def extrair_texto_docx(arquivo_bytes):
-    doc = Document(io.BytesIO(arquivo_bytes)) if isinstance(arquivo_bytes, bytes) else Document(arquivo_bytes)
-    return "\n".join([p.text for p in doc.paragraphs])
+    return "\n".join(iterar_paragrafos_docx(arquivo_bytes))
 
 
 def extrair_etapa_5(arquivo_bytes):
-    doc = Document(io.BytesIO(arquivo_bytes))
-    linhas = [p.text.strip() for p in doc.paragraphs if p.text.strip()]
-    idx_inicio = -1
+    # O marcador vale na sua ÚLTIMA ocorrência, então o que vem antes dele é
+    # descartado enquanto o arquivo é lido: só o trecho final fica em memória.
+    apos_marcador = None
+    apos_memorial = None
     
-    for i, linha in enumerate(linhas):
+    for texto in iterar_paragrafos_docx(arquivo_bytes):
+        linha = texto.strip()
+        if not linha:
+            continue
+            
         if "Lembre-se também de salvar este documento" in linha:
-            idx_inicio = i + 1
+            apos_marcador = []
+            apos_memorial = None
+            continue
             
-    if idx_inicio == -1:
-        for i in range(len(linhas)-1, -1, -1):
-            if "memorial analítico" in linhas[i].lower() and "redação" not in linhas[i].lower():
-                idx_inicio = i
-                break
-                
-    if idx_inicio == -1 or idx_inicio >= len(linhas):
+        if apos_marcador is not None:
+            apos_marcador.append(linha)
+            continue
+            
+        if "memorial analítico" in linha.lower() and "redação" not in linha.lower():
+            apos_memorial = [linha]
+        elif apos_memorial is not None:
+            apos_memorial.append(linha)
+            
+    linhas_finais = apos_marcador if apos_marcador is not None else apos_memorial
+    if not linhas_finais:
         return False, "Não foi possível separar as instruções do texto final. O arquivo pode estar fora do padrão."
         
-    linhas_finais = linhas[idx_inicio:]
     headers_oficiais = [
         "Resumo", "Contextualização do desafio", "Análise", 
         "Propostas de solução", "Conclusão reflexiva", "Referências", "Autoavaliação"
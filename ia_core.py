@@ -1,38 +1,32 @@
+import os
 import re
 import json
-import requests
+import time
+import asyncio
+import logging
+import inspect
 import hashlib
-from google import genai
+import threading
+import contextlib
+import unicodedata
+import concurrent.futures
+from collections import OrderedDict, deque
+import cliches
+import clientes_http
+
+UNICODE_ESCAPADO = re.compile(r'\\u([0-9a-fA-F]{4})')
+ASTERISCO_SOLTO = re.compile(r'(?<!\*)\*(?!\*)')
 
 def limpar_texto_ia(texto):
-    try: 
-        texto = re.sub(r'\\u([0-9a-fA-F]{4})', lambda m: chr(int(m.group(1), 16)), texto)
-    except Exception: 
-        pass
+    if '\\u' in texto:
+        try: 
+            texto = UNICODE_ESCAPADO.sub(lambda m: chr(int(m.group(1), 16)), texto)
+        except Exception: 
+            pass
         
-    texto = re.sub(r'(?<!\*)\*(?!\*)', '', texto)
-    
-    substituicoes = {
-        r'\bmomentum\b': 'impulso',
-        r'\blocus\b': 'ambiente',
-        r'\boutrossim\b': 'além disso',
-        r'\bdessarte\b': 'assim',
-        r'\bdestarte\b': 'assim',
-        r'\bum mergulho profundo\b': 'uma análise detalhada',
-        r'\bmergulho profundo\b': 'análise detalhada',
-        r'\btapeçaria de\b': 'conjunto de',
-        r'\btapeçaria\b': 'estrutura',
-        r'\bfarol\b': 'guia',
-        r'\bcrucial\b': 'essencial',
-        r'\bvital\b': 'essencial',
-        r'\badentrar\b': 'explorar',
-        r'\btestamento\b': 'prova',
-        r'\bpaisagem\b': 'cenário',
-        r'\bnotável\b': 'importante'
-    }
-    for padrao, substituto in substituicoes.items():
-        texto = re.sub(padrao, substituto, texto, flags=re.IGNORECASE)
-    return texto
+    texto = ASTERISCO_SOLTO.sub('', texto)
+    # Todos os clichês num passe só (léxico editável em /configuracoes)
+    return cliches.obter_lexico().substituir(texto)
 
 def calcular_custo_api(modelo, prompt_tokens, completion_tokens):
     usd_to_brl = 5.50
@@ -50,51 +44,925 @@ def calcular_custo_api(modelo, prompt_tokens, completion_tokens):
         
     return custo_usd * usd_to_brl
 
-def chamar_ia(prompt, nome_modelo, chave_google=None, chave_openrouter=None):
-    is_openrouter = "openrouter/" in nome_modelo.lower() or "/" in nome_modelo
+# =========================================================
+# GATEWAY ASSÍNCRONO DE IA (UM EVENT LOOP, LIMITES POR PROVEDOR E MODELO)
+# =========================================================
+LIMITES_PROVEDOR = {
+    "openrouter": int(os.environ.get("IA_LIMITE_OPENROUTER", 16)),
+    "google": int(os.environ.get("IA_LIMITE_GOOGLE", 8))
+}
+LIMITE_POR_MODELO = int(os.environ.get("IA_LIMITE_POR_MODELO", 4))
+# Ex.: IA_LIMITES_MODELOS='{"anthropic/claude-3-opus": 2}'
+LIMITES_MODELO = json.loads(os.environ.get("IA_LIMITES_MODELOS") or "{}")
+# Quanto uma thread do Flask espera pela fachada síncrona antes de desistir (e cancelar a corrotina)
+IA_GATEWAY_TIMEOUT = float(os.environ.get("IA_GATEWAY_TIMEOUT", 300))
+
+
+class GatewayIA:
+    """
+    Todas as chamadas de IA do processo correm como corrotinas num único event loop
+    (numa thread própria). Semáforos por provedor e por modelo seguram o excesso numa
+    fila de espera em vez de abrir mais conexões do que o provedor aceita.
+    """
+
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.loop = None
+        self.pid = None
+        self.semaforos = {}
+        self.clientes_async = {}
+        self.em_andamento = {}
+        self.aguardando = {}
+
+    def obter_loop(self):
+        with self.trava:
+            # Depois de um fork (gunicorn) a thread do loop não existe no filho: cria outra
+            if self.loop is None or self.pid != os.getpid():
+                self.loop = asyncio.new_event_loop()
+                self.pid = os.getpid()
+                self.semaforos = {}
+                self.clientes_async = {}
+                threading.Thread(target=self.loop.run_forever, daemon=True, name="gateway-ia").start()
+            return self.loop
+
+    def agendar(self, corrotina):
+        """Roda a corrotina no loop do gateway e devolve um concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(corrotina, self.obter_loop())
+
+    def executar(self, corrotina, timeout=IA_GATEWAY_TIMEOUT):
+        if threading.current_thread().name == "gateway-ia":
+            raise RuntimeError("Use 'await' dentro do gateway; a fachada síncrona travaria o event loop.")
+        futuro = self.agendar(corrotina)
+        try:
+            return futuro.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Uma corrotina presa não segura a thread do pedido para sempre
+            futuro.cancel()
+            raise Exception(f"A IA não respondeu em {timeout:g}s.")
+
+    def cliente_async(self, provedor):
+        cliente = self.clientes_async.get(provedor)
+        if cliente is None:
+            cliente = self.clientes_async[provedor] = clientes_http.criar_cliente_async(provedor)
+        return cliente
+
+    def semaforo(self, chave, limite):
+        semaforo = self.semaforos.get(chave)
+        if semaforo is None:
+            semaforo = self.semaforos[chave] = asyncio.Semaphore(max(1, limite))
+        return semaforo
+
+    @contextlib.asynccontextmanager
+    async def limitar(self, provedor, modelo):
+        # Primeiro a vaga do modelo: quem espera por um modelo lotado não segura vaga do provedor
+        sem_modelo = self.semaforo(("modelo", modelo), LIMITES_MODELO.get(modelo, LIMITE_POR_MODELO))
+        sem_provedor = self.semaforo(("provedor", provedor), LIMITES_PROVEDOR.get(provedor, 8))
+
+        self.aguardando[provedor] = self.aguardando.get(provedor, 0) + 1
+        try:
+            await sem_modelo.acquire()
+            try:
+                await sem_provedor.acquire()
+            except BaseException:
+                sem_modelo.release()
+                raise
+        finally:
+            self.aguardando[provedor] -= 1
+
+        self.em_andamento[provedor] = self.em_andamento.get(provedor, 0) + 1
+        try:
+            yield
+        finally:
+            self.em_andamento[provedor] -= 1
+            sem_provedor.release()
+            sem_modelo.release()
+
+    def estatisticas(self):
+        return {
+            provedor: {
+                "em_andamento": self.em_andamento.get(provedor, 0),
+                "aguardando": self.aguardando.get(provedor, 0),
+                "limite": limite
+            }
+            for provedor, limite in LIMITES_PROVEDOR.items()
+        }
+
+
+GATEWAY = GatewayIA()
+
+
+def provedor_do_modelo(nome_modelo):
+    return "openrouter" if ("openrouter/" in nome_modelo.lower() or "/" in nome_modelo) else "google"
+
+
+async def avisar_pedaco(ao_receber, pedaco):
+    resultado = ao_receber(pedaco)
+    if inspect.isawaitable(resultado):
+        await resultado
+
+
+async def transmitir_openrouter(headers, payload, ao_receber):
+    """Lê o SSE do OpenRouter repassando cada pedaço de texto. Devolve (texto, usage)."""
+    partes = []
+    usage = {}
+    payload = dict(payload, stream=True, usage={"include": True})
+    async with GATEWAY.cliente_async("openrouter").stream("POST", "https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload) as res:
+        if res.status_code != 200:
+            corpo = (await res.aread()).decode("utf-8", "ignore")
+            raise Exception(f"Erro OpenRouter ({res.status_code}): {corpo}")
+            
+        async for linha in res.aiter_lines():
+            # Linhas vazias e comentários (": OPENROUTER PROCESSING") só mantêm a conexão viva
+            if not linha.startswith("data:"):
+                continue
+            dado = linha[5:].strip()
+            if dado == "[DONE]":
+                break
+            try:
+                evento = json.loads(dado)
+            except ValueError:
+                continue
+                
+            if evento.get("error"):
+                erro = evento["error"]
+                raise Exception(f"Erro OpenRouter (stream): {erro.get('message', erro) if isinstance(erro, dict) else erro}")
+            if evento.get("usage"):
+                usage = evento["usage"]
+            for escolha in evento.get("choices") or []:
+                pedaco = (escolha.get("delta") or {}).get("content")
+                if pedaco:
+                    partes.append(pedaco)
+                    await avisar_pedaco(ao_receber, pedaco)
+                    
+    return "".join(partes), usage
+
+
+async def transmitir_google(client, nome_modelo, prompt, ao_receber):
+    """Mesmo papel do transmitir_openrouter para o Gemini nativo. Devolve (texto, usage_metadata)."""
+    partes = []
+    uso = None
+    async for resposta in await client.aio.models.generate_content_stream(model=nome_modelo, contents=prompt):
+        if resposta.usage_metadata:
+            uso = resposta.usage_metadata
+        pedaco = resposta.text
+        if pedaco:
+            partes.append(pedaco)
+            await avisar_pedaco(ao_receber, pedaco)
+    return "".join(partes), uso
+
+
+async def chamar_provedor_async(prompt, nome_modelo, chave_google=None, chave_openrouter=None, ao_receber=None):
+    """
+    Chamada de IA dentro do gateway. Com ao_receber (função ou corrotina), a resposta vem
+    em streaming e cada pedaço de texto é repassado assim que chega; o retorno é o mesmo.
+    """
+    provedor = provedor_do_modelo(nome_modelo)
     custo_reais = 0.0
     
-    if is_openrouter:
+    if provedor == "openrouter":
         if not chave_openrouter: raise Exception("A Chave da API do OpenRouter não foi configurada.")
         modelo_limpo = nome_modelo.replace("openrouter/", "")
         headers = {"Authorization": f"Bearer {chave_openrouter}", "HTTP-Referer": "https://hubmaster-system.com", "Content-Type": "application/json"}
         payload = {"model": modelo_limpo, "messages": [{"role": "user", "content": prompt}], "temperature": 0.7}
-        res = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload, timeout=180)
-        if res.status_code != 200: raise Exception(f"Erro OpenRouter ({res.status_code}): {res.text}")
-            
-        dados = res.json()
-        texto = dados['choices'][0]['message']['content']
-        usage = dados.get('usage', {})
+        async with GATEWAY.limitar(provedor, modelo_limpo):
+            if ao_receber is not None:
+                texto, usage = await transmitir_openrouter(headers, payload, ao_receber)
+            else:
+                res = await GATEWAY.cliente_async("openrouter").post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
+                if res.status_code != 200: raise Exception(f"Erro OpenRouter ({res.status_code}): {res.text}")
+                dados = res.json()
+                texto = dados['choices'][0]['message']['content']
+                usage = dados.get('usage', {})
+                
         custo_reais = calcular_custo_api(modelo_limpo, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
         return limpar_texto_ia(texto), custo_reais
     else:
         if not chave_google: raise Exception("A Chave da API nativa do Google não foi configurada.")
-        client = genai.Client(api_key=chave_google)
-        res = client.models.generate_content(model=nome_modelo, contents=prompt)
+        client = clientes_http.obter_cliente_google(chave_google)
+        async with GATEWAY.limitar(provedor, nome_modelo):
+            if ao_receber is not None:
+                texto, uso = await transmitir_google(client, nome_modelo, prompt, ao_receber)
+            else:
+                res = await client.aio.models.generate_content(model=nome_modelo, contents=prompt)
+                texto, uso = res.text, res.usage_metadata
         try:
-            pt = res.usage_metadata.prompt_token_count
-            ct = res.usage_metadata.candidates_token_count
+            pt = uso.prompt_token_count
+            ct = uso.candidates_token_count
             custo_reais = calcular_custo_api(nome_modelo, pt, ct)
         except Exception: pass
-        return limpar_texto_ia(res.text), custo_reais
+        return limpar_texto_ia(texto), custo_reais
+
+async def chamar_ia_async(prompt, nome_modelo, chave_google=None, chave_openrouter=None, ao_receber=None):
+    """chamar_provedor_async medido: latência, primeiro token e erros de cada modelo alimentam o ROTEADOR."""
+    inicio = time.monotonic()
+    primeiro_token = []
+
+    async def receber(pedaco):
+        if not primeiro_token:
+            primeiro_token.append(time.monotonic() - inicio)
+        await avisar_pedaco(ao_receber, pedaco)
+
+    try:
+        resultado = await chamar_provedor_async(prompt, nome_modelo, chave_google, chave_openrouter, receber if ao_receber is not None else None)
+    except asyncio.CancelledError:
+        ROTEADOR.registrar_interrupcao(nome_modelo, time.monotonic() - inicio)
+        raise
+    except ChamadaAbortada:
+        ROTEADOR.liberar_sonda(nome_modelo)
+        raise
+    except Exception:
+        ROTEADOR.registrar_erro(nome_modelo)
+        raise
+    ROTEADOR.registrar_sucesso(nome_modelo, time.monotonic() - inicio, primeiro_token[0] if primeiro_token else None)
+    return resultado
+
+def chamar_ia(prompt, nome_modelo, chave_google=None, chave_openrouter=None, ao_receber=None):
+    """Fachada síncrona: a chamada entra na fila do gateway e a thread atual só espera o resultado."""
+    return GATEWAY.executar(chamar_ia_async(prompt, nome_modelo, chave_google, chave_openrouter, ao_receber))
+
+# =========================================================
+# ROTEAMENTO ADAPTATIVO (EWMA POR MODELO + CIRCUIT BREAKER)
+# =========================================================
+IA_ROTEADOR_ALFA = float(os.environ.get("IA_ROTEADOR_ALFA", 0.2))
+IA_CIRCUITO_FALHAS = int(os.environ.get("IA_CIRCUITO_FALHAS", 3))
+IA_CIRCUITO_TAXA_ERRO = float(os.environ.get("IA_CIRCUITO_TAXA_ERRO", 0.5))
+IA_CIRCUITO_MIN_CHAMADAS = int(os.environ.get("IA_CIRCUITO_MIN_CHAMADAS", 10))
+IA_CIRCUITO_ESPERA = float(os.environ.get("IA_CIRCUITO_ESPERA", 30))
+IA_CIRCUITO_ESPERA_MAX = float(os.environ.get("IA_CIRCUITO_ESPERA_MAX", 600))
+# Quanto a chamada de teste de um circuito segura a vaga; vence sozinha se a chamada nunca registrar nada
+IA_CIRCUITO_PRAZO_SONDA = float(os.environ.get("IA_CIRCUITO_PRAZO_SONDA", clientes_http.TIMEOUTS_LEITURA["openrouter"]))
+
+
+class SaudeModelo:
+    def __init__(self):
+        self.chamadas = 0
+        self.latencia = None
+        self.primeiro_token = None
+        self.taxa_erro = 0.0
+        self.taxa_validacao = 0.0
+        self.falhas_seguidas = 0
+        self.reprovacoes_seguidas = 0
+        self.aberto_ate = 0.0
+        self.espera = IA_CIRCUITO_ESPERA
+        self.sonda_ate = 0.0
+
+
+def ewma(atual, amostra, alfa=None):
+    alfa = IA_ROTEADOR_ALFA if alfa is None else alfa
+    return amostra if atual is None else atual + alfa * (amostra - atual)
+
+
+class RoteadorIA:
+    """
+    Médias móveis (EWMA) de latência, tempo até o primeiro token, taxa de erro e taxa
+    de respostas reprovadas na validação de cada modelo. Erros ou reprovações seguidas
+    (ou uma taxa de erro alta) abrem o circuito do modelo: ele vai para o fim da fila até a espera
+    acabar. Depois disso o circuito fica em teste: uma única chamada (a sonda) recebe o modelo
+    na posição normal e as demais continuam a vê-lo aberto até ela terminar. Se a sonda falhar,
+    a espera dobra (até IA_CIRCUITO_ESPERA_MAX). As estatísticas são do processo (cada worker tem as suas).
+    """
+
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.modelos = {}
+
+    def saude(self, nome_modelo):
+        saude = self.modelos.get(nome_modelo)
+        if saude is None:
+            saude = self.modelos[nome_modelo] = SaudeModelo()
+        return saude
+
+    def registrar_sucesso(self, nome_modelo, latencia, primeiro_token=None):
+        with self.trava:
+            saude = self.saude(nome_modelo)
+            saude.chamadas += 1
+            saude.latencia = ewma(saude.latencia, latencia)
+            if primeiro_token is not None:
+                saude.primeiro_token = ewma(saude.primeiro_token, primeiro_token)
+            saude.taxa_erro = ewma(saude.taxa_erro, 0.0)
+            saude.falhas_seguidas = 0
+            saude.sonda_ate = 0.0
+            if not saude.reprovacoes_seguidas:
+                saude.espera = IA_CIRCUITO_ESPERA
+
+    def registrar_erro(self, nome_modelo):
+        with self.trava:
+            saude = self.saude(nome_modelo)
+            saude.chamadas += 1
+            saude.taxa_erro = ewma(saude.taxa_erro, 1.0)
+            saude.falhas_seguidas += 1
+            saude.sonda_ate = 0.0
+            self.avaliar_circuito(saude)
+
+    def registrar_validacao(self, nome_modelo, aprovada):
+        with self.trava:
+            saude = self.saude(nome_modelo)
+            saude.taxa_validacao = ewma(saude.taxa_validacao, 0.0 if aprovada else 1.0)
+            saude.sonda_ate = 0.0
+            if aprovada:
+                saude.reprovacoes_seguidas = 0
+                if not saude.falhas_seguidas:
+                    saude.espera = IA_CIRCUITO_ESPERA
+            else:
+                saude.reprovacoes_seguidas += 1
+                self.avaliar_circuito(saude)
+
+    def registrar_interrupcao(self, nome_modelo, decorrido):
+        # Chamada cancelada (perdeu o hedge): não é erro, mas a latência real foi no mínimo 'decorrido'
+        with self.trava:
+            saude = self.saude(nome_modelo)
+            saude.sonda_ate = 0.0
+            if saude.latencia is None or decorrido > saude.latencia:
+                saude.latencia = ewma(saude.latencia, decorrido)
+
+    def liberar_sonda(self, nome_modelo):
+        # Chamada abortada sem veredito: o teste fica para a próxima
+        with self.trava:
+            saude = self.modelos.get(nome_modelo)
+            if saude is not None:
+                saude.sonda_ate = 0.0
+
+    def avaliar_circuito(self, saude):
+        taxa_alta = saude.chamadas >= IA_CIRCUITO_MIN_CHAMADAS and saude.taxa_erro >= IA_CIRCUITO_TAXA_ERRO
+        if max(saude.falhas_seguidas, saude.reprovacoes_seguidas) >= IA_CIRCUITO_FALHAS or taxa_alta:
+            agora = time.monotonic()
+            # Falhou no teste de um circuito que já tinha sido aberto: espera o dobro
+            if saude.aberto_ate and agora >= saude.aberto_ate:
+                saude.espera = min(saude.espera * 2, IA_CIRCUITO_ESPERA_MAX)
+            saude.aberto_ate = agora + saude.espera
+
+    def em_teste(self, saude, agora):
+        # A espera acabou, mas o modelo ainda não voltou a acertar
+        return 0 < saude.aberto_ate <= agora and bool(saude.falhas_seguidas or saude.reprovacoes_seguidas)
+
+    def latencia_esperada(self, nome_modelo):
+        # Cada erro ou resposta reprovada custa mais uma volta pela fila
+        saude = self.modelos.get(nome_modelo)
+        if saude is None or saude.latencia is None:
+            return None
+        falha = min(0.9, saude.taxa_erro + saude.taxa_validacao)
+        return saude.latencia / (1.0 - falha)
+
+    def montar_fila(self, fila, abertos):
+        def chave(nome_modelo):
+            esperada = self.latencia_esperada(nome_modelo)
+            return (nome_modelo in abertos, esperada is None, esperada or 0.0)
+
+        if not fila or fila[0] in abertos:
+            return sorted(fila, key=chave)
+        return fila[:1] + sorted(fila[1:], key=chave)
+
+    def ordenar(self, modelos, preferido=None, sondar=True):
+        """
+        Fila de tentativa: o modelo escolhido pelo usuário na frente (a não ser que o
+        circuito dele esteja aberto), os reservas pela latência esperada e os modelos com
+        circuito aberto no fim. Modelos ainda sem histórico mantêm a ordem configurada.
+        Um circuito em teste conta como fechado só para a chamada que leva a sonda, e só
+        quando o modelo fica na frente (é a única posição que com certeza é tentada);
+        sondar=False apenas consulta a ordem, sem entregar sonda (tela de configurações).
+        """
+        fila = ([preferido] if preferido else []) + [m for m in modelos if m != preferido]
+        with self.trava:
+            agora = time.monotonic()
+            abertos, livres = set(), set()
+            for nome_modelo in fila:
+                saude = self.modelos.get(nome_modelo)
+                if saude is None:
+                    continue
+                if saude.aberto_ate > agora or (self.em_teste(saude, agora) and saude.sonda_ate > agora):
+                    abertos.add(nome_modelo)
+                elif self.em_teste(saude, agora):
+                    livres.add(nome_modelo)
+
+            if sondar and livres:
+                candidato = self.montar_fila(fila, abertos)[0]
+                if candidato in livres:
+                    self.modelos[candidato].sonda_ate = agora + IA_CIRCUITO_PRAZO_SONDA
+                    return self.montar_fila(fila, abertos | (livres - {candidato}))
+            return self.montar_fila(fila, abertos | livres)
+
+    def estatisticas(self, modelos=None):
+        with self.trava:
+            agora = time.monotonic()
+            nomes = list(modelos) if modelos is not None else list(self.modelos)
+            resultado = {}
+            for nome in nomes:
+                saude = self.modelos.get(nome) or SaudeModelo()
+                if saude.aberto_ate > agora:
+                    estado = "aberto"
+                elif saude.aberto_ate:
+                    estado = "teste" if (saude.falhas_seguidas or saude.reprovacoes_seguidas) else "fechado"
+                else:
+                    estado = "fechado"
+                esperada = self.latencia_esperada(nome)
+                resultado[nome] = {
+                    "chamadas": saude.chamadas,
+                    "latencia": round(saude.latencia, 2) if saude.latencia is not None else None,
+                    "primeiro_token": round(saude.primeiro_token, 2) if saude.primeiro_token is not None else None,
+                    "latencia_esperada": round(esperada, 2) if esperada is not None else None,
+                    "taxa_erro": round(saude.taxa_erro * 100, 1),
+                    "taxa_validacao": round(saude.taxa_validacao * 100, 1),
+                    "circuito": estado,
+                    "reabre_em": max(0, round(saude.aberto_ate - agora)) if estado == "aberto" else 0
+                }
+            return resultado
+
+
+ROTEADOR = RoteadorIA()
+
+# =========================================================
+# HEDGING ENTRE OS MODELOS DA FILA (CORTE DA LATÊNCIA DE CAUDA)
+# =========================================================
+IA_HEDGE_ATIVO = os.environ.get("IA_HEDGE", "1").strip().lower() not in ("0", "false", "nao", "não", "off")
+IA_HEDGE_PERCENTIL = float(os.environ.get("IA_HEDGE_PERCENTIL", 95))
+IA_HEDGE_AMOSTRAS = int(os.environ.get("IA_HEDGE_AMOSTRAS", 200))
+IA_HEDGE_MIN_AMOSTRAS = int(os.environ.get("IA_HEDGE_MIN_AMOSTRAS", 10))
+# Sem nenhuma latência observada (processo recém-iniciado), o reserva dispara depois deste
+# atraso: uma fração do timeout de leitura, que é o que a chamada esperaria sem hedge
+IA_HEDGE_ATRASO_PADRAO = float(os.environ.get("IA_HEDGE_ATRASO_PADRAO", clientes_http.TIMEOUTS_LEITURA["openrouter"] / 6))
+IA_HEDGE_ATRASO_MIN = float(os.environ.get("IA_HEDGE_ATRASO_MIN", 3))
+# Folga sobre a maior latência vista enquanto ainda não há amostras para o percentil
+IA_HEDGE_FOLGA_FRIO = float(os.environ.get("IA_HEDGE_FOLGA_FRIO", 1.5))
+
+
+class ChamadaAbortada(Exception):
+    """Levantada de dentro de um ao_receber para encerrar a corrida inteira (ex.: tarefa cancelada)."""
+    pass
+
+
+class LatenciasIA:
+    """Janela das últimas latências de sucesso por (tipo de chamada, modelo)."""
+
+    def __init__(self, amostras=IA_HEDGE_AMOSTRAS):
+        self.amostras = amostras
+        self.janelas = {}
+
+    def registrar(self, tipo, nome_modelo, segundos):
+        janela = self.janelas.get((tipo, nome_modelo))
+        if janela is None:
+            janela = self.janelas[(tipo, nome_modelo)] = deque(maxlen=self.amostras)
+        janela.append(segundos)
+
+    def percentil(self, tipo, nome_modelo, p):
+        valores = sorted(self.janelas.get((tipo, nome_modelo)) or [])
+        if len(valores) < IA_HEDGE_MIN_AMOSTRAS:
+            return None
+        k = (len(valores) - 1) * p / 100
+        baixo, alto = int(k), min(int(k) + 1, len(valores) - 1)
+        return valores[baixo] + (valores[alto] - valores[baixo]) * (k - baixo)
+
+    def atraso_hedge(self, tipo, nome_modelo):
+        atraso = self.percentil(tipo, nome_modelo, IA_HEDGE_PERCENTIL)
+        if atraso is None:
+            atraso = self.atraso_frio(tipo, nome_modelo)
+        if atraso is None:
+            return IA_HEDGE_ATRASO_PADRAO
+        return max(IA_HEDGE_ATRASO_MIN, atraso)
+
+    def atraso_frio(self, tipo, nome_modelo):
+        """
+        Poucas amostras para o percentil: a maior latência já vista do modelo neste tipo
+        (ou, sem nenhuma, de qualquer modelo no mesmo tipo), com folga. None sem histórico
+        nenhum do tipo (aí vale o IA_HEDGE_ATRASO_PADRAO).
+        """
+        vistas = list(self.janelas.get((tipo, nome_modelo)) or [])
+        if not vistas:
+            vistas = [s for (t, _), janela in list(self.janelas.items()) if t == tipo for s in janela]
+        return max(vistas) * IA_HEDGE_FOLGA_FRIO if vistas else None
+
+    def estatisticas(self):
+        return {
+            f"{tipo}:{modelo}": {
+                "amostras": len(janela),
+                "p50": round(self.percentil(tipo, modelo, 50) or 0.0, 2),
+                "atraso_hedge": round(self.atraso_hedge(tipo, modelo), 2)
+            }
+            for (tipo, modelo), janela in list(self.janelas.items())
+        }
+
+
+LATENCIAS_IA = LatenciasIA()
+
+
+def estimar_custo_interrompido(nome_modelo, prompt, texto_parcial):
+    # Sem o usage do provedor: estimativa de ~4 caracteres por token do que já foi enviado e recebido
+    return calcular_custo_api(nome_modelo.replace("openrouter/", ""), len(prompt) // 4, len(texto_parcial) // 4)
+
+
+async def chamar_ia_com_hedge(prompt, fila_modelos, tipo, chave_google=None, chave_openrouter=None, validar=None, ao_receber=None, gastos=None):
+    """
+    Tenta os modelos da fila como antes, mas sem esperar o timeout do primeiro: se ele
+    não responder dentro do percentil configurado das suas latências, o próximo modelo
+    dispara em paralelo. A primeira resposta que passar em 'validar(modelo, texto)'
+    vence e as demais são canceladas. Uma falha antes do atraso chama o reserva na hora.
+
+    'ao_receber(modelo)' devolve o callback de streaming de cada tentativa (ou None);
+    sem callback a tentativa usa a chamada comum, sem streaming.
+    Toda tentativa que consumiu tokens deixa (modelo, custo) em 'gastos', inclusive a
+    perdedora cancelada (custo estimado, marcada com ' (hedge)'; sem streaming só o
+    prompt entra na estimativa).
+    Devolve (modelo, resultado_de_validar, custo).
+    """
+    gastos = gastos if gastos is not None else []
+    fila = list(fila_modelos)
+    tarefas = {}
+    erros = []
+
+    async def tentar(modelo):
+        partes = []
+        callback = ao_receber(modelo) if ao_receber else None
+
+        async def receber(pedaco):
+            partes.append(pedaco)
+            await avisar_pedaco(callback, pedaco)
+
+        inicio = time.monotonic()
+        try:
+            texto, custo = await chamar_ia_async(prompt, modelo, chave_google, chave_openrouter, ao_receber=receber if callback is not None else None)
+        except asyncio.CancelledError:
+            gastos.append((f"{modelo} (hedge)", estimar_custo_interrompido(modelo, prompt, "".join(partes))))
+            raise
+        LATENCIAS_IA.registrar(tipo, modelo, time.monotonic() - inicio)
+        gastos.append((modelo, custo))
+        if validar is None:
+            return texto, custo
+        try:
+            resultado = validar(modelo, texto)
+        except Exception:
+            ROTEADOR.registrar_validacao(modelo, False)
+            raise
+        ROTEADOR.registrar_validacao(modelo, True)
+        return resultado, custo
+
+    def disparar():
+        modelo = fila.pop(0)
+        tarefas[asyncio.ensure_future(tentar(modelo))] = modelo
+        return modelo
+
+    try:
+        ultimo_disparado = disparar()
+        while tarefas:
+            atraso = LATENCIAS_IA.atraso_hedge(tipo, ultimo_disparado) if (IA_HEDGE_ATIVO and fila) else None
+            prontas, _ = await asyncio.wait(tarefas, timeout=atraso, return_when=asyncio.FIRST_COMPLETED)
+
+            if not prontas:
+                ultimo_disparado = disparar()
+                continue
+
+            for tarefa in prontas:
+                modelo = tarefas.pop(tarefa)
+                try:
+                    resultado, custo = tarefa.result()
+                except ChamadaAbortada:
+                    raise
+                except Exception as e:
+                    erros.append(str(e))
+                    continue
+                return modelo, resultado, custo
+
+            if not tarefas and fila:
+                ultimo_disparado = disparar()
+    finally:
+        # Vencedor encontrado, abortado ou erro: nenhuma perdedora continua consumindo tokens
+        for tarefa in tarefas:
+            tarefa.cancel()
+        if tarefas:
+            await asyncio.gather(*tarefas, return_exceptions=True)
+
+    raise Exception(erros[-1] if erros else "Nenhum modelo disponível na fila.")
+
+# =========================================================
+# CACHE DE RESPOSTAS DA IA (CHAMADAS UTILITÁRIAS REPETIDAS)
+# =========================================================
+IA_CACHE_TTL = int(os.environ.get("IA_CACHE_TTL", 7 * 24 * 3600))
+IA_CACHE_MAX_ITENS = int(os.environ.get("IA_CACHE_MAX_ITENS", 2000))
+IA_CACHE_MAX_BYTES = int(os.environ.get("IA_CACHE_MAX_MB", 32)) * 1024 * 1024
+# Só os tipos listados usam o cache; cada rota escolhe o seu tipo ao chamar
+IA_CACHE_TIPOS = {t.strip() for t in os.environ.get("IA_CACHE_TIPOS", "analise_trecho,cliches,fatiar_prova").split(",") if t.strip()}
+
+
+ESPACOS_NA_LINHA = re.compile(r"[^\S\n]+")
+
+
+def normalizar_prompt(prompt):
+    # Espaços a mais (autosave, colar de novo) não mudam a chave; quebras de linha sim,
+    # porque tipos como 'cliches' devolvem o texto inteiro com os parágrafos do pedido
+    texto = unicodedata.normalize("NFC", prompt).replace("\r\n", "\n")
+    return ESPACOS_NA_LINHA.sub(" ", texto).strip()
+
+
+def chave_cache_ia(tipo, nome_modelo, prompt):
+    return hashlib.sha256(f"{tipo}\x00{nome_modelo}\x00{normalizar_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+
+class CacheLocalIA:
+    """LRU em memória com TTL, limitado por quantidade e por bytes de texto."""
+
+    def __init__(self, ttl=IA_CACHE_TTL, max_itens=IA_CACHE_MAX_ITENS, max_bytes=IA_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.max_bytes = max_bytes
+        self.itens = OrderedDict()
+        self.total_bytes = 0
+        self.trava = threading.Lock()
+
+    def obter(self, chave):
+        with self.trava:
+            item = self.itens.get(chave)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                self.remover(chave)
+                return None
+            self.itens.move_to_end(chave)
+            return item[1], item[2]
+
+    def guardar(self, chave, texto, custo, expira_em=None):
+        tamanho = len(texto.encode("utf-8"))
+        if tamanho > self.max_bytes:
+            return
+        with self.trava:
+            self.remover(chave)
+            self.itens[chave] = (expira_em or time.time() + self.ttl, texto, custo, tamanho)
+            self.total_bytes += tamanho
+            while len(self.itens) > self.max_itens or self.total_bytes > self.max_bytes:
+                self.remover(next(iter(self.itens)))
+
+    def remover(self, chave):
+        item = self.itens.pop(chave, None)
+        if item is not None:
+            self.total_bytes -= item[3]
+
+
+class CacheCompartilhadoIA:
+    """
+    Camada em SQL (SQLite ou Postgres) para vários workers verem as mesmas respostas.
+    Usa uma engine própria do SQLAlchemy para não depender do contexto do Flask.
+    """
+
+    def __init__(self, url, ttl=IA_CACHE_TTL, max_itens=IA_CACHE_MAX_ITENS * 10):
+        import sqlalchemy as sa
+
+        self.sa = sa
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.gravacoes = 0
+        self.engine = sa.create_engine(url, pool_pre_ping=True)
+        metadata = sa.MetaData()
+        self.tabela = sa.Table(
+            "cache_resposta_ia", metadata,
+            sa.Column("chave", sa.String(64), primary_key=True),
+            sa.Column("tipo", sa.String(40)),
+            sa.Column("modelo", sa.String(100)),
+            sa.Column("resposta", sa.Text, nullable=False),
+            sa.Column("custo", sa.Float, default=0.0),
+            sa.Column("expira_em", sa.Float, index=True),
+            sa.Column("usado_em", sa.Float, index=True)
+        )
+        metadata.create_all(self.engine)
+
+    def obter(self, chave):
+        t = self.tabela
+        agora = time.time()
+        with self.engine.begin() as conexao:
+            linha = conexao.execute(self.sa.select(t.c.resposta, t.c.custo, t.c.expira_em).where(t.c.chave == chave, t.c.expira_em > agora)).first()
+            if linha is None:
+                return None
+            conexao.execute(t.update().where(t.c.chave == chave).values(usado_em=agora))
+            return linha.resposta, linha.custo, linha.expira_em
+
+    def guardar(self, chave, tipo, nome_modelo, texto, custo):
+        t = self.tabela
+        agora = time.time()
+        valores = dict(tipo=tipo, modelo=nome_modelo, resposta=texto, custo=custo, expira_em=agora + self.ttl, usado_em=agora)
+        with self.engine.begin() as conexao:
+            if conexao.execute(t.update().where(t.c.chave == chave).values(**valores)).rowcount == 0:
+                try:
+                    with conexao.begin_nested():
+                        conexao.execute(t.insert().values(chave=chave, **valores))
+                except self.sa.exc.IntegrityError:
+                    pass
+
+        self.gravacoes += 1
+        if self.gravacoes % 100 == 1:
+            self.podar()
+
+    def podar(self):
+        # Expirados saem sempre; acima do limite saem os menos usados
+        t = self.tabela
+        with self.engine.begin() as conexao:
+            conexao.execute(t.delete().where(t.c.expira_em <= time.time()))
+            excesso = conexao.execute(self.sa.select(self.sa.func.count()).select_from(t)).scalar() - self.max_itens
+            if excesso > 0:
+                antigos = self.sa.select(t.c.chave).order_by(t.c.usado_em).limit(excesso).scalar_subquery()
+                conexao.execute(t.delete().where(t.c.chave.in_(antigos)))
+
+
+class CacheRespostasIA:
+    def __init__(self):
+        self.local = CacheLocalIA()
+        self.compartilhado = None
+        self.acertos = 0
+        self.falhas = 0
+        # obter roda em threads do asyncio.to_thread: os contadores precisam de trava
+        self.trava = threading.Lock()
+
+    def configurar_compartilhado(self, url):
+        try:
+            self.compartilhado = CacheCompartilhadoIA(url)
+        except Exception as e:
+            logging.error(f"Cache compartilhado de IA indisponível: {e}")
+
+    def obter(self, chave):
+        achado = self.local.obter(chave)
+        if achado is None and self.compartilhado is not None:
+            try:
+                linha = self.compartilhado.obter(chave)
+            except Exception as e:
+                logging.error(f"Falha ao ler o cache compartilhado de IA: {e}")
+                linha = None
+            if linha is not None:
+                self.local.guardar(chave, linha[0], linha[1], linha[2])
+                achado = linha[0], linha[1]
+
+        with self.trava:
+            if achado is None:
+                self.falhas += 1
+            else:
+                self.acertos += 1
+        return achado
+
+    def guardar(self, chave, tipo, nome_modelo, texto, custo):
+        self.local.guardar(chave, texto, custo)
+        if self.compartilhado is not None:
+            try:
+                self.compartilhado.guardar(chave, tipo, nome_modelo, texto, custo)
+            except Exception as e:
+                logging.error(f"Falha ao gravar no cache compartilhado de IA: {e}")
+
+    def estatisticas(self):
+        with self.trava:
+            acertos, falhas = self.acertos, self.falhas
+        consultas = acertos + falhas
+        return {
+            "acertos": acertos,
+            "falhas": falhas,
+            "taxa_acerto": round(acertos / consultas, 3) if consultas else 0.0,
+            "itens_em_memoria": len(self.local.itens),
+            "bytes_em_memoria": self.local.total_bytes,
+            "compartilhado": self.compartilhado is not None
+        }
+
+
+CACHE_IA = CacheRespostasIA()
+
+
+async def chamar_ia_com_cache_async(prompt, nome_modelo, tipo, chave_google=None, chave_openrouter=None):
+    """
+    Igual ao chamar_ia_async para os tipos com cache ligado. Devolve (texto, custo, custo_evitado):
+    num acerto o custo é zero e custo_evitado traz o custo da chamada original; numa falha, custo_evitado é None.
+    """
+    if tipo not in IA_CACHE_TIPOS:
+        texto, custo = await chamar_ia_async(prompt, nome_modelo, chave_google, chave_openrouter)
+        return texto, custo, None
+
+    # O nível compartilhado fala com o banco de forma síncrona: fora do event loop
+    chave = chave_cache_ia(tipo, nome_modelo, prompt)
+    achado = await asyncio.to_thread(CACHE_IA.obter, chave)
+    if achado is not None:
+        return achado[0], 0.0, achado[1]
+
+    texto, custo = await chamar_ia_async(prompt, nome_modelo, chave_google, chave_openrouter)
+    if texto and texto.strip():
+        await asyncio.to_thread(CACHE_IA.guardar, chave, tipo, nome_modelo, texto, custo)
+    return texto, custo, None
+
+
+def chamar_ia_com_cache(prompt, nome_modelo, tipo, chave_google=None, chave_openrouter=None):
+    return GATEWAY.executar(chamar_ia_com_cache_async(prompt, nome_modelo, tipo, chave_google, chave_openrouter))
+
+
+async def chamar_ia_em_paralelo(prompts, nome_modelo, tipo, chave_google=None, chave_openrouter=None):
+    """
+    Várias chamadas independentes de uma vez, cada uma com o seu cache. Os limites do
+    gateway continuam valendo. Devolve {chave: (texto, custo, custo_evitado) ou a exceção}.
+    """
+    chaves = list(prompts)
+    resultados = await asyncio.gather(
+        *(chamar_ia_com_cache_async(prompts[c], nome_modelo, tipo, chave_google, chave_openrouter) for c in chaves),
+        return_exceptions=True
+    )
+    return dict(zip(chaves, resultados))
+
+CHAVES_DICIONARIO = [
+    "ASPECTO_1", "POR_QUE_1", "ASPECTO_2", "POR_QUE_2", "ASPECTO_3", "POR_QUE_3", 
+    "CONCEITOS_TEORICOS", "ANALISE_CONCEITO_1", "ENTENDIMENTO_TEORICO", "SOLUCOES_TEORICAS", 
+    "RESUMO_MEMORIAL", "CONTEXTO_MEMORIAL", "ANALISE_MEMORIAL", "PROPOSTAS_MEMORIAL", 
+    "CONCLUSAO_MEMORIAL", "REFERENCIAS_ADICIONAIS", "AUTOAVALIACAO_MEMORIAL"
+]
+
+# Marcador completo ([START_X], [END_X], também com "/" como [/END_X]) ou um "[START_" solto,
+# que o extrair_dicionario antigo já tratava como fim da seção aberta
+MARCADOR_SECAO = re.compile(r"\[(?:(/?)(START|END)_([A-Za-z0-9_]{1,60})\]|START_)", re.IGNORECASE)
+# Maior marcador possível: "[/START_" + 60 + "]". Menos que isso no fim do pedaço pode ser um marcador pela metade
+TAMANHO_MAX_MARCADOR = 69
+
+
+def limpar_secao(trecho):
+    trecho = trecho.strip()
+    while trecho.startswith('**') and trecho.endswith('**') and len(trecho) > 4: trecho = trecho[2:-2].strip()
+    return trecho
+
+
+class LeitorSecoesIA:
+    """
+    Tokenizador de uma passada só para os marcadores [START_X]/[END_X], inteiro ou em
+    pedaços (streaming). Cada caractere é examinado uma vez: só o conteúdo da seção
+    aberta e uma cauda do tamanho de um marcador ficam guardados.
+
+    Regras (as mesmas do antigo extrair_dicionario): a seção fecha no seu [END_X] ou no
+    próximo [START_, mesmo incompleto; sem [END_X] vai até o fim; um [END_] de outra
+    chave ou com barra ([/END_X]) faz parte do conteúdo; chave repetida vale a primeira
+    ocorrência. Com limpar=True cada seção passa
+    pelo limpar_texto_ia (o streaming recebe o texto cru do provedor).
+    """
+
+    def __init__(self, limpar=True):
+        self.limpar = limpar
+        self.cauda = ""
+        self.aberta = None
+        self.partes = []
+        self.secoes = {}
+
+    def alimentar(self, pedaco):
+        """Devolve {"{{CHAVE}}": texto} com as seções que terminaram neste pedaço."""
+        janela = self.cauda + pedaco
+        # Um "[" perto do fim pode ser o começo de um marcador que ainda não chegou inteiro
+        colchete = janela.rfind("[", max(0, len(janela) - TAMANHO_MAX_MARCADOR))
+        corte = colchete if colchete != -1 and "]" not in janela[colchete:] else len(janela)
+        self.cauda = janela[corte:]
+        return self.ler(janela, corte)
+
+    def finalizar(self):
+        janela, self.cauda = self.cauda, ""
+        novas = self.ler(janela, len(janela))
+        if self.aberta:
+            self.fechar(novas)
+        return novas
+
+    def ler(self, janela, corte):
+        novas = {}
+        inicio = 0
+        for m in MARCADOR_SECAO.finditer(janela, 0, corte):
+            barra, tipo, chave = m.group(1), (m.group(2) or "START").upper(), (m.group(3) or "").upper()
+            self.guardar(janela[inicio:m.start()])
+            if barra:
+                self.guardar(m.group(0))
+            elif self.aberta and (tipo == "START" or chave == self.aberta):
+                self.fechar(novas)
+            elif tipo == "END":
+                self.guardar(m.group(0))
+            if tipo == "START" and chave and not barra:
+                self.aberta = chave
+            inicio = m.end()
+        self.guardar(janela[inicio:corte])
+        return novas
+
+    def guardar(self, texto):
+        if self.aberta and texto:
+            self.partes.append(texto)
+
+    def fechar(self, novas):
+        marcador = f"{{{{{self.aberta}}}}}"
+        conteudo = "".join(self.partes)
+        self.aberta = None
+        self.partes = []
+        if marcador in self.secoes:
+            return
+        trecho = limpar_secao(limpar_texto_ia(conteudo) if self.limpar else conteudo)
+        self.secoes[marcador] = trecho
+        novas[marcador] = trecho
+
+
+def ler_secoes(texto_ia):
+    leitor = LeitorSecoesIA(limpar=False)
+    leitor.alimentar(texto_ia)
+    leitor.finalizar()
+    return leitor.secoes
+
 
 def extrair_dicionario(texto_ia):
-    chaves = [
-        "ASPECTO_1", "POR_QUE_1", "ASPECTO_2", "POR_QUE_2", "ASPECTO_3", "POR_QUE_3", 
-        "CONCEITOS_TEORICOS", "ANALISE_CONCEITO_1", "ENTENDIMENTO_TEORICO", "SOLUCOES_TEORICAS", 
-        "RESUMO_MEMORIAL", "CONTEXTO_MEMORIAL", "ANALISE_MEMORIAL", "PROPOSTAS_MEMORIAL", 
-        "CONCLUSAO_MEMORIAL", "REFERENCIAS_ADICIONAIS", "AUTOAVALIACAO_MEMORIAL"
-    ]
-    dic = {}
-    for chave in chaves:
-        match = re.search(rf"\[START_{chave}\](.*?)(?=\[END_{chave}\]|\[START_|$)", texto_ia, re.DOTALL | re.IGNORECASE)
-        if match:
-            trecho = match.group(1).strip()
-            while trecho.startswith('**') and trecho.endswith('**') and len(trecho) > 4: trecho = trecho[2:-2].strip()
-            dic[f"{{{{{chave}}}}}"] = trecho
-        else: 
-            dic[f"{{{{{chave}}}}}"] = "" 
-    return dic
+    secoes = ler_secoes(texto_ia)
+    return {f"{{{{{chave}}}}}": secoes.get(f"{{{{{chave}}}}}", "") for chave in CHAVES_DICIONARIO}
+
+
+def extrair_trecho(texto_ia, chave):
+    """
+    Resposta de uma seção só (regerar_trecho): o texto inteiro sem os marcadores dessa
+    chave, com ou sem barra ([START_X], [/END_X]...). O texto fora dos marcadores fica.
+    """
+    marcadores = re.compile(rf"\[/?(?:START|END)_{re.escape(chave)}\]", re.IGNORECASE)
+    return marcadores.sub("", texto_ia).strip('* ')
 
 def extrair_json_seguro(texto):
     try:
@@ -107,7 +975,7 @@ def consultar_saldo_openrouter(chave_openrouter):
     try:
         if not chave_openrouter: return 0.0
         headers = {"Authorization": f"Bearer {chave_openrouter}"}
-        res = requests.get("https://openrouter.ai/api/v1/credits", headers=headers, timeout=10)
+        res = clientes_http.obter_sessao("openrouter").get("https://openrouter.ai/api/v1/credits", headers=headers, timeout=clientes_http.timeout("openrouter_saldo"))
         if res.status_code == 200:
             dados = res.json().get("data", {})
             return max((float(dados.get("total_credits", 0.0)) - float(dados.get("total_usage", 0.0))), 0.0)
@@ -153,7 +1021,7 @@ def fatiar_prova(texto_prova):
     return questoes
 
 def fatiar_prova_com_ia(texto_prova, chave_google, chave_openrouter):
-    """PADRÃO OURO: O modelo Gemini organiza provas ilegíveis antes da lógica principal."""
+    """PADRÃO OURO: O modelo Gemini organiza provas ilegíveis antes da lógica principal. Devolve (questões, custo, custo_evitado)."""
     prompt = f"""Sua única função é ler o texto bruto de uma prova caótica e convertê-lo para um Array JSON puro.
 Ignore introduções, rodapés e textos irrelevantes.
 Se as alternativas não tiverem letras (A, B, C), atribua automaticamente na ordem.
@@ -169,7 +1037,7 @@ ESTRUTURA EXATA OBRIGATÓRIA (SÓ RETORNE O ARRAY JSON):
 TEXTO BRUTO DA PROVA:
 {texto_prova}"""
     
-    resposta, custo = chamar_ia(prompt, "google/gemini-2.5-flash", chave_google, chave_openrouter)
+    resposta, custo, custo_evitado = chamar_ia_com_cache(prompt, "google/gemini-2.5-flash", "fatiar_prova", chave_google, chave_openrouter)
     dados_json = extrair_json_seguro(resposta)
     
     questoes_limpas = []
@@ -183,7 +1051,7 @@ TEXTO BRUTO DA PROVA:
         except:
             pass
             
-    return questoes_limpas, custo
+    return questoes_limpas, custo, custo_evitado
 
 def gerar_hash_enunciado(enunciado):
     limpo = re.sub(r'[\W_0-9]+', '', str(enunciado).lower().strip())
@@ -0,0 +1,131 @@
+"""
+VERIFICAÇÃO DO LEITOR DE SEÇÕES DA IA
+
+Compara o leitor de marcadores [START_X]/[END_X] do ia_core com as regexes que ele
+substituiu (o extrair_dicionario de uma busca por chave e o limpar_trecho do
+regerar_trecho), em respostas malformadas fixas e em respostas sorteadas, inteiras
+e em pedaços (streaming). Qualquer diferença sai na tela e o código de saída é 1.
+
+Uso:
+    python verificar_secoes.py
+    python verificar_secoes.py --casos 20000 --semente 7
+"""
+import re
+import sys
+import random
+import argparse
+
+import ia_core
+
+CHAVES = ia_core.CHAVES_DICIONARIO
+
+
+# =========================================================
+# IMPLEMENTAÇÕES ANTIGAS (REFERÊNCIA)
+# =========================================================
+def extrair_dicionario_antigo(texto_ia):
+    dic = {}
+    for chave in CHAVES:
+        match = re.search(rf"\[START_{chave}\](.*?)(?=\[END_{chave}\]|\[START_|$)", texto_ia, re.DOTALL | re.IGNORECASE)
+        if match:
+            trecho = match.group(1).strip()
+            while trecho.startswith('**') and trecho.endswith('**') and len(trecho) > 4: trecho = trecho[2:-2].strip()
+            dic[f"{{{{{chave}}}}}"] = trecho
+        else:
+            dic[f"{{{{{chave}}}}}"] = ""
+    return dic
+
+
+def extrair_trecho_antigo(texto_ia, tag):
+    texto_ia = re.sub(rf"\[/?START_{tag}\]", "", texto_ia, flags=re.IGNORECASE)
+    return re.sub(rf"\[/?END_{tag}\]", "", texto_ia, flags=re.IGNORECASE).strip('* ')
+
+
+def extrair_dicionario_streaming(texto_ia, sorteio):
+    leitor = ia_core.LeitorSecoesIA(limpar=False)
+    posicao = 0
+    while posicao < len(texto_ia):
+        passo = sorteio.randint(1, 12)
+        leitor.alimentar(texto_ia[posicao:posicao + passo])
+        posicao += passo
+    leitor.finalizar()
+    return {f"{{{{{chave}}}}}": leitor.secoes.get(f"{{{{{chave}}}}}", "") for chave in CHAVES}
+
+
+# =========================================================
+# CASOS
+# =========================================================
+CASOS_FIXOS = [
+    "[START_RESUMO_MEMORIAL]\nTexto normal.\n[END_RESUMO_MEMORIAL]",
+    "Novo texto [/END_RESUMO_MEMORIAL]",
+    "[/START_RESUMO_MEMORIAL] Novo texto [/END_RESUMO_MEMORIAL]",
+    "[START_RESUMO_MEMORIAL] Novo texto [END_RESUMO_MEMORIAL] e o que sobrou depois",
+    "Antes [START_RESUMO_MEMORIAL] durante [END_RESUMO_MEMORIAL] depois",
+    "[START_RESUMO_MEMORIAL] sem fim",
+    "[START_RESUMO_MEMORIAL] fecha no solto [START_ e segue [START_ASPECTO_1] a1",
+    "[START_RESUMO_MEMORIAL] fecha no [START_ nada e mais nada",
+    "[START_ASPECTO_1] a [END_ASPECTO_2] b [END_ASPECTO_1]",
+    "[start_aspecto_1] minúsculas [end_aspecto_1]",
+    "[START_ASPECTO_1] **negrito** [END_ASPECTO_1]",
+    "[START_ASPECTO_1] ****duplo**** [END_ASPECTO_1]",
+    "[START_ASPECTO_1] primeiro [END_ASPECTO_1] [START_ASPECTO_1] segundo [END_ASPECTO_1]",
+    "[END_ASPECTO_1] antes [START_ASPECTO_1] depois",
+    "[START_ASPECTO_1] barra no meio [/START_ASPECTO_2] continua [END_ASPECTO_1]",
+    "[START_ASPECTO_1] chave longa [START_" + "X" * 70 + "] fecha",
+    "[START_[START_ASPECTO_1] colchete quebrado",
+    "[START_ASPECTO_1] [START_ASPECTO_1 sem fechar colchete",
+    "[START_ASPECTO_1]\n\n[END_ASPECTO_1]\n",
+    "",
+]
+
+PEDACOS = [
+    "[START_{}]", "[END_{}]", "[/START_{}]", "[/END_{}]", "[start_{}]", "[START_{}", "[START_", "[END_", "[/",
+    "[", "]", "**", "* ", "\n", " texto ", "Frase com [colchetes] no meio. ", "ção ", "x" * 80
+]
+
+
+def sortear_caso(sorteio):
+    partes = []
+    for _ in range(sorteio.randint(1, 14)):
+        modelo = sorteio.choice(PEDACOS)
+        chave = sorteio.choice(CHAVES[:4] + ["OUTRA_CHAVE"])
+        partes.append(modelo.format(chave) if "{}" in modelo else modelo)
+    return "".join(partes)
+
+
+# =========================================================
+# EXECUÇÃO
+# =========================================================
+def comparar_caso(texto, sorteio):
+    diferencas = []
+    antigo = extrair_dicionario_antigo(texto)
+    if ia_core.extrair_dicionario(texto) != antigo:
+        diferencas.append("extrair_dicionario")
+    if extrair_dicionario_streaming(texto, sorteio) != antigo:
+        diferencas.append("streaming")
+    for chave in CHAVES[:4]:
+        if ia_core.extrair_trecho(texto, chave) != extrair_trecho_antigo(texto, chave):
+            diferencas.append(f"extrair_trecho {chave}")
+    return diferencas
+
+
+def executar(casos, semente):
+    sorteio = random.Random(semente)
+    textos = CASOS_FIXOS + [sortear_caso(sorteio) for _ in range(casos)]
+    falhas = 0
+    for texto in textos:
+        diferencas = comparar_caso(texto, sorteio)
+        if diferencas:
+            falhas += 1
+            if falhas <= 20:
+                print(f"DIFERENTE ({', '.join(diferencas)}): {texto!r}")
+    print(f"{len(textos)} casos, {falhas} com diferença")
+    return falhas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara o leitor de seções com as regexes antigas.")
+    parser.add_argument("--casos", type=int, default=5000, help="Respostas sorteadas além dos casos fixos")
+    parser.add_argument("--semente", type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(1 if executar(args.casos, args.semente) else 0)